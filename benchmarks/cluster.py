@@ -0,0 +1,345 @@
+"""Benchmark a local cluster of hosts and consumers through the stand-in stream server.
+
+N hosts connect to a local :class:`hulse.server.StreamServer` and M consumer
+threads replay a workload of queries, mixing tasks, payload sizes and
+duplicate queries. Models are either fake pipelines, whose latency grows with
+the size of their input, or tiny models from the Hugging Face hub.
+
+Throughput, p50/p95/p99 latency of each task, the mean time spent in each
+stage of a query (see hulse.tracing) and the memory of the process are
+reported. With --baseline, the run fails when its throughput or p95 latency
+regressed by more than --tolerance compared to a previous --output report.
+
+Usage: python benchmarks/cluster.py [--hosts N] [--consumers M] [--queries Q]
+    [--mix TASK=WEIGHT,...] [--payload-sizes CHARS,...] [--duplicate-rate RATE]
+    [--model fake|tiny] [--output FILE] [--baseline FILE]
+"""
+
+import argparse
+import json
+import random
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from hulse import cache, producer, settings, tracing, utils
+from hulse.client import Hulse
+from hulse.server import StreamServer
+
+WORDS = "the model host query result cluster stream text summary of a and to".split()
+
+# tiny models of the hub, for runs going through real pipelines
+TINY_MODELS = {
+    "sentiment-analysis": "sshleifer/tiny-distilbert-base-uncased-finetuned-sst-2-english",
+    "text-classification": "sshleifer/tiny-distilbert-base-uncased-finetuned-sst-2-english",
+    "summarization": "sshleifer/bart-tiny-random",
+    "text-generation": "sshleifer/tiny-gpt2",
+}
+
+
+class FakePipeline:
+    """Pipeline sleeping for a fixed time plus a time per input character."""
+
+    def __init__(self, task: str, base: float, per_char: float):
+        self.task = task
+        self.base = base
+        self.per_char = per_char
+
+    def output(self, text: str):
+        if self.task in ("sentiment-analysis", "text-classification"):
+            return [{"label": "POSITIVE", "score": 0.99}]
+        if self.task == "summarization":
+            return [{"summary_text": text[:100]}]
+        if self.task == "translation":
+            return [{"translation_text": text[::-1]}]
+        return [{"generated_text": text[:100]}]
+
+    def __call__(self, data, **kwargs):
+        texts = data if isinstance(data, list) else [data]
+        time.sleep(self.base + self.per_char * sum(len(text) for text in texts))
+        outputs = [self.output(text) for text in texts]
+        return outputs if isinstance(data, list) else outputs[0]
+
+
+def make_loader(model: str, base: float, per_char: float):
+    if model == "fake":
+        return lambda task, **kwargs: FakePipeline(task, base, per_char)
+    return lambda task, model=None, **kwargs: cache.load_pipeline(
+        task=task, model=TINY_MODELS[task], **kwargs
+    )
+
+
+def make_text(rng: random.Random, size: int) -> str:
+    words = []
+    while sum(map(len, words)) + len(words) < size:
+        words.append(rng.choice(WORDS))
+    return " ".join(words)[:size]
+
+
+def make_workload(args) -> list:
+    """Queries of the run, as (task, data) pairs, identical for the same seed."""
+    rng = random.Random(args.seed)
+    tasks, weights = zip(*args.mix.items())
+    queries = []
+    for i in range(args.queries):
+        if queries and rng.random() < args.duplicate_rate:
+            queries.append(rng.choice(queries))
+            continue
+        # a unique prefix, so that only duplicates hit the result caches
+        text = f"{i} " + make_text(rng, rng.choice(args.payload_sizes))
+        queries.append((rng.choices(tasks, weights)[0], text))
+    return queries
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def run(args) -> dict:
+    workload = make_workload(args)
+    latencies = {task: [] for task in args.mix}
+    stages = {}
+    failures = []
+    lock = threading.Lock()
+    rss_before = utils.get_rss()
+
+    with StreamServer(keep_alive=1) as server:
+        settings.HULSE_STREAM_URL = server.url
+        hosts = [
+            producer.Host(
+                "benchmark",
+                workers=args.workers,
+                batch_size=args.batch_size,
+                result_cache_size=args.result_cache_size,
+                status_interval=0,
+                encoding=args.encoding,
+                pipeline_cache=cache.PipelineCache(
+                    loader=make_loader(
+                        args.model, args.base_ms / 1e3, args.per_char_us / 1e6
+                    )
+                ),
+            )
+            for _ in range(args.hosts)
+        ]
+        threads = [threading.Thread(target=host.run, daemon=True) for host in hosts]
+        for thread in threads:
+            thread.start()
+        while len(server.producers) < args.hosts:
+            time.sleep(0.01)
+
+        client = Hulse("benchmark", encoding=args.encoding)
+        # load the pipelines of every task on every host before measuring
+        for task in args.mix:
+            for _ in range(args.hosts):
+                client.query(f"warm-up {task}", task=task, timeout=args.timeout)
+
+        def send(query):
+            task, data = query
+            start = time.perf_counter()
+            try:
+                answer = client.query(data, task=task, timeout=args.timeout)
+            except Exception as e:
+                with lock:
+                    failures.append(repr(e))
+                return
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies[task].append(elapsed)
+                for stage, seconds in tracing.breakdown(answer["trace"]).items():
+                    stages[stage] = stages.get(stage, 0.0) + seconds
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.consumers) as executor:
+            list(executor.map(send, workload))
+        elapsed = time.perf_counter() - start
+
+        for host in hosts:
+            host.stop()
+        for thread in threads:
+            thread.join(timeout=5)
+        client.close()
+
+    answered = sum(len(values) for values in latencies.values())
+    every = [value for values in latencies.values() for value in values]
+    return dict(
+        config=dict(
+            hosts=args.hosts,
+            consumers=args.consumers,
+            queries=args.queries,
+            mix=args.mix,
+            payload_sizes=args.payload_sizes,
+            duplicate_rate=args.duplicate_rate,
+            model=args.model,
+            encoding=args.encoding,
+        ),
+        elapsed=elapsed,
+        throughput=answered / elapsed,
+        failures=len(failures),
+        latency={
+            name: dict(
+                count=len(values),
+                p50=percentile(values, 0.5),
+                p95=percentile(values, 0.95),
+                p99=percentile(values, 0.99),
+            )
+            for name, values in [("all", every), *latencies.items()]
+        },
+        stages={
+            stage: total / max(answered, 1)
+            for stage, total in sorted(stages.items(), key=lambda item: -item[1])
+        },
+        memory=dict(
+            rss_before=rss_before,
+            rss_after=utils.get_rss(),
+            # kilobytes on Linux
+            peak_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        ),
+    )
+
+
+def print_report(report: dict):
+    print(
+        f"{report['latency']['all']['count']} queries in {report['elapsed']:.2f}s, "
+        f"{report['throughput']:.1f} queries/s, {report['failures']} failed"
+    )
+    print(f"\n{'task':<22}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for task, stats in report["latency"].items():
+        print(
+            f"{task:<22}{stats['count']:>7}{stats['p50'] * 1e3:>8.1f}ms"
+            f"{stats['p95'] * 1e3:>8.1f}ms{stats['p99'] * 1e3:>8.1f}ms"
+        )
+    print(f"\n{'stage':<22}{'mean':>10}")
+    for stage, seconds in report["stages"].items():
+        print(f"{stage:<22}{seconds * 1e3:>8.2f}ms")
+    memory = report["memory"]
+    print(
+        f"\nrss {memory['rss_before'] / 2**20:.0f} MiB -> {memory['rss_after'] / 2**20:.0f} MiB, "
+        f"peak {memory['peak_rss'] / 2**20:.0f} MiB"
+    )
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of the run compared to a baseline report."""
+    regressions = []
+    if report["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append(
+            f"throughput {report['throughput']:.1f}/s < {baseline['throughput']:.1f}/s"
+        )
+    for task, stats in report["latency"].items():
+        previous = baseline["latency"].get(task)
+        if previous and stats["p95"] > previous["p95"] * (1 + tolerance):
+            regressions.append(
+                f"{task} p95 {stats['p95'] * 1e3:.1f}ms > {previous['p95'] * 1e3:.1f}ms"
+            )
+    return regressions
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for item in value.split(","):
+        task, _, weight = item.partition("=")
+        if task not in settings.SUPPORTED_TASKS:
+            raise argparse.ArgumentTypeError(f"unsupported task {task}")
+        mix[task] = float(weight or 1)
+    return mix
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hosts", type=int, default=2, help="Number of hosts")
+    parser.add_argument(
+        "--consumers", type=int, default=8, help="Number of concurrent consumers"
+    )
+    parser.add_argument("--queries", type=int, default=500, help="Number of queries")
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=parse_mix(
+            "sentiment-analysis=0.7,summarization=0.2,text-generation=0.1"
+        ),
+        help="Weight of each task, as TASK=WEIGHT,...",
+    )
+    parser.add_argument(
+        "--payload-sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=[50, 500, 5000],
+        help="Sizes of the query texts in characters, picked uniformly",
+    )
+    parser.add_argument(
+        "--duplicate-rate",
+        type=float,
+        default=0.1,
+        help="Fraction of queries repeating a previous query",
+    )
+    parser.add_argument(
+        "--model",
+        choices=["fake", "tiny"],
+        default="fake",
+        help="Fake pipelines or tiny models of the hub",
+    )
+    parser.add_argument(
+        "--base-ms", type=float, default=5, help="Fixed latency of fake pipelines"
+    )
+    parser.add_argument(
+        "--per-char-us",
+        type=float,
+        default=2,
+        help="Latency of fake pipelines per input character",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Inference workers per host"
+    )
+    parser.add_argument("--batch-size", type=int, default=1, help="Host batch size")
+    parser.add_argument(
+        "--result-cache-size",
+        type=int,
+        default=settings.HOST_RESULT_CACHE_SIZE,
+        help="Host result cache size, 0 to disable",
+    )
+    parser.add_argument(
+        "--encoding",
+        choices=settings.WIRE_ENCODINGS,
+        default=None,
+        help="Compact wire format, defaults to the legacy format",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=60, help="Timeout of each query"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the workload")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    parser.add_argument("--baseline", help="JSON report of a previous run")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative regression allowed against the baseline",
+    )
+    args = parser.parse_args()
+    if args.model == "tiny":
+        unsupported = set(args.mix) - set(TINY_MODELS)
+        if unsupported:
+            parser.error(f"no tiny model for {', '.join(sorted(unsupported))}")
+
+    report = run(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if report["failures"]:
+        print(f"{report['failures']} queries failed.")
+        return 1
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
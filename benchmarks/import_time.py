@@ -0,0 +1,90 @@
+"""Benchmark the import time of hulse, failing when it exceeds its budget.
+
+Consumers and light CLI commands should never pay for importing the
+inference (transformers, torch) or login (flask) dependencies.
+
+Usage: python benchmarks/import_time.py [--budget SECONDS] [--runs N]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ["transformers", "torch", "flask", "aiohttp"]
+
+SCENARIOS = {
+    "import hulse": "import hulse",
+    "consumer": "import hulse; hulse.Hulse(api_key='key')",
+    "hulse --help": "from hulse.cli import cli; cli(['--help'])",
+    "hulse tasks": "from hulse.cli import cli; cli(['tasks'])",
+}
+
+
+def measure(code: str, runs: int) -> float:
+    """Median wall time of running the code in a fresh interpreter."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", code],
+            check=False,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def loaded_heavy_modules(code: str) -> list:
+    """Heavy modules imported after running the code in a fresh interpreter."""
+    check = (
+        "import sys\n"
+        "try:\n"
+        f"    exec({code!r})\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        f"heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+        "print('heavy modules:', ','.join(heavy))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", check], capture_output=True, text=True
+    ).stdout
+    line = [line for line in output.splitlines() if line.startswith("heavy modules:")]
+    return [module for module in line[-1].split(":")[1].strip().split(",") if module]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=0.5,
+        help="Maximum import time of each scenario in seconds",
+    )
+    parser.add_argument("--runs", type=int, default=5, help="Runs per scenario")
+    args = parser.parse_args()
+
+    baseline = measure("pass", args.runs)
+    failed = False
+    print(f"{'scenario':<16}{'import time':>14}  heavy modules")
+    for name, code in SCENARIOS.items():
+        elapsed = max(0.0, measure(code, args.runs) - baseline)
+        heavy = loaded_heavy_modules(code)
+        over_budget = elapsed > args.budget
+        failed = failed or over_budget or bool(heavy)
+        print(
+            f"{name:<16}{elapsed * 1000:>11.0f} ms  {', '.join(heavy) or '-'}"
+            + ("  OVER BUDGET" if over_budget else "")
+        )
+
+    if failed:
+        print(
+            f"\nImport time budget of {args.budget}s exceeded or heavy modules loaded."
+        )
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""Benchmark the SSE parser against the line-based process_stream_data.
+
+Both parsers read the same synthetic stream through a requests response, the
+legacy one line by line with iter_lines, the incremental one chunk by chunk
+with iter_content, and decode the JSON data of every event.
+
+The incremental parser also handles multi-line data, event, id and retry
+fields, comments, CR line endings and characters split across chunks, which
+the legacy parser gets wrong. With small events, as by default, it is slightly
+faster, 1.02-1.07x over repeated runs, since JSON decoding dominates: feed()
+costs about as much as iter_lines, and Event.json() calls the JSON scanner
+directly instead of json.loads. Large events (e.g. --events 300 --payload
+100000) are parsed about 20x faster, since iter_lines rescans their lines on
+every read while feed() joins the chunks of a line once complete.
+
+Usage: python benchmarks/sse_parser.py [--events N] [--payload BYTES] [--chunk-size BYTES]
+"""
+
+import argparse
+import gc
+import io
+import json
+import sys
+import time
+
+import requests
+
+from hulse import sse, utils
+
+
+def make_stream(events: int, payload: int) -> bytes:
+    """Synthetic producer stream, with an id per event and regular heartbeats."""
+    blocks = []
+    for i in range(events):
+        query = {
+            "qid": f"{i:032x}",
+            "task": "sentiment-analysis",
+            "model": None,
+            "data": "x" * payload,
+            "timeout": 30.0 + i,
+        }
+        blocks.append(f"id: {i}\ndata: {json.dumps(query)}\n\n")
+        if i % 100 == 0:
+            blocks.append(": keep-alive\n\n")
+    return "".join(blocks).encode("utf-8")
+
+
+def make_response(stream: bytes) -> requests.Response:
+    response = requests.Response()
+    response.raw = io.BytesIO(stream)
+    response.status_code = 200
+    return response
+
+
+def legacy(stream: bytes, chunk_size: int) -> list:
+    response = make_response(stream)
+    results = []
+    for line in response.iter_lines(chunk_size=chunk_size):
+        data = utils.process_stream_data(line)
+        if data:
+            results.append(data)
+    return results
+
+
+def incremental(stream: bytes, chunk_size: int) -> list:
+    response = make_response(stream)
+    return [
+        event.json()
+        for event in sse.iter_events(response.iter_content(chunk_size=chunk_size))
+    ]
+
+
+def measure(parse, stream: bytes, chunk_size: int, runs: int) -> tuple:
+    """Best wall time of parsing the stream, and the parsed events.
+
+    As with timeit, the garbage collector is disabled while parsing, so that
+    the events kept from the previous runs and parsers are not traversed.
+    """
+    best = float("inf")
+    results = None
+    for _ in range(runs):
+        results = None
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            results = parse(stream, chunk_size)
+            best = min(best, time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return best, results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=100000, help="Number of events")
+    parser.add_argument(
+        "--payload", type=int, default=200, help="Size of the data of each query"
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=512, help="Size of the network reads"
+    )
+    parser.add_argument("--runs", type=int, default=3, help="Runs per parser")
+    args = parser.parse_args()
+
+    stream = make_stream(args.events, args.payload)
+    print(f"{args.events} events, {len(stream) / 2**20:.1f} MiB")
+    print(f"{'parser':<14}{'time':>10}{'events/s':>14}")
+    timings = {}
+    outputs = {}
+    for name, parse in [("legacy", legacy), ("incremental", incremental)]:
+        elapsed, outputs[name] = measure(parse, stream, args.chunk_size, args.runs)
+        timings[name] = elapsed
+        print(f"{name:<14}{elapsed:>9.3f}s{args.events / elapsed:>14,.0f}")
+    print(f"speedup: {timings['legacy'] / timings['incremental']:.2f}x")
+
+    if outputs["legacy"] != outputs["incremental"]:
+        print("Parsers disagree on the parsed events.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
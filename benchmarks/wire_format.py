@@ -0,0 +1,115 @@
+"""Benchmark the size and codec time of queries and results in each wire format.
+
+The legacy format sends the query as URL parameters and the result as a JSON
+string form field, then as a JSON string inside a server-sent event. The compact
+formats send both as length-prefixed frames, optionally compressed.
+
+Usage: python benchmarks/wire_format.py [--doc-size BYTES] [--runs N]
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from urllib.parse import parse_qs, urlencode
+
+from hulse import sse
+from hulse.encoding import WireFormat
+
+WORDS = "the model host query result cluster stream text summary of a and to".split()
+
+
+def make_document(size: int) -> str:
+    rng = random.Random(0)
+    words = []
+    while sum(map(len, words)) + len(words) < size:
+        words.append(rng.choice(WORDS))
+    return " ".join(words)[:size]
+
+
+def legacy_round_trip(query: dict, result: dict) -> int:
+    """Encode and decode a query and its result, return the bytes sent."""
+    params = urlencode(query, doseq=True).encode()
+    parse_qs(params.decode())
+    form = urlencode({"qid": query["qid"], "result": json.dumps(result)}).encode()
+    answer = parse_qs(form.decode())
+    event = (
+        f"data: {json.dumps({'qid': query['qid'], 'result': answer['result'][0]})}\n\n"
+    )
+    event = event.encode()
+    for message in sse.iter_events([event]):
+        json.loads(message.json()["result"])
+    return len(params) + len(form) + len(event)
+
+
+def compact_round_trip(wire_format: WireFormat, query: dict, result: dict) -> int:
+    body = wire_format.encode(query)
+    wire_format.decode(body)
+    answer = wire_format.encode({"qid": query["qid"], "result": result})
+    wire_format.decode(answer)
+    # the server forwards the result frame to the consumer as is
+    return len(body) + 2 * len(answer)
+
+
+def measure(round_trip, query: dict, result: dict, runs: int) -> tuple:
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        size = round_trip(query, result)
+        best = min(best, time.perf_counter() - start)
+    return size, best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--doc-size", type=int, default=20000, help="Size of the summarized document"
+    )
+    parser.add_argument("--runs", type=int, default=200, help="Runs per format")
+    args = parser.parse_args()
+
+    workloads = {
+        "summarization": (
+            {
+                "qid": "0" * 32,
+                "task": "summarization",
+                "data": make_document(args.doc_size),
+                "timeout": 30.0,
+            },
+            {"summary_text": make_document(args.doc_size // 10)},
+        ),
+        "sentiment": (
+            {
+                "qid": "0" * 32,
+                "task": "sentiment-analysis",
+                "data": "I love this!",
+                "timeout": 30.0,
+            },
+            {"label": "POSITIVE", "score": 0.9998},
+        ),
+    }
+    formats = {"legacy": None}
+    for encoding in ["json", "msgpack"]:
+        for compression in [None, "gzip", "zstd"]:
+            try:
+                wire_format = WireFormat(encoding, compression)
+            except ImportError:
+                continue
+            formats[f"{encoding}+{compression or 'none'}"] = wire_format
+
+    for name, (query, result) in workloads.items():
+        print(f"\n{name}")
+        print(f"{'format':<16}{'bytes':>10}{'time':>12}")
+        for format_name, wire_format in formats.items():
+            if wire_format is None:
+                round_trip = legacy_round_trip
+            else:
+                round_trip = lambda q, r: compact_round_trip(wire_format, q, r)
+            size, elapsed = measure(round_trip, query, result, args.runs)
+            print(f"{format_name:<16}{size:>10,}{elapsed * 1e6:>10.1f}us")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
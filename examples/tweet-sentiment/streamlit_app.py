@@ -1,4 +1,3 @@
-import json
 from bs4 import BeautifulSoup
 
 import hulse
@@ -57,7 +56,6 @@ else:
                 task="text-classification",
                 data=tweet_object.tweet_text,
             )
-            sentiment["result"] = json.loads(sentiment.get("result"))
         except Exception as e:
             st.error("Impossible to analyse tweet.")
 
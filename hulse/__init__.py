@@ -1,2 +1,3 @@
 from hulse import settings
 from hulse.client import Hulse
+from hulse.async_client import AsyncHulse
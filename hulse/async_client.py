@@ -0,0 +1,554 @@
+import asyncio
+import copy
+import json
+import time
+from collections import deque
+from typing import AsyncIterator, Iterable, Union
+
+from hulse import settings, errors, sse, tracing, utils
+from hulse.cache import ResultCache
+from hulse.encoding import WireFormat
+
+
+class AsyncHulse:
+    """Asyncio Hulse client, mirroring :class:`hulse.client.Hulse`.
+
+    All queries share a single aiohttp session, so that many outstanding
+    queries can be awaited concurrently from one event loop. Requires the
+    optional aiohttp dependency, installed with `pip install hulse[async]`.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        max_connections: int = 0,
+        cache: Union[bool, ResultCache] = False,
+        encoding: str = settings.WIRE_ENCODING,
+        compression: str = settings.WIRE_COMPRESSION,
+    ):
+        """Create a new asyncio Hulse client.
+
+        :param api_key: Your Hulse API key to run queries
+        :type api_key: str
+        :param max_connections: Maximum number of open connections, defaults to 0 (no limit)
+        :type max_connections: int, optional
+        :param cache: Cache results of identical queries, either True for an
+            in-memory cache or a configured ResultCache, defaults to False
+        :type cache: Union[bool, ResultCache], optional
+        :param encoding: Compact wire format of queries and results, either json
+            or msgpack, defaults to settings.WIRE_ENCODING
+        :type encoding: str, optional
+        :param compression: Compression of large queries and results in the compact
+            wire format, either gzip or zstd, defaults to settings.WIRE_COMPRESSION
+        :type compression: str, optional
+        """
+        self.api_key = api_key
+        self.max_connections = max_connections
+        if cache is True:
+            cache = ResultCache()
+        self.cache = cache if isinstance(cache, ResultCache) else None
+        self.wire_format = WireFormat(encoding, compression) if encoding else None
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            try:
+                import aiohttp
+            except ImportError as e:
+                raise ImportError(
+                    "AsyncHulse requires aiohttp, install it with `pip install hulse[async]`."
+                ) from e
+
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections)
+            )
+        return self._session
+
+    async def close(self):
+        """Close the underlying HTTP session."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self.cache is not None:
+            self.cache.close()
+
+    def cache_stats(self) -> dict:
+        """Get the statistics of the result cache.
+
+        :return: Number of cached results, hits, misses and hit rate, empty if caching is disabled.
+        :rtype: dict
+        """
+        return self.cache.stats() if self.cache is not None else {}
+
+    async def query(
+        self,
+        data: Union[str, list],
+        task: str = None,
+        model: str = None,
+        timeout: float = settings.QUERY_TIMEOUT,
+        connect_timeout: float = settings.QUERY_CONNECT_TIMEOUT,
+        first_byte_timeout: float = settings.QUERY_FIRST_BYTE_TIMEOUT,
+        **kwargs,
+    ) -> dict:
+        """Run an inference query on a Hulse cluster.
+
+        :param data: Data to be inferred upon by the target model.
+        :type data: Any
+        :param task: Task to be performed. Corresponds to the model you
+            want to use.
+        :type task: str
+        :param model: Model to be used, defaults to None
+        :type model: str, optional
+        :param timeout: Total timeout of the query in seconds, after which hosts
+            drop it, defaults to settings.QUERY_TIMEOUT
+        :type timeout: float, optional
+        :param connect_timeout: Timeout of the connection to the stream server, defaults to settings.QUERY_CONNECT_TIMEOUT
+        :type connect_timeout: float, optional
+        :param first_byte_timeout: Timeout for the stream server to start responding, defaults to settings.QUERY_FIRST_BYTE_TIMEOUT
+        :type first_byte_timeout: float, optional
+        :param kwargs: Keyword arguments of the pipeline call, such as
+            max_new_tokens or top_k, see settings.TASK_KWARGS.
+        :raises errors.UnsupportedTaskError: If the task is not supported.
+        :raises errors.UnsupportedArgumentError: If an argument is not supported by the task.
+        :raises errors.UnsufficientResources: If there are no online producers.
+        :raises errors.HostBusyError: If all online producers are busy.
+        :raises errors.InferenceError: If the inference of the query failed on its host.
+        :raises errors.QueryTimeoutError: If the query timed out.
+        :raises errors.HulseError: An error occurred while communicating with the Hulse server.
+        :return: The answer of the query, whose result is the complete pipeline
+            output, a list of the result of each item for list data, and whose
+            trace holds the spans of its stages, see :mod:`hulse.tracing`.
+        :rtype: dict
+        """
+        if task and task not in settings.SUPPORTED_TASKS:
+            raise errors.UnsupportedTaskError(task)
+        utils.validate_kwargs(task, kwargs)
+
+        if self.cache is not None:
+            trace = tracing.Trace()
+            key = ResultCache.make_key(task, model, data, **kwargs)
+            result = self.cache.get(key)
+            if result is not None:
+                return utils.cached_answer(result, trace)
+
+        answers = self._iter_answers(
+            data, task, model, timeout, connect_timeout, first_byte_timeout, kwargs
+        )
+        try:
+            async for answer in answers:
+                if "token" not in answer:
+                    if self.cache is not None:
+                        # answers are cached without the id and trace of their query
+                        self.cache.put(key, copy.deepcopy(answer["result"]))
+                    return answer
+        finally:
+            await answers.aclose()
+
+    async def stream_query(
+        self,
+        data: str,
+        task: str = "text-generation",
+        model: str = None,
+        timeout: float = settings.QUERY_TIMEOUT,
+        connect_timeout: float = settings.QUERY_CONNECT_TIMEOUT,
+        first_byte_timeout: float = settings.QUERY_FIRST_BYTE_TIMEOUT,
+        **kwargs,
+    ) -> AsyncIterator:
+        """Run a text generation query, yielding the generated text as it comes.
+
+        See :meth:`hulse.client.Hulse.stream_query`.
+
+        :param data: Prompt of the generation.
+        :type data: str
+        :param task: Either text-generation or text2text-generation, defaults to "text-generation"
+        :type task: str, optional
+        :param model: Model to be used, defaults to None
+        :type model: str, optional
+        :param timeout: Total timeout of the query in seconds, defaults to settings.QUERY_TIMEOUT
+        :type timeout: float, optional
+        :param connect_timeout: Timeout of the connection to the stream server, defaults to settings.QUERY_CONNECT_TIMEOUT
+        :type connect_timeout: float, optional
+        :param first_byte_timeout: Timeout for the stream server to start responding, defaults to settings.QUERY_FIRST_BYTE_TIMEOUT
+        :type first_byte_timeout: float, optional
+        :param kwargs: Keyword arguments of the pipeline call, see :meth:`query`.
+        :raises errors.UnsupportedTaskError: If the task does not generate text.
+        :raises errors.UnsupportedArgumentError: If an argument is not supported by the task.
+        :raises errors.QueryTimeoutError: If the query timed out.
+        :return: Async iterator over the chunks of generated text, the prompt excluded.
+        :rtype: AsyncIterator
+        """
+        if task not in settings.STREAMING_TASKS:
+            raise errors.UnsupportedTaskError(task)
+        utils.validate_kwargs(task, kwargs)
+
+        streamed = False
+        answers = self._iter_answers(
+            data,
+            task,
+            model,
+            timeout,
+            connect_timeout,
+            first_byte_timeout,
+            kwargs,
+            stream=True,
+        )
+        try:
+            async for answer in answers:
+                if "token" in answer:
+                    streamed = True
+                    yield answer["token"]
+                elif not streamed:
+                    text = utils.generated_text(answer.get("result"))
+                    if text:
+                        yield text
+        finally:
+            await answers.aclose()
+
+    async def _iter_answers(
+        self,
+        data: Union[str, list],
+        task: str,
+        model: str,
+        timeout: float,
+        connect_timeout: float,
+        first_byte_timeout: float,
+        kwargs: dict,
+        stream: bool = False,
+    ) -> AsyncIterator:
+        # answers of a query, partial ones first for streaming queries
+        session = self._get_session()
+        import aiohttp
+
+        trace = tracing.Trace()
+        fields = [
+            ("task", task),
+            ("data", data),
+            ("model", model),
+            ("trace_id", trace.trace_id),
+        ]
+        if timeout:
+            fields.append(("timeout", timeout))
+            first_byte_timeout = min(first_byte_timeout or timeout, timeout)
+        # mirror requests, which drops empty parameters and repeats list ones
+        params = [
+            (key, str(item))
+            for key, value in fields
+            if value is not None
+            for item in (value if isinstance(value, list) else [value])
+        ]
+        if kwargs:
+            params.append(("kwargs", json.dumps(kwargs)))
+            fields.append(("kwargs", kwargs))
+        if stream:
+            params.append(("stream", "1"))
+            fields.append(("stream", True))
+        if isinstance(data, list):
+            params.append(("list", "1"))
+        url = settings.HULSE_STREAM_URL + f"consumer/{self.api_key}/"
+        headers = settings.get_auth_headers(self.api_key)
+        client_timeout = aiohttp.ClientTimeout(
+            total=timeout, sock_connect=connect_timeout
+        )
+        stage, stage_timeout = "first byte", first_byte_timeout
+        sending = time.time()
+        try:
+            resp = None
+            if self.wire_format is not None:
+                resp = await asyncio.wait_for(
+                    session.post(
+                        url,
+                        data=self.wire_format.encode(
+                            {key: value for key, value in fields if value is not None}
+                        ),
+                        headers={**headers, **self.wire_format.headers()},
+                        timeout=client_timeout,
+                    ),
+                    first_byte_timeout,
+                )
+                if resp.status in (405, 415):
+                    # the server only speaks the legacy format
+                    resp.release()
+                    resp = None
+            if resp is None:
+                resp = await asyncio.wait_for(
+                    session.get(
+                        url, params=params, headers=headers, timeout=client_timeout
+                    ),
+                    first_byte_timeout,
+                )
+            async with resp:
+                if resp.status == 418:
+                    raise errors.UnsufficientResources()
+                elif resp.status != 200:
+                    raise errors.HulseError(resp.status)
+
+                stage, stage_timeout = "result", timeout
+                waiting = trace.add("client.send", sending)["end"]
+                wire_format = WireFormat.from_headers(resp.headers)
+                if wire_format is not None:
+                    parser, decode = wire_format.parser(), lambda message: message.data
+                else:
+                    parser, decode = sse.SSEParser(), utils.decode_event
+                async for chunk in resp.content.iter_any():
+                    for message in parser.feed(chunk):
+                        answer = decode(message)
+                        if isinstance(answer, dict) and answer.get("error"):
+                            raise utils.answer_error(answer)
+                        if not answer:
+                            continue
+                        if "token" in answer:
+                            yield answer
+                            continue
+                        trace.add("client.wait", waiting)
+                        yield trace.finish(answer)
+                        return
+        except aiohttp.ServerTimeoutError as e:
+            # only raised by the sock_connect timeout, others are set by wait_for
+            raise errors.QueryTimeoutError("connection", connect_timeout, e)
+        except asyncio.TimeoutError as e:
+            raise errors.QueryTimeoutError(stage, stage_timeout, e)
+
+    async def iter_query(
+        self,
+        items: Iterable,
+        task: str = None,
+        model: str = None,
+        concurrency: int = settings.QUERY_CONCURRENCY,
+        ordered: bool = True,
+        return_exceptions: bool = False,
+        **kwargs,
+    ) -> AsyncIterator:
+        """Run an inference query for each item, with a bounded number of queries in flight.
+
+        See :meth:`hulse.client.Hulse.iter_query`.
+
+        :param items: Data of each query.
+        :type items: Iterable
+        :param task: Task to be performed, defaults to None
+        :type task: str, optional
+        :param model: Model to be used, defaults to None
+        :type model: str, optional
+        :param concurrency: Maximum number of queries in flight, defaults to settings.QUERY_CONCURRENCY
+        :type concurrency: int, optional
+        :param ordered: Yield results in the order of the items rather than as
+            they complete, in which case (index, result) tuples are yielded, defaults to True
+        :type ordered: bool, optional
+        :param return_exceptions: Yield the exception of failed queries instead of raising it, defaults to False
+        :type return_exceptions: bool, optional
+        :return: Async iterator over the query results.
+        :rtype: AsyncIterator
+        """
+        if task and task not in settings.SUPPORTED_TASKS:
+            raise errors.UnsupportedTaskError(task)
+
+        items = enumerate(items)
+        pending = {}
+        in_order = deque()
+
+        def submit_next():
+            for index, item in items:
+                future = asyncio.ensure_future(
+                    self.query(data=item, task=task, model=model, **kwargs)
+                )
+                pending[future] = index
+                if ordered:
+                    in_order.append(future)
+                return
+
+        async def get_result(future):
+            try:
+                return await future
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                return e
+
+        try:
+            for _ in range(max(1, concurrency)):
+                submit_next()
+
+            while pending:
+                if ordered:
+                    done = [in_order.popleft()]
+                else:
+                    done, _ = await asyncio.wait(
+                        set(pending), return_when=asyncio.FIRST_COMPLETED
+                    )
+
+                for future in done:
+                    index = pending.pop(future)
+                    result = await get_result(future)
+                    submit_next()
+                    yield result if ordered else (index, result)
+        finally:
+            for future in pending:
+                future.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def query_batch(
+        self,
+        items: Iterable,
+        task: str = None,
+        model: str = None,
+        concurrency: int = settings.QUERY_CONCURRENCY,
+        return_exceptions: bool = False,
+        **kwargs,
+    ) -> list:
+        """Run an inference query for each item, with a bounded number of queries in flight.
+
+        Items are consumed lazily by `concurrency` worker tasks, so that only
+        the queries in flight are held in memory, not one per item.
+
+        :param items: Data of each query.
+        :type items: Iterable
+        :param task: Task to be performed, defaults to None
+        :type task: str, optional
+        :param model: Model to be used, defaults to None
+        :type model: str, optional
+        :param concurrency: Maximum number of queries in flight, defaults to settings.QUERY_CONCURRENCY
+        :type concurrency: int, optional
+        :param return_exceptions: Return the exception of failed queries instead of raising it, defaults to False
+        :type return_exceptions: bool, optional
+        :return: Result of each query, in the order of the items.
+        :rtype: list
+        """
+        items = enumerate(items)
+        results = {}
+
+        async def worker():
+            # workers share the iterator, next() never yields to the event loop
+            for index, item in items:
+                try:
+                    results[index] = await self.query(
+                        data=item, task=task, model=model, **kwargs
+                    )
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    results[index] = e
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(max(1, concurrency))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            # stop the other workers once one of them failed
+            for running in workers:
+                running.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        return [results[index] for index in range(len(results))]
+
+    async def _post_api(self, path: str, data: dict, error_message: str) -> bool:
+        async with self._get_session().post(
+            settings.HULSE_API_URL + path,
+            headers=settings.get_auth_headers(self.api_key),
+            data={key: value for key, value in data.items() if value is not None},
+        ) as resp:
+            if resp.status != 200:
+                raise errors.HulseError(resp.status, error_message)
+        return True
+
+    async def get_clusters(self) -> list:
+        """Get all available clusters for the account.
+
+        :raises errors.HulseError: Unknown error occured while sending request to Hulse server.
+        :return: List of clusters for the account.
+        :rtype: list
+        """
+        async with self._get_session().get(
+            settings.HULSE_API_URL + "clusters/",
+            headers=settings.get_auth_headers(self.api_key),
+        ) as resp:
+            if resp.status != 200:
+                raise errors.HulseError(resp.status, "Failed to get clusters")
+            return (await resp.json(content_type=None)).get("clusters")
+
+    async def create_cluster(self, name: str, description: str = None) -> bool:
+        """Create a new Hulse cluster.
+
+        :param name: Name of the cluster to be created.
+        :type name: str
+        :param description: Short description of the newly created cluster, defaults to None
+        :type description: str, optional
+        :return: Whether the cluster was created.
+        :rtype: bool
+        """
+        try:
+            return await self._post_api(
+                "cluster/create/",
+                {"name": name, "description": description},
+                "Failed to create cluster",
+            )
+        except errors.HulseError:
+            return False
+
+    async def join_cluster(self, cluster_id: str) -> bool:
+        """Join a Hulse cluster
+
+        :param cluster_id: Cluster ID to join.
+        :type cluster_id: str
+        :raises errors.HulseError: Error raised if the cluster could not be joined.
+        :return: Whether the cluster was joined or not.
+        :rtype: bool
+        """
+        return await self._post_api(
+            "cluster/join/", {"cluster_id": cluster_id}, "Failed to join cluster"
+        )
+
+    async def leave_cluster(self, cluster_id: str) -> bool:
+        """Leave a Hulse cluster
+
+        :param cluster_id: Cluster ID to leave.
+        :type cluster_id: str
+        :raises errors.HulseError: Error raised if the cluster could not be left.
+        :return: Whether the cluster was left or not.
+        :rtype: bool
+        """
+        return await self._post_api(
+            "cluster/leave/", {"cluster_id": cluster_id}, "Failed to leave cluster"
+        )
+
+    async def edit_cluster(self, cluster_id: str, name: str, description: str) -> bool:
+        """Edit a Hulse cluster
+
+        :param cluster_id: Cluster ID to edit.
+        :type cluster_id: str
+        :param name: New name for the cluster.
+        :type name: str
+        :param description: New description for the cluster.
+        :type description: str
+        :raises errors.HulseError: Error raised if the cluster could not be edited.
+        :return: Whether the cluster was edited or not.
+        :rtype: bool
+        """
+        return await self._post_api(
+            "cluster/edit/",
+            {"cluster_id": cluster_id, "name": name, "description": description},
+            "Failed to edit cluster",
+        )
+
+    async def delete_cluster(self, cluster_id: str) -> bool:
+        """Delete a Hulse cluster
+
+        :param cluster_id: Cluster ID to delete.
+        :type cluster_id: str
+        :raises errors.HulseError: Error raised if the cluster could not be deleted.
+        :return: Whether the cluster was deleted or not.
+        :rtype: bool
+        """
+        return await self._post_api(
+            "cluster/delete/", {"cluster_id": cluster_id}, "Failed to delete cluster"
+        )
+
+    def set_api_key(self, api_key: str):
+        """Set the Hulse API key.
+
+        :param api_key: Hulse API key to define as default configuration.
+        :type api_key: str
+        """
+        self.api_key = api_key
@@ -0,0 +1,300 @@
+import logging
+import time
+from typing import Any, Iterable
+
+from hulse import cache, settings
+
+logger = logging.getLogger(__name__)
+
+# output fields holding the scores of pipelines, compared with a tolerance
+SCORE_FIELDS = ["score", "scores"]
+
+
+def quantize(pipe: Any) -> Any:
+    """Quantize the linear layers of a pipeline model to int8, in place.
+
+    Weights are stored as int8 and activations quantized on the fly, which
+    speeds up transformer inference on CPU at a small cost in accuracy.
+
+    :param pipe: Hugging Face pipeline running a PyTorch model.
+    :type pipe: Any
+    :return: The pipeline, with its quantized model.
+    :rtype: Any
+    """
+    import torch
+
+    pipe.model = torch.ao.quantization.quantize_dynamic(
+        pipe.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+    return pipe
+
+
+def compile_model(pipe: Any) -> Any:
+    """Compile the forward pass of a pipeline model with torch.compile, in place.
+
+    Shapes are compiled as dynamic, since the length of inputs varies between
+    queries, and the first inference of a pipeline pays for the compilation.
+
+    :param pipe: Hugging Face pipeline running a PyTorch model.
+    :type pipe: Any
+    :return: The pipeline, with its compiled model.
+    :rtype: Any
+    """
+    import torch
+
+    pipe.model.forward = torch.compile(pipe.model.forward, dynamic=True)
+    return pipe
+
+
+def load_onnx_pipeline(task: str, model: str = None, **kwargs) -> Any:
+    """Build a pipeline running on ONNX Runtime, exporting the model if needed.
+
+    :param task: Transformer task of the pipeline.
+    :type task: str
+    :param model: Model of the pipeline, defaults to None for the task default.
+    :type model: str, optional
+    :raises ImportError: If optimum is not installed.
+    :return: The loaded pipeline.
+    :rtype: Any
+    """
+    # ONNX Runtime maps its own model files
+    kwargs.pop("mmap_weights", None)
+    try:
+        from optimum.onnxruntime import pipeline
+    except ImportError:
+        try:
+            from optimum.pipelines import pipeline
+        except ImportError as e:
+            raise ImportError(
+                "The onnx backend requires optimum, install it with `pip install hulse[onnx]`."
+            ) from e
+        kwargs["accelerator"] = "ort"
+    return pipeline(task=task, model=model, **kwargs)
+
+
+def run_pipeline(pipe: Any, data: Any) -> Any:
+    """Run an input through a pipeline, dict inputs are passed as keyword arguments.
+
+    :param pipe: Hugging Face pipeline.
+    :type pipe: Any
+    :param data: Input of the pipeline task.
+    :type data: Any
+    :return: Raw pipeline output.
+    :rtype: Any
+    """
+    if isinstance(data, dict):
+        return pipe(**data)
+    return pipe(data)
+
+
+def load_pipeline(
+    task: str, model: str = None, backend: str = "default", **kwargs
+) -> Any:
+    """Build a pipeline with an inference backend, falling back to the default one.
+
+    Pipelines of other backends run the warm-up input of their task once,
+    since some backends only fail on their first inference.
+
+    :param task: Transformer task of the pipeline.
+    :type task: str
+    :param model: Model of the pipeline, defaults to None for the task default.
+    :type model: str, optional
+    :param backend: One of settings.HOST_BACKENDS, defaults to "default"
+    :type backend: str, optional
+    :raises ValueError: If the backend is not supported.
+    :return: The loaded pipeline, its backend set as its `hulse_backend` attribute.
+    :rtype: Any
+    """
+    if backend not in settings.HOST_BACKENDS:
+        raise ValueError(f"Unsupported inference backend {backend}.")
+
+    if backend != "default":
+        try:
+            if backend == "onnx":
+                pipe = load_onnx_pipeline(task, model, **kwargs)
+            else:
+                pipe = cache.load_pipeline(task=task, model=model, **kwargs)
+                pipe = quantize(pipe) if backend == "quantized" else compile_model(pipe)
+            warmup_input = settings.WARMUP_INPUTS.get(task)
+            if warmup_input is not None:
+                run_pipeline(pipe, warmup_input)
+            pipe.hulse_backend = backend
+            return pipe
+        except Exception as e:
+            logger.warning(
+                "Failed to load %s pipeline %s with the %s backend, falling back to the default backend: %s",
+                task,
+                model or "(default model)",
+                backend,
+                repr(e),
+            )
+
+    pipe = cache.load_pipeline(task=task, model=model, **kwargs)
+    pipe.hulse_backend = "default"
+    return pipe
+
+
+class BackendLoader:
+    """Pipeline loader building each model with the backend configured for it.
+
+    Backends are looked up by "task:model" spec, then by task, and default to
+    the backend of the host. Instances are picklable, so that worker processes
+    load their pipelines the same way.
+    """
+
+    def __init__(self, backend: str = settings.HOST_BACKEND, backends: dict = None):
+        """Create a new loader.
+
+        :param backend: Backend of models without a configured backend, defaults to settings.HOST_BACKEND
+        :type backend: str, optional
+        :param backends: Backend of models keyed by "task:model" or "task" spec, defaults to None
+        :type backends: dict, optional
+        :raises ValueError: If a backend is not supported.
+        """
+        self.backend = backend
+        self.backends = dict(backends or {})
+        for name in [backend, *self.backends.values()]:
+            if name not in settings.HOST_BACKENDS:
+                raise ValueError(f"Unsupported inference backend {name}.")
+
+    def __repr__(self) -> str:
+        return f"BackendLoader({self.backend!r}, {self.backends!r})"
+
+    def select(self, task: str, model: str = None) -> str:
+        """Get the backend of a model.
+
+        :param task: Transformer task of the pipeline.
+        :type task: str
+        :param model: Model of the pipeline, defaults to None for the task default.
+        :type model: str, optional
+        :return: Name of the backend.
+        :rtype: str
+        """
+        if model and f"{task}:{model}" in self.backends:
+            return self.backends[f"{task}:{model}"]
+        return self.backends.get(task, self.backend)
+
+    def __call__(self, task: str, model: str = None, **kwargs) -> Any:
+        return load_pipeline(task, model, self.select(task, model), **kwargs)
+
+
+def _split_output(output: Any, scores: list) -> Any:
+    # separate the scores of an output from the rest, compared exactly
+    if isinstance(output, dict):
+        rest = {}
+        for key, value in output.items():
+            if key in SCORE_FIELDS:
+                scores.extend(value if isinstance(value, list) else [value])
+            else:
+                rest[key] = _split_output(value, scores)
+        return rest
+    if isinstance(output, (list, tuple)):
+        return [_split_output(item, scores) for item in output]
+    return output
+
+
+def compare_outputs(reference: Any, output: Any) -> tuple:
+    """Compare the output of a pipeline with the output of the reference backend.
+
+    :param reference: Raw output of the reference pipeline.
+    :type reference: Any
+    :param output: Raw output of the compared pipeline, for the same input.
+    :type output: Any
+    :return: Whether labels, answers and generated texts match, and the largest
+        score difference, None if they do not match.
+    :rtype: tuple
+    """
+    reference_scores, scores = [], []
+    if _split_output(reference, reference_scores) != _split_output(output, scores):
+        return False, None
+    errors = [abs(float(a) - float(b)) for a, b in zip(reference_scores, scores)]
+    return True, max(errors, default=0.0)
+
+
+def compare_backends(
+    task: str,
+    model: str = None,
+    backends: Iterable = settings.HOST_BACKENDS,
+    inputs: list = None,
+    runs: int = 10,
+) -> list:
+    """Measure the latency and accuracy of a model with each inference backend.
+
+    Outputs are compared with the outputs of the first backend, the default
+    one unless specified otherwise.
+
+    :param task: Transformer task of the pipeline.
+    :type task: str
+    :param model: Model of the pipeline, defaults to None for the task default.
+    :type model: str, optional
+    :param backends: Backends to compare, defaults to settings.HOST_BACKENDS
+    :type backends: Iterable, optional
+    :param inputs: Inputs of the task, defaults to its warm-up input.
+    :type inputs: list, optional
+    :param runs: Number of times each input is run, defaults to 10
+    :type runs: int, optional
+    :return: Backend requested and loaded, load time, mean and p95 latency in
+        seconds, speedup, agreement and largest score difference of each backend.
+    :rtype: list
+    """
+    if not inputs:
+        inputs = [settings.WARMUP_INPUTS[task]]
+    rows = []
+    reference = None
+    for backend in backends:
+        start = time.perf_counter()
+        pipe = load_pipeline(task, model, backend)
+        load_time = time.perf_counter() - start
+        outputs = [run_pipeline(pipe, data) for data in inputs]
+
+        latencies = []
+        for _ in range(runs):
+            for data in inputs:
+                start = time.perf_counter()
+                run_pipeline(pipe, data)
+                latencies.append(time.perf_counter() - start)
+        latencies.sort()
+
+        if reference is None:
+            reference = outputs
+        comparisons = [compare_outputs(*pair) for pair in zip(reference, outputs)]
+        score_errors = [error for _, error in comparisons if error is not None]
+        rows.append(
+            dict(
+                backend=backend,
+                loaded=getattr(pipe, "hulse_backend", backend),
+                load_time=load_time,
+                latency=sum(latencies) / len(latencies),
+                p95=latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+                agreement=sum(match for match, _ in comparisons) / len(comparisons),
+                score_error=max(score_errors, default=None),
+            )
+        )
+        del pipe
+
+    for row in rows:
+        row["speedup"] = rows[0]["latency"] / row["latency"]
+    return rows
+
+
+def format_report(rows: list) -> str:
+    """Format the rows of :func:`compare_backends` as a table.
+
+    :param rows: Comparison of each backend.
+    :type rows: list
+    :return: Table of the comparison.
+    :rtype: str
+    """
+    lines = [
+        f"{'backend':<12}{'loaded':<12}{'load':>9}{'latency':>11}{'p95':>11}"
+        f"{'speedup':>9}{'agreement':>11}{'score err':>11}"
+    ]
+    for row in rows:
+        score_error = row["score_error"]
+        lines.append(
+            f"{row['backend']:<12}{row['loaded']:<12}{row['load_time']:>8.1f}s"
+            f"{row['latency'] * 1e3:>9.1f}ms{row['p95'] * 1e3:>9.1f}ms"
+            f"{row['speedup']:>8.2f}x{row['agreement']:>11.0%}"
+            f"{'-' if score_error is None else f'{score_error:.4f}':>11}"
+        )
+    return "\n".join(lines)
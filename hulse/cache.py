@@ -0,0 +1,715 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Hashable, Union
+
+from hulse import settings, errors, utils
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Thread-safe least recently used cache with hit, miss and eviction counters.
+
+    Pinned entries are never evicted, but still count towards the budget.
+    """
+
+    def __init__(self, max_entries: int = 128):
+        """Create a new LRU cache.
+
+        :param max_entries: Maximum number of entries kept in the cache, defaults to 128
+        :type max_entries: int, optional
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._pinned = set()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def keys(self) -> list:
+        """Get the keys of the cached entries.
+
+        :return: Keys from the least to the most recently used.
+        :rtype: list
+        """
+        with self._lock:
+            return list(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get an entry from the cache, marking it as most recently used.
+
+        :param key: Key of the entry.
+        :type key: Hashable
+        :param default: Value returned when the key is not cached, defaults to None
+        :type default: Any, optional
+        :return: The cached value or the default value.
+        :rtype: Any
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: Any):
+        """Add an entry to the cache, evicting older entries if over budget.
+
+        :param key: Key of the entry.
+        :type key: Hashable
+        :param value: Value to be cached.
+        :type value: Any
+        """
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an entry from the cache.
+
+        :param key: Key of the entry.
+        :type key: Hashable
+        :param default: Value returned when the key is not cached, defaults to None
+        :type default: Any, optional
+        :return: The removed value or the default value.
+        :rtype: Any
+        """
+        with self._lock:
+            self._pinned.discard(key)
+            return self._entries.pop(key, default)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+            self._pinned.clear()
+
+    def pin(self, key: Hashable) -> bool:
+        """Protect an entry from eviction.
+
+        :param key: Key of the entry.
+        :type key: Hashable
+        :return: Whether the entry is cached and was pinned.
+        :rtype: bool
+        """
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._pinned.add(key)
+            return True
+
+    def unpin(self, key: Hashable):
+        """Allow a pinned entry to be evicted again.
+
+        :param key: Key of the entry.
+        :type key: Hashable
+        """
+        with self._lock:
+            self._pinned.discard(key)
+            self._evict()
+
+    def stats(self) -> dict:
+        """Get the cache usage statistics.
+
+        :return: Number of entries, hits, misses and evictions.
+        :rtype: dict
+        """
+        with self._lock:
+            return dict(
+                entries=len(self._entries),
+                max_entries=self.max_entries,
+                pinned=len(self._pinned),
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+            )
+
+    def _over_budget(self) -> bool:
+        return self.max_entries is not None and len(self._entries) > self.max_entries
+
+    def _evict(self):
+        # always keep the most recently added entry, even if it is over budget
+        for key in list(self._entries)[:-1]:
+            if not self._over_budget():
+                break
+            if key in self._pinned:
+                continue
+            del self._entries[key]
+            self._on_evict(key)
+            self.evictions += 1
+
+    def _on_evict(self, key: Hashable):
+        pass
+
+
+class ResultCache(LRUCache):
+    """Cache of query results keyed by a hash of the query, with a time to live.
+
+    Results are kept in memory and, if enabled, in a SQLite database on disk so
+    that they survive restarts. Both stores evict least recently used results
+    once over budget.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = settings.RESULT_CACHE_SIZE,
+        ttl: float = settings.RESULT_CACHE_TTL,
+        disk: bool = False,
+        path: Union[str, Path] = settings.RESULT_CACHE_PATH,
+        max_disk_entries: int = settings.RESULT_CACHE_DISK_SIZE,
+    ):
+        """Create a new result cache.
+
+        :param max_entries: Maximum number of results kept in memory, defaults to settings.RESULT_CACHE_SIZE
+        :type max_entries: int, optional
+        :param ttl: Time to live of results in seconds, defaults to settings.RESULT_CACHE_TTL
+        :type ttl: float, optional
+        :param disk: Whether to also store results on disk, defaults to False
+        :type disk: bool, optional
+        :param path: Path of the on-disk store, defaults to settings.RESULT_CACHE_PATH
+        :type path: Union[str, Path], optional
+        :param max_disk_entries: Maximum number of results stored on disk, defaults to settings.RESULT_CACHE_DISK_SIZE
+        :type max_disk_entries: int, optional
+        """
+        super().__init__(max_entries=max_entries)
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self._db = None
+        if disk:
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, value TEXT, expires_at REAL, accessed_at REAL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(task: str, model: str, data: Any, **kwargs) -> str:
+        """Build the cache key of a query.
+
+        :param task: Transformer task of the query.
+        :type task: str
+        :param model: Model of the query.
+        :type model: str
+        :param data: Data of the query.
+        :type data: Any
+        :return: Hash of the query.
+        :rtype: str
+        """
+        query = json.dumps([task, model, data, kwargs], sort_keys=True, default=str)
+        return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            if key in self._entries:
+                expires_at, value = self._entries[key]
+                if expires_at > now:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM results WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    self._db.execute(
+                        "UPDATE results SET accessed_at = ? WHERE key = ?", (now, key)
+                    )
+                    self._db.commit()
+                    self.hits += 1
+                    value = json.loads(row[0])
+                    super().put(key, (row[1], value))
+                    return value
+
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        now = time.time()
+        with self._lock:
+            super().put(key, (now + self.ttl, value))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now + self.ttl, now),
+                )
+                # drop expired results, then least recently used ones over budget
+                self._db.execute("DELETE FROM results WHERE expires_at <= ?", (now,))
+                self._db.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results "
+                    "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,),
+                )
+                self._db.commit()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = super().pop(key)
+            if self._db is not None:
+                self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._db.commit()
+            return entry[1] if entry else default
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+    def close(self):
+        """Close the on-disk store."""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = super().stats()
+            lookups = self.hits + self.misses
+            stats["hit_rate"] = self.hits / lookups if lookups else 0.0
+            if self._db is not None:
+                stats["disk_entries"] = self._db.execute(
+                    "SELECT COUNT(*) FROM results"
+                ).fetchone()[0]
+            return stats
+
+
+def load_pipeline(mmap_weights: bool = False, **kwargs) -> Any:
+    """Build a Hugging Face pipeline, importing transformers on first use.
+
+    :param mmap_weights: Whether to only load weights from memory-mapped
+        safetensors files, falling back to any weights for models without
+        them, defaults to False
+    :type mmap_weights: bool, optional
+    :return: The loaded pipeline.
+    :rtype: Any
+    """
+    from transformers import pipeline
+
+    if mmap_weights:
+        model_kwargs = dict(kwargs.get("model_kwargs") or {}, use_safetensors=True)
+        try:
+            return pipeline(**dict(kwargs, model_kwargs=model_kwargs))
+        except OSError as e:
+            logger.warning(
+                "No safetensors weights for %s pipeline %s, loading them in memory: %s",
+                kwargs.get("task"),
+                kwargs.get("model") or "(default model)",
+                repr(e),
+            )
+    return pipeline(**kwargs)
+
+
+def estimate_pipeline_memory(pipe: Any) -> int:
+    """Estimate the memory footprint of a pipeline from its model weights.
+
+    :param pipe: Hugging Face pipeline.
+    :type pipe: Any
+    :return: Size of the model parameters and buffers in bytes, 0 if unknown.
+    :rtype: int
+    """
+    model = getattr(pipe, "model", None)
+    try:
+        tensors = list(model.parameters()) + list(model.buffers())
+    except Exception:
+        return 0
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def _weights_size(files: dict) -> int:
+    # safetensors weights are loaded instead of pickled ones when both exist
+    safetensors = [
+        size for name, size in files.items() if name.endswith(".safetensors")
+    ]
+    if safetensors:
+        return sum(safetensors)
+    return sum(
+        size
+        for name, size in files.items()
+        if name.endswith(".bin") and "model" in name
+    )
+
+
+def _hub_cache_dir() -> Path:
+    try:
+        from huggingface_hub.constants import HF_HUB_CACHE
+
+        return Path(HF_HUB_CACHE)
+    except ImportError:
+        home = os.getenv("HF_HOME", Path.home() / ".cache" / "huggingface")
+        return Path(os.getenv("HF_HUB_CACHE", Path(home) / "hub"))
+
+
+def _files_sizes(path: Path) -> dict:
+    return {p.name: p.stat().st_size for p in path.iterdir() if p.is_file()}
+
+
+# sizes of the weights of models looked up on the hub, which do not change
+_hub_weights_sizes = {}
+
+
+def _hub_weights_size(model: str) -> int:
+    if model in _hub_weights_sizes:
+        return _hub_weights_sizes[model]
+    try:
+        from huggingface_hub import HfApi
+
+        info = HfApi().model_info(
+            model, files_metadata=True, timeout=settings.PIPELINE_ESTIMATE_TIMEOUT
+        )
+    except Exception:
+        # not cached, the hub may answer next time
+        return 0
+    size = _weights_size({f.rfilename: f.size or 0 for f in info.siblings})
+    _hub_weights_sizes[model] = size
+    return size
+
+
+def estimate_weights_size(model: str = None) -> int:
+    """Estimate the memory footprint of a model before loading it, from the size of its weights.
+
+    Weights are looked up in local model directories, in the cache of the
+    Hugging Face hub, then in the file metadata of the hub, within
+    settings.PIPELINE_ESTIMATE_TIMEOUT seconds. Sizes found on the hub are cached.
+
+    :param model: Model name or path, defaults to None for the task default.
+    :type model: str, optional
+    :return: Size of the weight files in bytes, 0 if unknown.
+    :rtype: int
+    """
+    if not model:
+        return 0
+    if Path(model).is_dir():
+        return _weights_size(_files_sizes(Path(model)))
+
+    repo = _hub_cache_dir() / f"models--{model.replace('/', '--')}"
+    snapshots = repo / "snapshots"
+    if snapshots.is_dir():
+        ref = repo / "refs" / "main"
+        snapshot = snapshots / ref.read_text().strip() if ref.is_file() else None
+        if snapshot is None or not snapshot.is_dir():
+            revisions = sorted(snapshots.iterdir(), key=lambda p: p.stat().st_mtime)
+            snapshot = revisions[-1] if revisions else None
+        size = _weights_size(_files_sizes(snapshot)) if snapshot else 0
+        if size:
+            return size
+
+    return _hub_weights_size(model)
+
+
+def _check_rss_budget(max_rss: int) -> int:
+    # the budget cannot be enforced without measuring the current resident memory
+    if max_rss and not utils.get_rss():
+        logger.warning(
+            "The resident memory of the host cannot be measured on this platform, "
+            "memory budget disabled. Install psutil with `pip install hulse[memory]`."
+        )
+        return 0
+    return max_rss
+
+
+class PipelineCache(LRUCache):
+    """Process-wide cache of loaded Hugging Face pipelines.
+
+    Pipelines are keyed by task, model and pipeline keyword arguments, and the
+    least recently used ones are evicted when the number of cached pipelines or
+    their estimated memory footprint exceeds the configured budget.
+
+    With a resident memory budget, loads are serialized to measure the
+    resident memory taken by each pipeline. Least recently used pipelines are
+    unloaded until the next one fits in the budget, and pipelines which cannot
+    fit, even once all unpinned pipelines are unloaded, are refused. Their
+    size is estimated from their weight files before they are loaded, then
+    measured once loaded.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = settings.PIPELINE_CACHE_SIZE,
+        max_memory: int = settings.PIPELINE_CACHE_MEMORY,
+        loader: Callable = load_pipeline,
+        max_rss: int = settings.HOST_MAX_MEMORY,
+        mmap_weights: bool = settings.PIPELINE_MMAP_WEIGHTS,
+        estimator: Callable = estimate_weights_size,
+    ):
+        """Create a new pipeline cache.
+
+        :param max_entries: Maximum number of cached pipelines, defaults to settings.PIPELINE_CACHE_SIZE
+        :type max_entries: int, optional
+        :param max_memory: Maximum memory used by cached pipelines in bytes, 0 for no limit, defaults to settings.PIPELINE_CACHE_MEMORY
+        :type max_memory: int, optional
+        :param loader: Callable building a pipeline, defaults to load_pipeline
+        :type loader: Callable, optional
+        :param max_rss: Maximum resident memory of the process in bytes, 0 for no
+            limit, disabled if it cannot be measured, see :func:`hulse.utils.get_rss`,
+            defaults to settings.HOST_MAX_MEMORY
+        :type max_rss: int, optional
+        :param mmap_weights: Whether loaders only load weights from memory-mapped
+            safetensors files, see :func:`load_pipeline`, defaults to settings.PIPELINE_MMAP_WEIGHTS
+        :type mmap_weights: bool, optional
+        :param estimator: Callable estimating the size of a model from its name
+            before loading it, 0 if unknown, defaults to estimate_weights_size
+        :type estimator: Callable, optional
+        """
+        super().__init__(max_entries=max_entries)
+        self.max_memory = max_memory
+        self.loader = loader
+        self.max_rss = _check_rss_budget(max_rss)
+        self.mmap_weights = mmap_weights
+        self.estimator = estimator
+        self.memory = 0
+        # duration of the last load of each cached pipeline, in seconds
+        self.load_times = {}
+        # resident memory measured when loading each pipeline, in bytes, kept
+        # once unloaded to refuse reloading pipelines which cannot fit
+        self.resident = {}
+        self._sizes = {}
+        self._loading = {}
+        self._load_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(task: str, model: str = None, **kwargs) -> tuple:
+        """Build the cache key of a pipeline.
+
+        :param task: Transformer task of the pipeline.
+        :type task: str
+        :param model: Model of the pipeline, defaults to None
+        :type model: str, optional
+        :return: Hashable cache key.
+        :rtype: tuple
+        """
+        return task, model, json.dumps(kwargs, sort_keys=True, default=str)
+
+    def get_pipeline(self, task: str, model: str = None, **kwargs) -> Any:
+        """Get a pipeline from the cache, loading it on a miss.
+
+        Concurrent requests for the same pipeline wait for a single load.
+
+        :param task: Transformer task to be performed.
+        :type task: str
+        :param model: Model to be used, defaults to None for the task default.
+        :type model: str, optional
+        :return: The loaded pipeline.
+        :rtype: Any
+        """
+        key = self.make_key(task, model, **kwargs)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            loading = self._loading.setdefault(key, threading.Lock())
+
+        with loading:
+            with self._lock:
+                if key in self._entries:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    return self._entries[key]
+                self.misses += 1
+
+            try:
+                start = time.monotonic()
+                pipe = self._load(key, task, model, **kwargs)
+                self.put(key, pipe)
+                with self._lock:
+                    if key in self._entries:
+                        self.load_times[key] = time.monotonic() - start
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+
+        return pipe
+
+    def _load(self, key: tuple, task: str, model: str = None, **kwargs) -> Any:
+        if self.mmap_weights:
+            kwargs["mmap_weights"] = True
+        if not self.max_rss:
+            return self.loader(task=task, model=model, **kwargs)
+
+        # estimate outside of the lock, as it may look weights up on the hub
+        estimate = self.resident.get(key) or self.estimator(model)
+        with self._load_lock:
+            # refuse pipelines which cannot fit before loading them, from the
+            # size measured by a previous load or estimated from their weights
+            size = self.resident.get(key) or estimate
+            self._make_room(task, model, size)
+            rss = utils.get_rss()
+            pipe = self.loader(task=task, model=model, **kwargs)
+            size = max(utils.get_rss() - rss, estimate_pipeline_memory(pipe))
+            self.resident[key] = size
+            try:
+                # make room for the pipeline now that its size is known
+                self._make_room(task, model)
+            except errors.MemoryBudgetError:
+                del pipe
+                utils.release_memory()
+                raise
+            return pipe
+
+    def _make_room(self, task: str, model: str = None, size: int = 0):
+        # unload least recently used pipelines until the resident memory of
+        # the process, plus the size of a pipeline to load, fits the budget
+        with self._lock:
+            rss = utils.get_rss()
+            sizes = {
+                key: self.resident.get(key, self._sizes.get(key, 0))
+                for key in self._entries
+                if key not in self._pinned
+            }
+            # refuse pipelines which cannot fit before unloading anything
+            if rss - sum(sizes.values()) + size > self.max_rss:
+                raise errors.MemoryBudgetError(
+                    task, model, rss - sum(sizes.values()) + size, self.max_rss
+                )
+            evicted = False
+            for key in sizes:
+                if rss + size <= self.max_rss:
+                    break
+                rss -= sizes[key]
+                del self._entries[key]
+                self._on_evict(key)
+                self.evictions += 1
+                evicted = True
+                logger.info("Unloaded %s pipeline %s to free memory", key[0], key[1])
+        if evicted:
+            utils.release_memory()
+
+    def preload(
+        self, task: str, model: str = None, warmup_input: Any = None, **kwargs
+    ) -> Any:
+        """Load a pipeline, pin it in the cache and run a warm-up inference.
+
+        :param task: Transformer task to be performed.
+        :type task: str
+        :param model: Model to be used, defaults to None for the task default.
+        :type model: str, optional
+        :param warmup_input: Sample input of the task, dicts are passed as
+            keyword arguments, defaults to None for no warm-up.
+        :type warmup_input: Any, optional
+        :return: The loaded pipeline.
+        :rtype: Any
+        """
+        pipe = self.get_pipeline(task, model, **kwargs)
+        self.pin(self.make_key(task, model, **kwargs))
+        if isinstance(warmup_input, dict):
+            pipe(**warmup_input)
+        elif warmup_input is not None:
+            pipe(warmup_input)
+        return pipe
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self.memory -= self._sizes.pop(key, 0)
+            self._sizes[key] = estimate_pipeline_memory(value)
+            self.memory += self._sizes[key]
+            super().put(key, value)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            self.memory -= self._sizes.pop(key, 0)
+            self.load_times.pop(key, None)
+            return super().pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self._sizes.clear()
+            self.load_times.clear()
+            self.memory = 0
+
+    def configure(
+        self,
+        max_entries: int = None,
+        max_memory: int = None,
+        loader: Callable = None,
+        max_rss: int = None,
+        mmap_weights: bool = None,
+    ):
+        """Update the cache budget, evicting pipelines if needed.
+
+        :param max_entries: Maximum number of cached pipelines, defaults to None (unchanged)
+        :type max_entries: int, optional
+        :param max_memory: Maximum memory used by cached pipelines in bytes, defaults to None (unchanged)
+        :type max_memory: int, optional
+        :param loader: Callable building the pipelines loaded from now on, defaults to None (unchanged)
+        :type loader: Callable, optional
+        :param max_rss: Maximum resident memory of the process in bytes, defaults to None (unchanged)
+        :type max_rss: int, optional
+        :param mmap_weights: Whether loaders only load memory-mapped weights, defaults to None (unchanged)
+        :type mmap_weights: bool, optional
+        """
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_memory is not None:
+                self.max_memory = max_memory
+            if loader is not None:
+                self.loader = loader
+            if max_rss is not None:
+                self.max_rss = _check_rss_budget(max_rss)
+            if mmap_weights is not None:
+                self.mmap_weights = mmap_weights
+            self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = super().stats()
+            stats.update(
+                memory=self.memory,
+                max_memory=self.max_memory,
+                resident=sum(self.resident.get(key, 0) for key in self._entries),
+                max_rss=self.max_rss,
+            )
+            return stats
+
+    def pipelines(self) -> dict:
+        """Get the load time and resident memory of each cached pipeline.
+
+        :return: Duration of the last load in seconds and resident memory in
+            bytes of each pipeline, None if unknown, keyed by cache key.
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                key: dict(
+                    load_time=self.load_times.get(key),
+                    resident=self.resident.get(key),
+                )
+                for key in self._entries
+            }
+
+    def _over_budget(self) -> bool:
+        if self.max_memory and self.memory > self.max_memory:
+            return True
+        return super()._over_budget()
+
+    def _on_evict(self, key: Hashable):
+        self.memory -= self._sizes.pop(key, 0)
+        self.load_times.pop(key, None)
+
+
+# long-lived pipeline cache shared by the whole host process
+pipeline_cache = PipelineCache()
@@ -3,7 +3,7 @@ import json
 import webbrowser
 import time
 
-from hulse import utils, settings, errors
+from hulse import utils, settings, errors, cache, producer, backends
 
 
 @click.group()
@@ -13,15 +13,305 @@ def cli():
 
 
 @cli.command()
-def host():
+@click.option(
+    "--cache-size",
+    metavar="N",
+    type=int,
+    default=settings.PIPELINE_CACHE_SIZE,
+    show_default=True,
+    help="Maximum number of pipelines kept loaded in memory",
+)
+@click.option(
+    "--cache-memory",
+    metavar="SIZE",
+    default=str(settings.PIPELINE_CACHE_MEMORY),
+    show_default=True,
+    help="Maximum memory used by loaded pipelines (e.g. 4GB), 0 for no limit",
+)
+@click.option(
+    "--max-memory",
+    metavar="SIZE",
+    default=str(settings.HOST_MAX_MEMORY),
+    show_default=True,
+    help="Resident memory budget of the host (e.g. 8GB), unloading least recently used pipelines, 0 for no limit",
+)
+@click.option(
+    "--mmap-weights",
+    is_flag=True,
+    default=settings.PIPELINE_MMAP_WEIGHTS,
+    help="Load weights from memory-mapped safetensors files, for fast reloads of unloaded pipelines",
+)
+@click.option(
+    "--workers",
+    metavar="N",
+    type=int,
+    default=settings.HOST_WORKERS,
+    show_default=True,
+    help="Number of inference workers",
+)
+@click.option(
+    "--worker-type",
+    type=click.Choice(settings.HOST_WORKER_TYPES),
+    default=settings.HOST_WORKER_TYPE,
+    show_default=True,
+    help="Run inferences on threads or processes",
+)
+@click.option(
+    "--post-workers",
+    metavar="N",
+    type=int,
+    default=settings.HOST_POST_WORKERS,
+    show_default=True,
+    help="Number of threads posting results back to the server",
+)
+@click.option(
+    "--batch-size",
+    metavar="N",
+    type=int,
+    default=settings.HOST_BATCH_SIZE,
+    show_default=True,
+    help="Maximum number of text classification queries run as one batch",
+)
+@click.option(
+    "--batch-wait-ms",
+    metavar="MS",
+    type=float,
+    default=settings.HOST_BATCH_WAIT_MS,
+    show_default=True,
+    help="Maximum time a query waits for its batch to fill up",
+)
+@click.option(
+    "--result-cache-size",
+    metavar="N",
+    type=int,
+    default=settings.HOST_RESULT_CACHE_SIZE,
+    show_default=True,
+    help="Maximum number of memoized inference results, 0 to disable",
+)
+@click.option(
+    "--result-cache-ttl",
+    metavar="SECONDS",
+    type=float,
+    default=settings.HOST_RESULT_CACHE_TTL,
+    show_default=True,
+    help="Time to live of memoized inference results",
+)
+@click.option(
+    "--queue-size",
+    metavar="N",
+    type=int,
+    default=settings.HOST_QUEUE_SIZE,
+    show_default=True,
+    help="Maximum number of queries waiting for a worker, 0 for no limit",
+)
+@click.option(
+    "--queue-policy",
+    type=click.Choice(settings.HOST_QUEUE_POLICIES),
+    default=settings.HOST_QUEUE_POLICY,
+    show_default=True,
+    help="Reject new queries as busy, shed the oldest or pause reading once the queue is full",
+)
+@click.option(
+    "--max-reconnects",
+    metavar="N",
+    type=int,
+    default=settings.HOST_MAX_RECONNECTS,
+    show_default=True,
+    help="Maximum number of consecutive failed reconnects to the server, -1 for no limit",
+)
+@click.option(
+    "--max-new-tokens",
+    metavar="N",
+    type=int,
+    default=settings.HOST_MAX_NEW_TOKENS,
+    show_default=True,
+    help="Maximum number of tokens generated by a query, 0 for no limit",
+)
+@click.option(
+    "--max-input-length",
+    metavar="CHARS",
+    type=int,
+    default=settings.HOST_MAX_INPUT_LENGTH,
+    show_default=True,
+    help="Maximum number of characters of each input text, 0 for no limit",
+)
+@click.option(
+    "--encoding",
+    type=click.Choice(settings.WIRE_ENCODINGS),
+    default=settings.WIRE_ENCODING,
+    help="Compact wire format of queries and results, if supported by the server",
+)
+@click.option(
+    "--compression",
+    type=click.Choice(settings.WIRE_COMPRESSIONS),
+    default=settings.WIRE_COMPRESSION,
+    help="Compression of large queries and results in the compact wire format",
+)
+@click.option(
+    "--metrics-port",
+    metavar="PORT",
+    type=int,
+    default=settings.HOST_METRICS_PORT,
+    show_default=True,
+    help="Port of the local Prometheus metrics endpoint, 0 to disable it",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Sample the host and write a flamegraph of where its time goes",
+)
+@click.option(
+    "--profile-duration",
+    metavar="SECONDS",
+    type=float,
+    default=settings.HOST_PROFILE_DURATION,
+    show_default=True,
+    help="Duration of the profile, 0 to profile until the host stops",
+)
+@click.option(
+    "--profile-output",
+    metavar="PATH",
+    default=settings.HOST_PROFILE_OUTPUT,
+    show_default=True,
+    help="Path of the profile, written to PATH.folded and PATH.txt",
+)
+@click.option(
+    "--backend",
+    type=click.Choice(settings.HOST_BACKENDS),
+    default=settings.HOST_BACKEND,
+    show_default=True,
+    help='Inference backend of models without a backend in the "backends" map of the host config',
+)
+@click.option(
+    "--preload",
+    metavar="TASK[:MODEL]",
+    multiple=True,
+    default=settings.HOST_PRELOAD,
+    help="Pipeline loaded, warmed up and pinned in memory before connecting, may be repeated",
+)
+@click.option(
+    "--config",
+    "config_path",
+    type=click.Path(dir_okay=False),
+    default=str(settings.HOST_CONFIG_PATH),
+    show_default=True,
+    help='JSON host config file, with a "preload" list of pipelines and a "backends" map',
+)
+def host(
+    cache_size,
+    cache_memory,
+    max_memory,
+    mmap_weights,
+    workers,
+    worker_type,
+    post_workers,
+    batch_size,
+    batch_wait_ms,
+    result_cache_size,
+    result_cache_ttl,
+    queue_size,
+    queue_policy,
+    max_reconnects,
+    max_new_tokens,
+    max_input_length,
+    encoding,
+    compression,
+    metrics_port,
+    profile,
+    profile_duration,
+    profile_output,
+    backend,
+    preload,
+    config_path,
+):
     """Run the Hulse host."""
     if not settings.CONFIG.get("api_key"):
         click.echo(
             f"It seems like you're not logged in 😢. Please run `hulse login` first."
         )
     else:
+        host_config = settings.load_host_config(config_path)
+        cache.pipeline_cache.configure(
+            max_entries=cache_size,
+            max_memory=utils.parse_size(cache_memory),
+            loader=backends.BackendLoader(backend, host_config.get("backends")),
+            max_rss=utils.parse_size(max_memory),
+            mmap_weights=mmap_weights,
+        )
+        preload = host_config.get("preload", []) + list(preload)
+        if preload:
+            click.echo(f"Preloading {len(preload)} pipeline(s) 🔥...")
         click.echo(f"Starting your Hulse host 🚀 🛠 🔭!")
-        utils.run_host(api_key=settings.CONFIG.get("api_key"))
+        producer.run_host(
+            api_key=settings.CONFIG.get("api_key"),
+            workers=workers,
+            worker_type=worker_type,
+            post_workers=post_workers,
+            batch_size=batch_size,
+            batch_wait_ms=batch_wait_ms,
+            result_cache_size=result_cache_size,
+            result_cache_ttl=result_cache_ttl,
+            queue_size=queue_size,
+            queue_policy=queue_policy,
+            max_reconnects=max_reconnects,
+            max_new_tokens=max_new_tokens,
+            max_input_length=max_input_length,
+            encoding=encoding,
+            compression=compression,
+            metrics_port=metrics_port,
+            profile=profile,
+            profile_duration=profile_duration,
+            profile_output=profile_output,
+            preload=preload,
+        )
+
+
+@cli.command()
+@click.option(
+    "--task",
+    type=click.Choice(settings.SUPPORTED_TASKS),
+    required=True,
+    help="Transformer task of the model",
+)
+@click.option(
+    "--model", metavar="MODEL", help="Model to compare, defaults to the task default"
+)
+@click.option(
+    "--backend",
+    "backend_names",
+    type=click.Choice(settings.HOST_BACKENDS),
+    multiple=True,
+    help="Backend to compare, may be repeated, defaults to all backends",
+)
+@click.option(
+    "--inputs",
+    "inputs_path",
+    type=click.Path(exists=True, dir_okay=False),
+    help="JSON file with a list of inputs, defaults to a sample input of the task",
+)
+@click.option(
+    "--runs",
+    metavar="N",
+    type=int,
+    default=10,
+    show_default=True,
+    help="Number of times each input is run",
+)
+def compare_backends(task, model, backend_names, inputs_path, runs):
+    """Compare the latency and accuracy of a model with each inference backend."""
+    inputs = None
+    if inputs_path:
+        with open(inputs_path) as f:
+            inputs = json.load(f)
+    # outputs are compared with those of the default backend
+    names = settings.HOST_BACKENDS
+    if backend_names:
+        names = ["default"] + [name for name in backend_names if name != "default"]
+    click.echo(f"Comparing {len(names)} backend(s) for {task} 🏎...")
+    rows = backends.compare_backends(
+        task, model, backends=names, inputs=inputs, runs=runs
+    )
+    click.echo(backends.format_report(rows))
 
 
 @cli.command()
@@ -1,42 +1,317 @@
-from typing import Union
+import copy
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, Union
 
-from hulse import settings, errors, utils
+from hulse import settings, errors, tracing, utils
+from hulse.cache import ResultCache
+from hulse.encoding import WireFormat
+from hulse.sessions import SessionPool
 
 
 class Hulse:
     def __init__(
         self,
         api_key: str,
+        pool_size: int = settings.HTTP_POOL_SIZE,
+        retries: int = settings.HTTP_RETRIES,
+        backoff: float = settings.HTTP_BACKOFF,
+        cache: Union[bool, ResultCache] = False,
+        encoding: str = settings.WIRE_ENCODING,
+        compression: str = settings.WIRE_COMPRESSION,
     ):
         """Create a new Hulse client.
 
+        Requests of the client share pooled keep-alive HTTP sessions, so that
+        connections to the Hulse servers are reused between queries.
+
         :param api_key: Your Hulse API key to run queries
         :type api_key: str
+        :param pool_size: Maximum number of connections kept open per server, defaults to settings.HTTP_POOL_SIZE
+        :type pool_size: int, optional
+        :param retries: Maximum number of retries of a failed request, defaults to settings.HTTP_RETRIES
+        :type retries: int, optional
+        :param backoff: Backoff factor between retries in seconds, defaults to settings.HTTP_BACKOFF
+        :type backoff: float, optional
+        :param cache: Cache results of identical queries, either True for an
+            in-memory cache or a configured ResultCache, defaults to False
+        :type cache: Union[bool, ResultCache], optional
+        :param encoding: Compact wire format of queries and results, either json
+            or msgpack, defaults to settings.WIRE_ENCODING
+        :type encoding: str, optional
+        :param compression: Compression of large queries and results in the compact
+            wire format, either gzip or zstd, defaults to settings.WIRE_COMPRESSION
+        :type compression: str, optional
         """
         self.api_key = api_key
+        self.sessions = SessionPool(
+            pool_size=pool_size, retries=retries, backoff=backoff
+        )
+        if cache is True:
+            cache = ResultCache()
+        self.cache = cache if isinstance(cache, ResultCache) else None
+        self.wire_format = WireFormat(encoding, compression) if encoding else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the open connections of the client."""
+        self.sessions.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def cache_stats(self) -> dict:
+        """Get the statistics of the result cache.
+
+        :return: Number of cached results, hits, misses and hit rate, empty if caching is disabled.
+        :rtype: dict
+        """
+        return self.cache.stats() if self.cache is not None else {}
 
     def query(
         self,
         data: Union[str, list],
         task: str = None,
         model: str = None,
+        timeout: float = settings.QUERY_TIMEOUT,
+        connect_timeout: float = settings.QUERY_CONNECT_TIMEOUT,
+        first_byte_timeout: float = settings.QUERY_FIRST_BYTE_TIMEOUT,
         **kwargs,
     ) -> dict:
         """Run an inference query on a Hulse cluster.
 
-        Note that we don't support HF pipeline batching as of now, since all
-        inferences are performed on CPU. HF does not recommend batching on CPU.
+        Note that hosts may run concurrent text classification queries for the
+        same model as a single pipeline batch, when micro-batching is enabled
+        with `hulse host --batch-size`.
 
         :param task: Task to be performed. Corresponds to the model you
             want to use.
         :type task: str
         :param data: Data to be inferred upon by the target model.
         :type data: Any
+        :param timeout: Total timeout of the query in seconds, after which hosts
+            drop it, defaults to settings.QUERY_TIMEOUT
+        :type timeout: float, optional
+        :param connect_timeout: Timeout of the connection to the stream server, defaults to settings.QUERY_CONNECT_TIMEOUT
+        :type connect_timeout: float, optional
+        :param first_byte_timeout: Timeout for the stream server to start responding, defaults to settings.QUERY_FIRST_BYTE_TIMEOUT
+        :type first_byte_timeout: float, optional
+        :param kwargs: Keyword arguments of the pipeline call, such as
+            max_new_tokens or top_k, see settings.TASK_KWARGS. Hosts bound the
+            arguments driving the cost of a query, see `hulse host --max-new-tokens`.
+        :raises errors.UnsupportedArgumentError: If an argument is not supported by the task.
+        :raises errors.QueryTimeoutError: If the query timed out.
+        :raises errors.InferenceError: If the inference of the query failed on its host.
+        :return: The answer of the query, whose result is the complete pipeline
+            output, such as every generated sequence or top-k label, and a list
+            of the result of each item for list data. Its trace holds the spans
+            of the stages of the query, see :mod:`hulse.tracing`.
+        :rtype: dict
+        """
+        if task and task not in settings.SUPPORTED_TASKS:
+            raise errors.UnsupportedTaskError(task)
+        utils.validate_kwargs(task, kwargs)
+
+        if self.cache is not None:
+            trace = tracing.Trace()
+            key = ResultCache.make_key(task, model, data, **kwargs)
+            result = self.cache.get(key)
+            if result is not None:
+                return utils.cached_answer(result, trace)
+
+        answer = utils.post_query(
+            task,
+            data,
+            model,
+            self.api_key,
+            sessions=self.sessions,
+            timeout=timeout,
+            connect_timeout=connect_timeout,
+            first_byte_timeout=first_byte_timeout,
+            wire_format=self.wire_format,
+            kwargs=kwargs,
+        )
+        if self.cache is not None and answer is not None:
+            # answers are cached without the id and trace of their query
+            self.cache.put(key, copy.deepcopy(answer["result"]))
+        return answer
+
+    def stream_query(
+        self,
+        data: str,
+        task: str = "text-generation",
+        model: str = None,
+        timeout: float = settings.QUERY_TIMEOUT,
+        connect_timeout: float = settings.QUERY_CONNECT_TIMEOUT,
+        first_byte_timeout: float = settings.QUERY_FIRST_BYTE_TIMEOUT,
+        **kwargs,
+    ) -> Iterator:
+        """Run a text generation query, yielding the generated text as it comes.
+
+        Hosts send the tokens generated since their previous post, so that the
+        first tokens arrive long before the generation completes. Hosts which
+        cannot stream the query answer the whole text at once.
+
+        :param data: Prompt of the generation.
+        :type data: str
+        :param task: Either text-generation or text2text-generation, defaults to "text-generation"
+        :type task: str, optional
+        :param model: Model to be used, defaults to None
+        :type model: str, optional
+        :param timeout: Total timeout of the query in seconds, defaults to settings.QUERY_TIMEOUT
+        :type timeout: float, optional
+        :param connect_timeout: Timeout of the connection to the stream server, defaults to settings.QUERY_CONNECT_TIMEOUT
+        :type connect_timeout: float, optional
+        :param first_byte_timeout: Timeout for the stream server to start responding, defaults to settings.QUERY_FIRST_BYTE_TIMEOUT
+        :type first_byte_timeout: float, optional
+        :param kwargs: Keyword arguments of the pipeline call, see :meth:`query`.
+        :raises errors.UnsupportedTaskError: If the task does not generate text.
+        :raises errors.UnsupportedArgumentError: If an argument is not supported by the task.
+        :raises errors.QueryTimeoutError: If the query timed out.
+        :raises errors.InferenceError: If the inference of the query failed on its host.
+        :return: Iterator over the chunks of generated text, the prompt excluded.
+        :rtype: Iterator
+        """
+        if task not in settings.STREAMING_TASKS:
+            raise errors.UnsupportedTaskError(task)
+        utils.validate_kwargs(task, kwargs)
+
+        streamed = False
+        for answer in utils.stream_query(
+            task,
+            data,
+            model,
+            self.api_key,
+            sessions=self.sessions,
+            timeout=timeout,
+            connect_timeout=connect_timeout,
+            first_byte_timeout=first_byte_timeout,
+            wire_format=self.wire_format,
+            kwargs=kwargs,
+        ):
+            if "token" in answer:
+                streamed = True
+                yield answer["token"]
+            elif not streamed:
+                text = utils.generated_text(answer.get("result"))
+                if text:
+                    yield text
+
+    def iter_query(
+        self,
+        items: Iterable,
+        task: str = None,
+        model: str = None,
+        concurrency: int = settings.QUERY_CONCURRENCY,
+        ordered: bool = True,
+        return_exceptions: bool = False,
+        **kwargs,
+    ) -> Iterator:
+        """Run an inference query for each item, with a bounded number of queries in flight.
+
+        Items are consumed lazily, so that arbitrarily large iterables can be
+        streamed through a Hulse cluster.
+
+        :param items: Data of each query.
+        :type items: Iterable
+        :param task: Task to be performed, defaults to None
+        :type task: str, optional
+        :param model: Model to be used, defaults to None
+        :type model: str, optional
+        :param concurrency: Maximum number of queries in flight, defaults to settings.QUERY_CONCURRENCY
+        :type concurrency: int, optional
+        :param ordered: Yield results in the order of the items rather than as
+            they complete, in which case (index, result) tuples are yielded, defaults to True
+        :type ordered: bool, optional
+        :param return_exceptions: Yield the exception of failed queries instead of raising it, defaults to False
+        :type return_exceptions: bool, optional
+        :return: Iterator over the query results.
+        :rtype: Iterator
         """
         if task and task not in settings.SUPPORTED_TASKS:
             raise errors.UnsupportedTaskError(task)
 
-        return utils.post_query(task, data, model, self.api_key)
+        items = enumerate(items)
+        executor = ThreadPoolExecutor(
+            max_workers=max(1, concurrency), thread_name_prefix="hulse-query"
+        )
+        pending = {}
+        in_order = deque()
+
+        def submit_next():
+            for index, item in items:
+                future = executor.submit(
+                    self.query, data=item, task=task, model=model, **kwargs
+                )
+                pending[future] = index
+                if ordered:
+                    in_order.append(future)
+                return
+
+        def get_result(future):
+            try:
+                return future.result()
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                return e
+
+        try:
+            for _ in range(max(1, concurrency)):
+                submit_next()
+
+            while pending:
+                if ordered:
+                    done = [in_order.popleft()]
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    index = pending.pop(future)
+                    result = get_result(future)
+                    submit_next()
+                    yield result if ordered else (index, result)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def query_batch(
+        self,
+        items: Iterable,
+        task: str = None,
+        model: str = None,
+        concurrency: int = settings.QUERY_CONCURRENCY,
+        return_exceptions: bool = False,
+        **kwargs,
+    ) -> list:
+        """Run an inference query for each item, with a bounded number of queries in flight.
+
+        :param items: Data of each query.
+        :type items: Iterable
+        :param task: Task to be performed, defaults to None
+        :type task: str, optional
+        :param model: Model to be used, defaults to None
+        :type model: str, optional
+        :param concurrency: Maximum number of queries in flight, defaults to settings.QUERY_CONCURRENCY
+        :type concurrency: int, optional
+        :param return_exceptions: Return the exception of failed queries instead of raising it, defaults to False
+        :type return_exceptions: bool, optional
+        :return: Result of each query, in the order of the items.
+        :rtype: list
+        """
+        return list(
+            self.iter_query(
+                items,
+                task=task,
+                model=model,
+                concurrency=concurrency,
+                return_exceptions=return_exceptions,
+                **kwargs,
+            )
+        )
 
     def set_api_key(self, api_key: str):
         """Set the Hulse API key.
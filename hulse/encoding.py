@@ -0,0 +1,246 @@
+import gzip
+import json
+import struct
+from typing import Any, Iterable, Iterator, NamedTuple
+
+from hulse import settings
+
+# media types of the compact wire format, streams and bodies are made of frames
+CONTENT_TYPES = {
+    "json": "application/vnd.hulse.json",
+    "msgpack": "application/vnd.hulse.msgpack",
+}
+COMPRESSION_HEADER = "Hulse-Compression"
+
+# frame header: payload length, flags and event id (0 for none), a frame
+# without payload is a keep-alive
+FRAME_HEADER = struct.Struct(">IBI")
+COMPRESSED = 0x01
+KEEP_ALIVE = FRAME_HEADER.pack(0, 0, 0)
+
+
+class Message(NamedTuple):
+    """Message decoded from a frame by :class:`FrameParser`."""
+
+    data: Any
+    id: str = None
+
+
+def _import_optional(name: str, extra: str):
+    try:
+        return __import__(name)
+    except ImportError as e:
+        raise ImportError(
+            f"The {extra} wire format requires {name}, install it with `pip install hulse[{extra}]`."
+        ) from e
+
+
+class WireFormat:
+    """Compact wire format of queries and results.
+
+    Objects are encoded with json or msgpack into frames prefixed with their
+    length, so that streams need no text framing and bodies no form encoding.
+    Frames larger than `min_compress_size` are compressed with gzip or zstd,
+    small frames are sent as is since compressing them costs more than it saves.
+    """
+
+    def __init__(
+        self,
+        encoding: str = "json",
+        compression: str = None,
+        min_compress_size: int = settings.WIRE_COMPRESS_MIN_SIZE,
+    ):
+        """Create a new wire format.
+
+        :param encoding: Either json or msgpack, defaults to "json"
+        :type encoding: str, optional
+        :param compression: Either gzip or zstd, defaults to None for no compression
+        :type compression: str, optional
+        :param min_compress_size: Size from which frames are compressed in bytes, defaults to settings.WIRE_COMPRESS_MIN_SIZE
+        :type min_compress_size: int, optional
+        :raises ValueError: If the encoding or the compression is not supported.
+        :raises ImportError: If the optional dependency of the encoding or the compression is missing.
+        """
+        if encoding not in settings.WIRE_ENCODINGS:
+            raise ValueError(f"Unsupported wire encoding {encoding}.")
+        if compression is not None and compression not in settings.WIRE_COMPRESSIONS:
+            raise ValueError(f"Unsupported wire compression {compression}.")
+
+        self.encoding = encoding
+        self.compression = compression
+        self.min_compress_size = min_compress_size
+
+        if encoding == "msgpack":
+            msgpack = _import_optional("msgpack", "msgpack")
+            self._dumps = lambda obj: msgpack.packb(obj, use_bin_type=True)
+            self._loads = lambda data: msgpack.unpackb(data, raw=False)
+        else:
+            self._dumps = lambda obj: json.dumps(obj, separators=(",", ":")).encode()
+            self._loads = json.loads
+
+        if compression == "zstd":
+            zstandard = _import_optional("zstandard", "zstd")
+            self._compress = zstandard.compress
+            self._decompress = zstandard.decompress
+        elif compression == "gzip":
+            self._compress = lambda data: gzip.compress(data, compresslevel=6, mtime=0)
+            self._decompress = gzip.decompress
+        else:
+            self._compress = self._decompress = None
+
+    def __repr__(self) -> str:
+        return f"WireFormat({self.encoding!r}, {self.compression!r})"
+
+    @property
+    def content_type(self) -> str:
+        """Media type of bodies and streams in this format."""
+        return CONTENT_TYPES[self.encoding]
+
+    def accept_headers(self) -> dict:
+        """Headers asking the server to respond in this format.
+
+        :return: Accept and compression headers.
+        :rtype: dict
+        """
+        headers = {"Accept": self.content_type}
+        if self.compression:
+            headers[COMPRESSION_HEADER] = self.compression
+        return headers
+
+    def headers(self) -> dict:
+        """Headers of a body sent in this format, asking for a response in the same format.
+
+        :return: Content type, accept and compression headers.
+        :rtype: dict
+        """
+        return {"Content-Type": self.content_type, **self.accept_headers()}
+
+    @classmethod
+    def from_headers(cls, headers, field: str = "Content-Type") -> "WireFormat":
+        """Read the wire format of a request or a response from its headers.
+
+        :param headers: Headers of the request or the response.
+        :type headers: Mapping
+        :param field: Header naming the media type, defaults to "Content-Type"
+        :type field: str, optional
+        :return: The wire format, None for the legacy format or an unsupported compression.
+        :rtype: WireFormat
+        """
+        content_type = (headers.get(field) or "").split(";")[0].strip()
+        compression = headers.get(COMPRESSION_HEADER) or None
+        for encoding, media_type in CONTENT_TYPES.items():
+            if content_type == media_type:
+                try:
+                    return cls(encoding, compression)
+                except (ValueError, ImportError):
+                    return None
+        return None
+
+    def encode(self, obj: Any, event_id: int = None) -> bytes:
+        """Encode an object into a frame.
+
+        :param obj: Object to encode, made of JSON types.
+        :type obj: Any
+        :param event_id: Id of the event carried by the frame, defaults to None
+        :type event_id: int, optional
+        :return: Frame, header included.
+        :rtype: bytes
+        """
+        payload = self._dumps(obj)
+        flags = 0
+        if self._compress is not None and len(payload) >= self.min_compress_size:
+            payload = self._compress(payload)
+            flags |= COMPRESSED
+        return FRAME_HEADER.pack(len(payload), flags, event_id or 0) + payload
+
+    def decode(self, body: bytes) -> Any:
+        """Decode a body made of a single frame.
+
+        :param body: Body of a request or a response.
+        :type body: bytes
+        :raises ValueError: If the body is not a complete frame.
+        :return: Decoded object.
+        :rtype: Any
+        """
+        messages = self.parser().feed(body)
+        if len(messages) != 1:
+            raise ValueError("Body is not a single frame.")
+        return messages[0].data
+
+    def loads(self, payload: bytes, flags: int = 0) -> Any:
+        """Decode the payload of a frame.
+
+        :param payload: Payload of the frame, without its header.
+        :type payload: bytes
+        :param flags: Flags of the frame header, defaults to 0
+        :type flags: int, optional
+        :raises ValueError: If the frame is compressed with an unknown compression.
+        :return: Decoded object.
+        :rtype: Any
+        """
+        if flags & COMPRESSED:
+            if self._decompress is None:
+                raise ValueError("Compressed frame without a negotiated compression.")
+            payload = self._decompress(payload)
+        return self._loads(payload)
+
+    def parser(self) -> "FrameParser":
+        """Create an incremental parser of a stream in this format.
+
+        :return: Frame parser.
+        :rtype: FrameParser
+        """
+        return FrameParser(self)
+
+    def iter_messages(self, chunks: Iterable) -> Iterator:
+        """Parse the messages of a stream in this format.
+
+        :param chunks: Raw byte chunks of the stream, such as :func:`hulse.sse.iter_chunks`.
+        :type chunks: Iterable
+        :return: Iterator over the decoded messages, keep-alives excluded.
+        :rtype: Iterator
+        """
+        parser = self.parser()
+        for chunk in chunks:
+            yield from parser.feed(chunk)
+
+
+class FrameParser:
+    """Incremental parser of a stream of length-prefixed frames."""
+
+    def __init__(self, wire_format: WireFormat):
+        """Create a new parser.
+
+        :param wire_format: Format of the stream.
+        :type wire_format: WireFormat
+        """
+        self.wire_format = wire_format
+        self._buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> list:
+        """Parse a chunk of the stream.
+
+        :param chunk: Raw bytes, possibly cut in the middle of a frame.
+        :type chunk: bytes
+        :return: Messages completed by the chunk, keep-alives excluded.
+        :rtype: list
+        """
+        buffer = self._buffer
+        buffer += chunk
+        messages = []
+        offset = 0
+        header_size = FRAME_HEADER.size
+        while len(buffer) - offset >= header_size:
+            length, flags, event_id = FRAME_HEADER.unpack_from(buffer, offset)
+            end = offset + header_size + length
+            if end > len(buffer):
+                break
+            if length:
+                data = self.wire_format.loads(
+                    bytes(buffer[offset + header_size : end]), flags
+                )
+                messages.append(Message(data, str(event_id) if event_id else None))
+            offset = end
+        if offset:
+            del buffer[:offset]
+        return messages
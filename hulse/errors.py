@@ -7,13 +7,60 @@ class UnsupportedTaskError(Exception):
         self.expression = expression
 
 
+class UnsupportedArgumentError(Exception):
+    def __init__(self, task: str, argument: str, expression: Any = None):
+        self.message = (
+            f"The argument provided ({argument}) is not supported by the task {task}."
+        )
+        self.task = task
+        self.argument = argument
+        self.expression = expression
+
+
 class UnsufficientResources(Exception):
     def __init__(self, expression: Any = None):
         self.message = f"No running cluster resource was found."
         self.expression = expression
 
 
+class HostBusyError(UnsufficientResources):
+    def __init__(self, expression: Any = None):
+        self.message = f"All running cluster resources are busy."
+        self.expression = expression
+
+
+class InferenceError(Exception):
+    def __init__(self, reason: str = None, expression: Any = None):
+        self.message = f"The host failed to answer the query: {reason}."
+        self.reason = reason
+        self.expression = expression
+
+
+class MemoryBudgetError(Exception):
+    def __init__(
+        self, task: str, model: str, needed: int, budget: int, expression: Any = None
+    ):
+        self.message = (
+            f"The {task} pipeline {model or '(default model)'} does not fit in the "
+            f"memory budget of the host ({needed / 2**20:.0f}MB > {budget / 2**20:.0f}MB)."
+        )
+        self.task = task
+        self.model = model
+        self.needed = needed
+        self.budget = budget
+        self.expression = expression
+
+
 class HulseError(Exception):
     def __init__(self, status: int = None, expression: Any = None):
         self.message = f"Received error code {status}."
+        self.status = status
+        self.expression = expression
+
+
+class QueryTimeoutError(Exception):
+    def __init__(self, stage: str, timeout: float = None, expression: Any = None):
+        self.message = f"The query timed out after {timeout}s waiting for the {stage}."
+        self.stage = stage
+        self.timeout = timeout
         self.expression = expression
@@ -0,0 +1,404 @@
+"""Metrics of a running host, exported in the Prometheus text format.
+
+Enable the endpoint with ``hulse host --metrics-port 9100``, then scrape
+``http://127.0.0.1:9100/metrics``. Host metrics are prefixed with ``hulse_host_``:
+
+- ``queries_total``: queries by task, model and outcome, either answered,
+  coalesced with an identical running query, cached, expired, rejected or failed
+- ``inference_seconds``: histogram of the pipeline calls by task and model
+- ``pipeline_acquire_seconds``: histogram of the pipeline lookups by task and
+  model, model loads included
+- ``model_load_seconds``: duration of the last load of each cached pipeline,
+  hosts running inferences on threads only
+- ``post_failures_total``: failed posts to the server, of results, tokens, rejections or errors
+- ``queue_depth``, ``pending_queries``: queries waiting for a worker, and running
+- ``pipeline_cache_entries``, ``pipeline_cache_memory_bytes``: loaded pipelines
+- ``pipeline_resident_bytes``: resident memory measured when loading each
+  pipeline, with a memory budget
+- ``rss_bytes``: resident memory of the host process
+- ``reconnects_total``, ``downtime_seconds_total``: producer stream reconnects
+"""
+
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable
+
+from hulse import settings, utils
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# buckets of latency histograms, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def escape_label(value: Any) -> str:
+    """Escape a label value of the text format.
+
+    :param value: Label value, None for an empty value.
+    :type value: Any
+    :return: Escaped value.
+    :rtype: str
+    """
+    if value is None:
+        return ""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metric:
+    """Counter or gauge, with a value per combination of label values."""
+
+    def __init__(self, name: str, help: str, kind: str = "counter", labels=()):
+        """Create a new metric.
+
+        :param name: Name of the metric.
+        :type name: str
+        :param help: Description of the metric.
+        :type help: str
+        :param kind: Either counter or gauge, defaults to "counter"
+        :type kind: str, optional
+        :param labels: Names of the labels of the metric, defaults to ()
+        :type labels: tuple, optional
+        """
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name) for name in self.labels)
+
+    def inc(self, value: float = 1, **labels):
+        """Increment the value of the metric.
+
+        :param value: Increment, defaults to 1
+        :type value: float, optional
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, value: float, **labels):
+        """Set the value of the metric.
+
+        :param value: New value.
+        :type value: float
+        """
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def clear(self):
+        """Remove the values of all label combinations."""
+        with self._lock:
+            self._values.clear()
+
+    def render(self) -> list:
+        """Render the metric in the text format.
+
+        :return: Lines of the metric.
+        :rtype: list
+        """
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items(), key=str):
+                lines.append(
+                    f"{self.name}{_format_labels(self.labels, key)} {float(value)!r}"
+                )
+        return lines
+
+
+class Histogram(Metric):
+    """Histogram of observed values, with cumulative buckets."""
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        """Create a new histogram.
+
+        :param name: Name of the metric.
+        :type name: str
+        :param help: Description of the metric.
+        :type help: str
+        :param labels: Names of the labels of the metric, defaults to ()
+        :type labels: tuple, optional
+        :param buckets: Upper bounds of the buckets, defaults to LATENCY_BUCKETS
+        :type buckets: tuple, optional
+        """
+        super().__init__(name, help, "histogram", labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        """Record an observed value.
+
+        :param value: Observed value, such as a duration in seconds.
+        :type value: float
+        """
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # count of each bucket, then the sum and the count of all values
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, entry in sorted(self._values.items(), key=str):
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry):
+                    cumulative += count
+                    labels = _format_labels(self.labels, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labels, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {entry[-1]}")
+                labels = _format_labels(self.labels, key)
+                lines.append(f"{self.name}_sum{labels} {entry[-2]!r}")
+                lines.append(f"{self.name}_count{labels} {entry[-1]}")
+        return lines
+
+
+class Registry:
+    """Set of metrics rendered together, refreshed by collectors on each scrape."""
+
+    def __init__(self):
+        """Create a new registry."""
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name: str, help: str, labels=()) -> Metric:
+        """Register a new counter, see :class:`Metric`."""
+        return self.register(Metric(name, help, "counter", labels))
+
+    def gauge(self, name: str, help: str, labels=()) -> Metric:
+        """Register a new gauge, see :class:`Metric`."""
+        return self.register(Metric(name, help, "gauge", labels))
+
+    def histogram(
+        self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS
+    ) -> Histogram:
+        """Register a new histogram, see :class:`Histogram`."""
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def register(self, metric: Metric) -> Metric:
+        """Add a metric to the registry.
+
+        :param metric: Metric to be rendered with the registry.
+        :type metric: Metric
+        :return: The metric.
+        :rtype: Metric
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable):
+        """Add a callable updating metrics from the current state, before each scrape.
+
+        :param collector: Callable without arguments.
+        :type collector: Callable
+        """
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text format.
+
+        :return: Text exposition of the metrics.
+        :rtype: str
+        """
+        for collector in self.collectors:
+            collector()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Local HTTP server exposing a registry on ``/metrics``."""
+
+    def __init__(
+        self,
+        registry: Registry,
+        port: int = settings.HOST_METRICS_PORT,
+        address: str = settings.HOST_METRICS_ADDRESS,
+    ):
+        """Create a new metrics server.
+
+        :param registry: Metrics to be exposed.
+        :type registry: Registry
+        :param port: Port to listen on, 0 for any free port, defaults to settings.HOST_METRICS_PORT
+        :type port: int, optional
+        :param address: Interface to listen on, defaults to settings.HOST_METRICS_ADDRESS
+        :type address: str, optional
+        """
+        self.registry = registry
+        self.address = address
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.address}:{self.port}/metrics"
+
+    def start(self):
+        """Serve requests from a background thread."""
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.address, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="hulse-metrics", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving requests."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class HostMetrics(Registry):
+    """Metrics of a host, recorded as queries are answered and collected on scrape."""
+
+    def __init__(self, host: Any):
+        """Create the metrics of a host.
+
+        :param host: Host whose state is collected on each scrape.
+        :type host: hulse.producer.Host
+        """
+        super().__init__()
+        self.host = host
+        self.queries = self.counter(
+            "hulse_host_queries_total",
+            "Queries received by the host, by outcome.",
+            ("task", "model", "outcome"),
+        )
+        self.inference_seconds = self.histogram(
+            "hulse_host_inference_seconds",
+            "Duration of the pipeline calls, batches included.",
+            ("task", "model"),
+        )
+        self.acquire_seconds = self.histogram(
+            "hulse_host_pipeline_acquire_seconds",
+            "Duration of the pipeline lookups, model loads included.",
+            ("task", "model"),
+        )
+        self.load_seconds = self.gauge(
+            "hulse_host_model_load_seconds",
+            "Duration of the last load of each cached pipeline.",
+            ("task", "model"),
+        )
+        self.post_failures = self.counter(
+            "hulse_host_post_failures_total",
+            "Failed posts to the server, by kind.",
+            ("kind",),
+        )
+        self.queue_depth = self.gauge(
+            "hulse_host_queue_depth", "Queries waiting for a worker."
+        )
+        self.pending = self.gauge(
+            "hulse_host_pending_queries", "Queries dispatched to the workers."
+        )
+        self.cache_entries = self.gauge(
+            "hulse_host_pipeline_cache_entries", "Pipelines loaded in memory."
+        )
+        self.cache_memory = self.gauge(
+            "hulse_host_pipeline_cache_memory_bytes",
+            "Estimated memory of the loaded pipelines.",
+        )
+        self.resident = self.gauge(
+            "hulse_host_pipeline_resident_bytes",
+            "Resident memory of each loaded pipeline.",
+            ("task", "model"),
+        )
+        self.rss = self.gauge("hulse_host_rss_bytes", "Resident memory of the host.")
+        self.reconnects = self.counter(
+            "hulse_host_reconnects_total", "Reconnects to the producer stream."
+        )
+        self.downtime = self.counter(
+            "hulse_host_downtime_seconds_total",
+            "Time spent disconnected from the producer stream.",
+        )
+        self.add_collector(self.collect)
+
+    def observe_query(self, query: dict, outcome: str):
+        """Count a query by outcome.
+
+        :param query: Query received on the producer stream.
+        :type query: dict
+        :param outcome: One of answered, coalesced, cached, expired, rejected or failed.
+        :type outcome: str
+        """
+        self.queries.inc(
+            task=query.get("task"), model=query.get("model"), outcome=outcome
+        )
+
+    def observe_spans(self, query: dict, spans: list):
+        """Record the durations of the pipeline spans of a batch.
+
+        :param query: Query of the batch.
+        :type query: dict
+        :param spans: Spans of the batch, see :func:`hulse.producer.run_traced_batch`.
+        :type spans: list
+        """
+        histograms = {
+            "inference": self.inference_seconds,
+            "pipeline.acquire": self.acquire_seconds,
+        }
+        for span in spans:
+            if span["name"] in histograms:
+                histograms[span["name"]].observe(
+                    span["end"] - span["start"],
+                    task=query.get("task"),
+                    model=query.get("model"),
+                )
+
+    def collect(self):
+        """Update the metrics read from the state of the host."""
+        host = self.host
+        self.queue_depth.set(len(host.admission))
+        self.pending.set(host.pending)
+        stats = host.pipeline_cache.stats()
+        self.cache_entries.set(stats["entries"])
+        self.cache_memory.set(stats["memory"])
+        self.load_seconds.clear()
+        self.resident.clear()
+        # copied under the lock of the cache, which loads may update meanwhile
+        for (task, model, _), pipeline in host.pipeline_cache.pipelines().items():
+            if pipeline["load_time"] is not None:
+                self.load_seconds.set(pipeline["load_time"], task=task, model=model)
+            if pipeline["resident"] is not None:
+                self.resident.set(pipeline["resident"], task=task, model=model)
+        self.rss.set(utils.get_rss())
+        self.reconnects.set(host.reconnects)
+        self.downtime.set(host.downtime)
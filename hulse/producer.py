@@ -0,0 +1,1640 @@
+import json
+import logging
+import multiprocessing
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+import requests
+
+from hulse import settings, errors, cache, metrics, profiling, tracing, utils, sse
+from hulse.encoding import Message, WireFormat
+from hulse.sessions import SessionPool, default_sessions
+
+logger = logging.getLogger(__name__)
+
+
+def set_torch_threads(num_threads: int):
+    """Set the number of threads used by torch for intra-op parallelism.
+
+    :param num_threads: Number of torch threads.
+    :type num_threads: int
+    """
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(max(1, num_threads))
+
+
+def query_key(query: dict) -> str:
+    """Build the key identifying queries with the same inference result.
+
+    :param query: Query received on the producer stream.
+    :type query: dict
+    :return: Hash of the task, model, data and pipeline arguments of the query.
+    :rtype: str
+    """
+    return cache.ResultCache.make_key(
+        query.get("task"),
+        query.get("model"),
+        query.get("data"),
+        **(query.get("kwargs") or {}),
+    )
+
+
+def parse_model_spec(spec) -> tuple:
+    """Parse the task and model of a pipeline to be preloaded.
+
+    :param spec: Either a "task:model" or "task" string, a dict with task and
+        model keys or a (task, model) tuple.
+    :type spec: Union[str, dict, tuple]
+    :raises errors.UnsupportedTaskError: If the task is not supported.
+    :return: Task and model, None for the default model of the task.
+    :rtype: tuple
+    """
+    if isinstance(spec, str):
+        task, _, model = spec.partition(":")
+    elif isinstance(spec, dict):
+        task, model = spec.get("task"), spec.get("model")
+    else:
+        task, model = spec
+    if task not in settings.SUPPORTED_TASKS:
+        raise errors.UnsupportedTaskError(task)
+    return task, model or None
+
+
+def format_model_spec(task: str, model: str = None) -> str:
+    """Format the task and model of a pipeline, as parsed by :func:`parse_model_spec`.
+
+    :param task: Transformer task of the pipeline.
+    :type task: str
+    :param model: Model of the pipeline, defaults to None for the task default.
+    :type model: str, optional
+    :return: Either "task:model" or "task" for the default model.
+    :rtype: str
+    """
+    return f"{task}:{model}" if model else task
+
+
+def preload_pipelines(models: list, pipeline_cache: cache.PipelineCache = None):
+    """Load, pin and warm up pipelines before any query is received.
+
+    :param models: Task and model of each pipeline.
+    :type models: list
+    :param pipeline_cache: Cache of loaded pipelines, defaults to the process-wide cache.
+    :type pipeline_cache: cache.PipelineCache, optional
+    """
+    if pipeline_cache is None:
+        pipeline_cache = cache.pipeline_cache
+    for task, model in models:
+        start = time.monotonic()
+        pipeline_cache.preload(
+            task, model, warmup_input=settings.WARMUP_INPUTS.get(task)
+        )
+        logger.info(
+            "Preloaded %s pipeline %s in %.1fs",
+            task,
+            model or "(default model)",
+            time.monotonic() - start,
+        )
+
+
+def truncate_input(data: Any, max_length: int) -> Any:
+    """Truncate the texts of the data of a query.
+
+    :param data: Data of the query, a text, a list of texts or a dict of texts.
+    :type data: Any
+    :param max_length: Maximum number of characters of each text, 0 for no bound.
+    :type max_length: int
+    :return: Data with each text truncated.
+    :rtype: Any
+    """
+    if max_length <= 0:
+        return data
+    if isinstance(data, str):
+        return data[:max_length]
+    if isinstance(data, list):
+        return [truncate_input(item, max_length) for item in data]
+    if isinstance(data, dict):
+        return {key: truncate_input(value, max_length) for key, value in data.items()}
+    return data
+
+
+def bound_query(
+    query: dict,
+    max_new_tokens: int = settings.HOST_MAX_NEW_TOKENS,
+    max_input_length: int = settings.HOST_MAX_INPUT_LENGTH,
+) -> dict:
+    """Bound the cost of a query, whatever the pipeline arguments it asks for.
+
+    Arguments not supported by the task of the query are dropped, the number
+    of generated tokens, sequences and beams is capped and generation tasks
+    generate at most `max_new_tokens` by default. Input texts are truncated to
+    `max_input_length` characters, then to the maximum length of the model.
+
+    :param query: Query received on the producer stream.
+    :type query: dict
+    :param max_new_tokens: Maximum number of generated tokens, 0 for no bound, defaults to settings.HOST_MAX_NEW_TOKENS
+    :type max_new_tokens: int, optional
+    :param max_input_length: Maximum number of characters of each input text, 0 for no bound, defaults to settings.HOST_MAX_INPUT_LENGTH
+    :type max_input_length: int, optional
+    :return: Copy of the query with bounded data and pipeline arguments.
+    :rtype: dict
+    """
+    task = query.get("task")
+    supported = settings.TASK_KWARGS.get(task, [])
+    kwargs = {}
+    for name, value in (query.get("kwargs") or {}).items():
+        if name in supported:
+            kwargs[name] = value
+        else:
+            logger.warning(
+                "Dropped argument %s of query %s, unsupported by %s",
+                name,
+                query.get("qid"),
+                task,
+            )
+
+    limits = {
+        "max_new_tokens": max_new_tokens,
+        "min_new_tokens": max_new_tokens,
+        "num_return_sequences": settings.HOST_MAX_RETURN_SEQUENCES,
+        "num_beams": settings.HOST_MAX_BEAMS,
+    }
+    for name, limit in limits.items():
+        if name not in kwargs:
+            continue
+        try:
+            value = int(kwargs[name])
+        except (TypeError, ValueError):
+            del kwargs[name]
+            continue
+        kwargs[name] = min(value, limit) if limit > 0 else value
+    if task in settings.GENERATION_TASKS and max_new_tokens > 0:
+        kwargs.setdefault("max_new_tokens", max_new_tokens)
+    if task in settings.TRUNCATION_TASKS:
+        kwargs["truncation"] = True
+
+    bounded = dict(
+        query, data=truncate_input(query.get("data"), max_input_length), kwargs=kwargs
+    )
+    if query.get("stream"):
+        # tokens of a single greedy or sampled sequence can be streamed
+        bounded["stream"] = is_streamable(bounded)
+        if bounded["stream"]:
+            kwargs.update(num_beams=1, num_return_sequences=1)
+            if task == "text-generation":
+                kwargs.setdefault("return_full_text", False)
+    return bounded
+
+
+def is_streamable(query: dict) -> bool:
+    """Whether the tokens generated for a query can be streamed to its consumer.
+
+    :param query: Query received on the producer stream.
+    :type query: dict
+    :return: True for single text inputs of a streaming task.
+    :rtype: bool
+    """
+    return query.get("task") in settings.STREAMING_TASKS and isinstance(
+        query.get("data"), str
+    )
+
+
+def make_streamer(tokenizer: Any, on_text: Callable) -> Any:
+    """Create a generation streamer calling back with the text of new tokens.
+
+    :param tokenizer: Tokenizer of the generation pipeline.
+    :type tokenizer: transformers.PreTrainedTokenizer
+    :param on_text: Called with each chunk of generated text, the prompt excluded.
+    :type on_text: Callable
+    :return: Streamer to be passed to the pipeline call.
+    :rtype: transformers.TextStreamer
+    """
+    from transformers import TextStreamer
+
+    class CallbackStreamer(TextStreamer):
+        def on_finalized_text(self, text: str, stream_end: bool = False):
+            if text:
+                on_text(text)
+
+    return CallbackStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+
+def run_inference(
+    query: dict,
+    pipeline_cache: cache.PipelineCache = None,
+    on_text: Callable = None,
+    spans: list = None,
+) -> Any:
+    """Run a query received from the Hulse server through its pipeline.
+
+    :param query: Query received on the producer stream.
+    :type query: dict
+    :param pipeline_cache: Cache of loaded pipelines, defaults to the process-wide cache.
+    :type pipeline_cache: cache.PipelineCache, optional
+    :param on_text: Called with the text of the tokens generated for a
+        streaming query as they come, see :func:`make_streamer`, defaults to None
+    :type on_text: Callable, optional
+    :param spans: Spans of the pipeline lookup and call are appended to it, defaults to None
+    :type spans: list, optional
+    :return: Raw pipeline output.
+    :rtype: Any
+    """
+    if pipeline_cache is None:
+        pipeline_cache = cache.pipeline_cache
+    # analyse data using hugging face model, reusing warm pipelines
+    start = time.time()
+    classifier = pipeline_cache.get_pipeline(
+        task=query.get("task"), model=query.get("model")
+    )
+    kwargs = query.get("kwargs") or {}
+    if on_text is not None and query.get("stream"):
+        kwargs = dict(kwargs, streamer=make_streamer(classifier.tokenizer, on_text))
+    acquired = time.time()
+    output = classifier(query.get("data"), **kwargs)
+    if spans is not None:
+        spans.append(tracing.make_span("pipeline.acquire", start, acquired))
+        spans.append(tracing.make_span("inference", acquired, time.time()))
+    return output
+
+
+def format_result(data: Any, output: Any) -> Any:
+    """Shape the pipeline output of a query into the result sent back to its consumer.
+
+    Pipelines wrap the output of a single input in a list, which is unwrapped
+    when it holds a single output. Multiple outputs, such as top-k labels,
+    generated sequences or answers, are kept as a list. List inputs get the
+    list of the results of each item.
+
+    :param data: Data of the query.
+    :type data: Any
+    :param output: Raw pipeline output.
+    :type output: Any
+    :return: Complete result of the query.
+    :rtype: Any
+    """
+
+    def unwrap(item_output):
+        if isinstance(item_output, list) and len(item_output) == 1:
+            return item_output[0]
+        return item_output
+
+    if isinstance(data, list) and isinstance(output, list):
+        return [unwrap(item_output) for item_output in output]
+    return unwrap(output)
+
+
+def run_batch(
+    queries: list,
+    pipeline_cache: cache.PipelineCache = None,
+    on_text: Callable = None,
+    spans: list = None,
+) -> list:
+    """Run queries sharing the same pipeline as a single batch.
+
+    :param queries: Queries received on the producer stream, for the same task,
+        model and pipeline arguments.
+    :type queries: list
+    :param pipeline_cache: Cache of loaded pipelines, defaults to the process-wide cache.
+    :type pipeline_cache: cache.PipelineCache, optional
+    :param on_text: Called with the text generated for a single streaming query, defaults to None
+    :type on_text: Callable, optional
+    :param spans: Spans of the pipeline lookup and call are appended to it, defaults to None
+    :type spans: list, optional
+    :return: Result of each query as if run on its own, see :func:`format_result`,
+        or None for queries which expired while waiting for a worker.
+    :rtype: list
+    """
+    # skip queries whose consumer already gave up while they were queued
+    live = [i for i, query in enumerate(queries) if not utils.is_expired(query)]
+    results = [None] * len(queries)
+    if len(live) == 1:
+        query = queries[live[0]]
+        results[live[0]] = format_result(
+            query.get("data"), run_inference(query, pipeline_cache, on_text, spans)
+        )
+    elif live:
+        if pipeline_cache is None:
+            pipeline_cache = cache.pipeline_cache
+        start = time.time()
+        classifier = pipeline_cache.get_pipeline(
+            task=queries[live[0]].get("task"), model=queries[live[0]].get("model")
+        )
+        acquired = time.time()
+        outputs = classifier(
+            [queries[i].get("data") for i in live],
+            batch_size=len(live),
+            **(queries[live[0]].get("kwargs") or {}),
+        )
+        if spans is not None:
+            spans.append(tracing.make_span("pipeline.acquire", start, acquired))
+            spans.append(tracing.make_span("inference", acquired, time.time()))
+        for i, output in zip(live, outputs):
+            results[i] = format_result(queries[i].get("data"), output)
+    return results
+
+
+def run_traced_batch(
+    queries: list, pipeline_cache: cache.PipelineCache = None, on_text: Callable = None
+) -> tuple:
+    """Run queries as a single batch, see :func:`run_batch`, recording its spans.
+
+    :return: Result of each query, and the spans of the pipeline lookup and call.
+    :rtype: tuple
+    """
+    spans = []
+    return run_batch(queries, pipeline_cache, on_text, spans), spans
+
+
+def make_trace(query: dict, spans: list) -> dict:
+    """Build the trace sent with the result of a query, ending with the post of the result.
+
+    :param query: Query received on the producer stream.
+    :type query: dict
+    :param spans: Spans recorded by the host for the query, see :mod:`hulse.tracing`.
+    :type spans: list
+    :return: Trace id and spans, None if the query has no trace id.
+    :rtype: dict
+    """
+    if not query.get("trace_id"):
+        return None
+    return {
+        "trace_id": query["trace_id"],
+        "spans": [*spans, tracing.make_span("result.post", time.time())],
+    }
+
+
+def _post_answer(
+    answer: dict, api_key: str, sessions: SessionPool, wire_format: WireFormat
+) -> requests.Response:
+    session = (sessions or default_sessions).get(settings.HULSE_STREAM_URL)
+    headers = settings.get_auth_headers(api_key)
+    if wire_format is not None:
+        return session.post(
+            settings.HULSE_STREAM_URL + "result/",
+            data=wire_format.encode(answer),
+            headers={**headers, "Content-Type": wire_format.content_type},
+        )
+    return session.post(
+        settings.HULSE_STREAM_URL + "result/", data=answer, headers=headers
+    )
+
+
+def post_result(
+    qid: str,
+    result: Any,
+    api_key: str,
+    sessions: SessionPool = None,
+    wire_format: WireFormat = None,
+    seq: int = None,
+    trace: dict = None,
+) -> requests.Response:
+    """Post the result of a query back to the Hulse server.
+
+    :param qid: Id of the answered query.
+    :type qid: str
+    :param result: Complete result of the query, see :func:`format_result`.
+    :type result: Any
+    :param api_key: Hulse API key.
+    :type api_key: str
+    :param sessions: Pooled HTTP sessions, defaults to the process-wide sessions.
+    :type sessions: SessionPool, optional
+    :param wire_format: Compact wire format negotiated with the server, defaults
+        to None to post the result as a JSON string form field.
+    :type wire_format: WireFormat, optional
+    :param seq: Sequence number of the final answer of a streaming query, after
+        its partial answers, defaults to None
+    :type seq: int, optional
+    :param trace: Spans of the query on the host, see :func:`make_trace`, defaults to None
+    :type trace: dict, optional
+    :return: Response of the Hulse server.
+    :rtype: requests.Response
+    """
+    if wire_format is not None:
+        answer = {"result": result, "qid": qid}
+    else:
+        answer = {"result": json.dumps(result), "qid": qid}
+    if seq is not None:
+        answer["seq"] = seq
+    if trace is not None:
+        answer["trace"] = trace if wire_format is not None else json.dumps(trace)
+    return _post_answer(answer, api_key, sessions, wire_format)
+
+
+def post_partial(
+    qid: str,
+    seq: int,
+    token: str,
+    api_key: str,
+    sessions: SessionPool = None,
+    wire_format: WireFormat = None,
+) -> requests.Response:
+    """Post the text generated so far for a streaming query back to the Hulse server.
+
+    :param qid: Id of the streaming query.
+    :type qid: str
+    :param seq: Sequence number of the partial answer, from 0.
+    :type seq: int
+    :param token: Text generated since the previous partial answer.
+    :type token: str
+    :param api_key: Hulse API key.
+    :type api_key: str
+    :param sessions: Pooled HTTP sessions, defaults to the process-wide sessions.
+    :type sessions: SessionPool, optional
+    :param wire_format: Compact wire format negotiated with the server, defaults to None
+    :type wire_format: WireFormat, optional
+    :return: Response of the Hulse server.
+    :rtype: requests.Response
+    """
+    return _post_answer(
+        {"qid": qid, "seq": seq, "token": token}, api_key, sessions, wire_format
+    )
+
+
+def post_busy(
+    qid: str,
+    api_key: str,
+    sessions: SessionPool = None,
+    wire_format: WireFormat = None,
+) -> requests.Response:
+    """Reject a query back to the Hulse server, for another host to answer it.
+
+    :param qid: Id of the rejected query.
+    :type qid: str
+    :param api_key: Hulse API key.
+    :type api_key: str
+    :param sessions: Pooled HTTP sessions, defaults to the process-wide sessions.
+    :type sessions: SessionPool, optional
+    :param wire_format: Compact wire format negotiated with the server, defaults to None
+    :type wire_format: WireFormat, optional
+    :return: Response of the Hulse server.
+    :rtype: requests.Response
+    """
+    return _post_answer({"error": "busy", "qid": qid}, api_key, sessions, wire_format)
+
+
+def post_error(
+    qid: str,
+    reason: str,
+    api_key: str,
+    sessions: SessionPool = None,
+    wire_format: WireFormat = None,
+) -> requests.Response:
+    """Answer a query whose inference failed, for its consumer to stop waiting.
+
+    :param qid: Id of the failed query.
+    :type qid: str
+    :param reason: Description of the failure, sent to the consumer.
+    :type reason: str
+    :param api_key: Hulse API key.
+    :type api_key: str
+    :param sessions: Pooled HTTP sessions, defaults to the process-wide sessions.
+    :type sessions: SessionPool, optional
+    :param wire_format: Compact wire format negotiated with the server, defaults to None
+    :type wire_format: WireFormat, optional
+    :return: Response of the Hulse server.
+    :rtype: requests.Response
+    """
+    return _post_answer(
+        {"error": "inference", "reason": reason, "qid": qid},
+        api_key,
+        sessions,
+        wire_format,
+    )
+
+
+def handle_producer_stream(
+    response: requests.Response,
+    api_key: str,
+    pipeline_cache: cache.PipelineCache = None,
+):
+    """Serially answer the queries received on the producer stream.
+
+    :param response: Stream request response to be handled.
+    :type response: requests.Response
+    :param api_key: Hulse API key.
+    :type api_key: str
+    :param pipeline_cache: Cache of loaded pipelines, defaults to the process-wide cache.
+    :type pipeline_cache: cache.PipelineCache, optional
+    """
+    for event in sse.iter_events(sse.iter_chunks(response)):
+        data = event.json()
+        if data:
+            data = utils.localize_deadline(data)
+        if data and not utils.is_expired(data):
+            data = bound_query(data)
+            spans = []
+            try:
+                output = run_inference(data, pipeline_cache, spans=spans)
+            except Exception as e:
+                logger.error("Query %s failed: %s", data.get("qid"), repr(e))
+                post_error(data.get("qid"), repr(e), api_key)
+                continue
+            result = format_result(data.get("data"), output)
+            post_result(data.get("qid"), result, api_key, trace=make_trace(data, spans))
+
+
+def _init_process_worker(
+    num_threads: int,
+    max_entries: int,
+    max_memory: int,
+    preload: list = (),
+    loader: Callable = None,
+    max_rss: int = 0,
+    mmap_weights: bool = False,
+    ready: Any = None,
+):
+    """Set up a host worker process, each process owns its pipeline cache.
+
+    Once its pipelines are preloaded, the process waits on the `ready` barrier
+    for all worker processes to be set up.
+    """
+    set_torch_threads(num_threads)
+    cache.pipeline_cache.configure(
+        max_entries=max_entries,
+        max_memory=max_memory,
+        loader=loader,
+        max_rss=max_rss,
+        mmap_weights=mmap_weights,
+    )
+    preload_pipelines(preload)
+    if ready is not None:
+        ready.wait()
+
+
+class Batcher:
+    """Accumulate queries for the same pipeline into micro-batches.
+
+    A batch is dispatched once it holds `max_batch_size` queries, or once its
+    oldest query waited for `max_wait_ms` milliseconds.
+    """
+
+    def __init__(self, dispatch: Callable, max_batch_size: int, max_wait_ms: float):
+        """Create a new batcher.
+
+        :param dispatch: Callable receiving each batch as a list of queries.
+        :type dispatch: Callable
+        :param max_batch_size: Maximum number of queries in a batch.
+        :type max_batch_size: int
+        :param max_wait_ms: Maximum time a query waits for its batch to fill up.
+        :type max_wait_ms: float
+        """
+        self.dispatch = dispatch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending = {}
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name="hulse-batcher", daemon=True
+        )
+        self._thread.start()
+
+    @staticmethod
+    def is_batchable(query: dict) -> bool:
+        """Whether a query can be batched with others.
+
+        :param query: Query received on the producer stream.
+        :type query: dict
+        :return: True for single text inputs of a batchable task.
+        :rtype: bool
+        """
+        return query.get("task") in settings.BATCHABLE_TASKS and isinstance(
+            query.get("data"), str
+        )
+
+    def add(self, query: dict):
+        """Add a query to the batch of its pipeline and pipeline arguments.
+
+        :param query: Query received on the producer stream.
+        :type query: dict
+        """
+        key = (
+            query.get("task"),
+            query.get("model"),
+            json.dumps(query.get("kwargs") or {}, sort_keys=True),
+        )
+        batch = None
+        with self._cond:
+            if key not in self._pending:
+                self._pending[key] = (time.monotonic() + self.max_wait, [])
+                self._cond.notify()
+            self._pending[key][1].append(query)
+            if len(self._pending[key][1]) >= self.max_batch_size:
+                batch = self._pending.pop(key)[1]
+        if batch:
+            self.dispatch(batch)
+
+    def close(self):
+        """Dispatch all pending batches and stop the batcher."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    now = time.monotonic()
+                    deadlines = [deadline for deadline, _ in self._pending.values()]
+                    if deadlines and min(deadlines) <= now:
+                        break
+                    self._cond.wait(min(deadlines) - now if deadlines else None)
+
+                due = [
+                    key
+                    for key, (deadline, _) in self._pending.items()
+                    if self._closed or deadline <= time.monotonic()
+                ]
+                batches = [self._pending.pop(key)[1] for key in due]
+                closed = self._closed
+
+            for batch in batches:
+                self.dispatch(batch)
+            if closed:
+                return
+
+
+class TokenStream:
+    """Post the text generated for a streaming query in order, then its result.
+
+    Text generated while a partial answer is being posted is accumulated and
+    posted as the next one, so that a slow connection delays tokens instead of
+    queuing one request per token.
+    """
+
+    def __init__(self, post_partial: Callable, executor: Any):
+        """Create a new token stream.
+
+        :param post_partial: Called with the sequence number and text of each partial answer.
+        :type post_partial: Callable
+        :param executor: Executor running the posts.
+        :type executor: concurrent.futures.Executor
+        """
+        self.post_partial = post_partial
+        self.executor = executor
+        self.seq = 0
+        self._buffer = []
+        self._post_final = None
+        self._posting = False
+        self._lock = threading.Lock()
+
+    def put(self, text: str):
+        """Add generated text, posted as soon as the previous post completed.
+
+        :param text: Text of the new tokens.
+        :type text: str
+        """
+        with self._lock:
+            self._buffer.append(text)
+            if self._posting:
+                return
+            self._posting = True
+        self.executor.submit(self._flush)
+
+    def finish(self, post_final: Callable):
+        """Post the final answer of the query, once all generated text was posted.
+
+        :param post_final: Called with the sequence number of the final answer.
+        :type post_final: Callable
+        """
+        with self._lock:
+            self._post_final = post_final
+            if self._posting:
+                return
+            self._posting = True
+        self.executor.submit(self._flush)
+
+    def _flush(self):
+        while True:
+            with self._lock:
+                seq = self.seq
+                if self._buffer:
+                    post = partial(self.post_partial, seq, "".join(self._buffer))
+                    self._buffer.clear()
+                elif self._post_final is not None:
+                    post = partial(self._post_final, seq)
+                    self._post_final = None
+                else:
+                    self._posting = False
+                    return
+                self.seq += 1
+            post()
+
+
+class AdmissionQueue:
+    """Bounded queue of the queries admitted by a host, waiting for a free worker.
+
+    Once the queue holds `max_depth` queries, new queries are either rejected,
+    shed the oldest queued query or block until there is room, depending on the
+    overflow policy.
+    """
+
+    def __init__(
+        self,
+        max_depth: int = settings.HOST_QUEUE_SIZE,
+        policy: str = settings.HOST_QUEUE_POLICY,
+    ):
+        """Create a new admission queue.
+
+        :param max_depth: Maximum number of queued queries, 0 for no bound, defaults to settings.HOST_QUEUE_SIZE
+        :type max_depth: int, optional
+        :param policy: Overflow policy, one of settings.HOST_QUEUE_POLICIES, defaults to settings.HOST_QUEUE_POLICY
+        :type policy: str, optional
+        :raises ValueError: If the overflow policy is not supported.
+        """
+        if policy not in settings.HOST_QUEUE_POLICIES:
+            raise ValueError(f"Unsupported queue policy {policy}.")
+
+        self.max_depth = max_depth
+        self.policy = policy
+        self.admitted = 0
+        self.rejected = 0
+        self.shed = 0
+        self.peak_depth = 0
+        self.dispatched = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._queue = deque()
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def put(self, query: dict, front: bool = False) -> list:
+        """Admit a query, applying the overflow policy if the queue is full.
+
+        :param query: Query received on the producer stream.
+        :type query: dict
+        :param front: Queue the query first, regardless of the bound, defaults to False
+        :type front: bool, optional
+        :return: Queries refused by the queue, either the query itself or the
+            oldest queued query.
+        :rtype: list
+        """
+        refused = []
+        with self._cond:
+            if not front and self._is_full():
+                if self.policy == "reject":
+                    self.rejected += 1
+                    return [query]
+                elif self.policy == "shed-oldest":
+                    self.shed += 1
+                    refused.append(self._queue.popleft()[1])
+                else:
+                    while self._is_full() and not self._closed:
+                        self._cond.wait()
+            if self._closed:
+                return refused + [query]
+
+            entry = (time.monotonic(), query)
+            if front:
+                self._queue.appendleft(entry)
+            else:
+                self._queue.append(entry)
+            self.admitted += 1
+            self.peak_depth = max(self.peak_depth, len(self._queue))
+            self._cond.notify_all()
+        return refused
+
+    def get(self) -> dict:
+        """Wait for the oldest admitted query.
+
+        :return: The query, None once the queue is closed and drained.
+        :rtype: dict
+        """
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return None
+
+            admitted_at, query = self._queue.popleft()
+            wait = time.monotonic() - admitted_at
+            self.dispatched += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self._cond.notify_all()
+            return query
+
+    def close(self, drain: bool = True) -> list:
+        """Stop admitting queries.
+
+        :param drain: Whether queued queries are still handed out by get, defaults to True
+        :type drain: bool, optional
+        :return: Queries dropped from the queue.
+        :rtype: list
+        """
+        with self._cond:
+            self._closed = True
+            dropped = []
+            if not drain:
+                dropped = [query for _, query in self._queue]
+                self._queue.clear()
+            self._cond.notify_all()
+            return dropped
+
+    def _is_full(self) -> bool:
+        return bool(self.max_depth) and len(self._queue) >= self.max_depth
+
+    def stats(self) -> dict:
+        """Get the queue depth and wait time metrics.
+
+        :return: Current and peak depth, admitted, rejected, shed and dispatched
+            queries, and mean and max wait time in seconds.
+        :rtype: dict
+        """
+        with self._cond:
+            return dict(
+                depth=len(self._queue),
+                max_depth=self.max_depth,
+                policy=self.policy,
+                peak_depth=self.peak_depth,
+                admitted=self.admitted,
+                rejected=self.rejected,
+                shed=self.shed,
+                dispatched=self.dispatched,
+                mean_wait=self.total_wait / self.dispatched if self.dispatched else 0.0,
+                max_wait=self.max_wait,
+            )
+
+
+class Host:
+    """Hulse host dispatching the queries of the producer stream to a worker pool.
+
+    Inferences run on a pool of threads or processes while results are posted
+    back to the Hulse server from a separate pool of threads, in the order they
+    complete. The CPU cores of the machine are partitioned between inference
+    workers by limiting the number of torch threads of each worker.
+
+    Queries identical to a query already running are coalesced with it and
+    answered by the same inference, and recent results are memoized.
+
+    Preloaded pipelines are loaded, warmed up and pinned in every worker before
+    the host connects to the producer channel.
+
+    The host advertises its capabilities to the stream server when connecting
+    and periodically thereafter, so that queries are routed to warm, idle hosts.
+
+    Queries wait in a bounded admission queue until a worker is free, and the
+    overflow policy of the queue decides how an overloaded host degrades.
+
+    When the producer stream drops, the host reconnects with a jittered
+    exponential backoff and resumes from the last received event, keeping its
+    loaded pipelines and in-flight queries. Replayed queries are dropped.
+
+    Streaming text generation queries get the text of their tokens as they are
+    generated, when inferences run on threads.
+
+    The pipeline arguments of queries are bounded, so that a single query
+    cannot hold a worker for long, see :func:`bound_query`.
+
+    Queries and results use the compact wire format when one is requested and
+    the server supports it, and the legacy format otherwise.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        workers: int = settings.HOST_WORKERS,
+        worker_type: str = settings.HOST_WORKER_TYPE,
+        post_workers: int = settings.HOST_POST_WORKERS,
+        batch_size: int = settings.HOST_BATCH_SIZE,
+        batch_wait_ms: float = settings.HOST_BATCH_WAIT_MS,
+        result_cache_size: int = settings.HOST_RESULT_CACHE_SIZE,
+        result_cache_ttl: float = settings.HOST_RESULT_CACHE_TTL,
+        preload: list = None,
+        status_interval: float = settings.HOST_STATUS_INTERVAL,
+        queue_size: int = settings.HOST_QUEUE_SIZE,
+        queue_policy: str = settings.HOST_QUEUE_POLICY,
+        max_reconnects: int = settings.HOST_MAX_RECONNECTS,
+        reconnect_backoff: float = settings.HOST_RECONNECT_BACKOFF,
+        max_reconnect_backoff: float = settings.HOST_RECONNECT_MAX_BACKOFF,
+        stream_timeout: float = settings.HOST_STREAM_TIMEOUT,
+        encoding: str = settings.WIRE_ENCODING,
+        compression: str = settings.WIRE_COMPRESSION,
+        max_new_tokens: int = settings.HOST_MAX_NEW_TOKENS,
+        max_input_length: int = settings.HOST_MAX_INPUT_LENGTH,
+        metrics_port: int = settings.HOST_METRICS_PORT,
+        profile: bool = False,
+        profile_duration: float = settings.HOST_PROFILE_DURATION,
+        profile_output: str = settings.HOST_PROFILE_OUTPUT,
+        pipeline_cache: cache.PipelineCache = None,
+        sessions: SessionPool = None,
+    ):
+        """Create a new Hulse host.
+
+        :param api_key: Hulse API key for the account.
+        :type api_key: str
+        :param workers: Number of inference workers, defaults to settings.HOST_WORKERS
+        :type workers: int, optional
+        :param worker_type: Either thread or process, defaults to settings.HOST_WORKER_TYPE
+        :type worker_type: str, optional
+        :param post_workers: Number of threads posting results, defaults to settings.HOST_POST_WORKERS
+        :type post_workers: int, optional
+        :param batch_size: Maximum number of queries batched together, defaults to settings.HOST_BATCH_SIZE
+        :type batch_size: int, optional
+        :param batch_wait_ms: Maximum time a query waits for its batch, defaults to settings.HOST_BATCH_WAIT_MS
+        :type batch_wait_ms: float, optional
+        :param result_cache_size: Maximum number of memoized results, 0 to disable, defaults to settings.HOST_RESULT_CACHE_SIZE
+        :type result_cache_size: int, optional
+        :param result_cache_ttl: Time to live of memoized results in seconds, defaults to settings.HOST_RESULT_CACHE_TTL
+        :type result_cache_ttl: float, optional
+        :param preload: Pipelines to preload, see :func:`parse_model_spec`, defaults to None
+        :type preload: list, optional
+        :param status_interval: Interval between capability reports in seconds, 0 to only report on connect, defaults to settings.HOST_STATUS_INTERVAL
+        :type status_interval: float, optional
+        :param queue_size: Maximum number of queries waiting for a worker, 0 for no bound, defaults to settings.HOST_QUEUE_SIZE
+        :type queue_size: int, optional
+        :param queue_policy: Overflow policy of the admission queue, one of settings.HOST_QUEUE_POLICIES, defaults to settings.HOST_QUEUE_POLICY
+        :type queue_policy: str, optional
+        :param max_reconnects: Maximum number of consecutive failed reconnects, -1 for no limit, defaults to settings.HOST_MAX_RECONNECTS
+        :type max_reconnects: int, optional
+        :param reconnect_backoff: Initial backoff between reconnects in seconds, defaults to settings.HOST_RECONNECT_BACKOFF
+        :type reconnect_backoff: float, optional
+        :param max_reconnect_backoff: Maximum backoff between reconnects in seconds, defaults to settings.HOST_RECONNECT_MAX_BACKOFF
+        :type max_reconnect_backoff: float, optional
+        :param stream_timeout: Time without data after which the producer stream is considered dead, 0 to wait forever, defaults to settings.HOST_STREAM_TIMEOUT
+        :type stream_timeout: float, optional
+        :param encoding: Compact wire format of queries and results, either json or msgpack, defaults to settings.WIRE_ENCODING
+        :type encoding: str, optional
+        :param compression: Compression of large queries and results, either gzip or zstd, defaults to settings.WIRE_COMPRESSION
+        :type compression: str, optional
+        :param max_new_tokens: Maximum number of tokens generated by a query, 0 for no bound, defaults to settings.HOST_MAX_NEW_TOKENS
+        :type max_new_tokens: int, optional
+        :param max_input_length: Maximum number of characters of each input text, 0 for no bound, defaults to settings.HOST_MAX_INPUT_LENGTH
+        :type max_input_length: int, optional
+        :param metrics_port: Port of the local Prometheus metrics endpoint, see
+            :mod:`hulse.metrics`, 0 to disable it, defaults to settings.HOST_METRICS_PORT
+        :type metrics_port: int, optional
+        :param profile: Whether to profile the host once started, see :mod:`hulse.profiling`, defaults to False
+        :type profile: bool, optional
+        :param profile_duration: Duration of the profile in seconds, 0 to profile until the host stops, defaults to settings.HOST_PROFILE_DURATION
+        :type profile_duration: float, optional
+        :param profile_output: Path of the profile files, without extension, defaults to settings.HOST_PROFILE_OUTPUT
+        :type profile_output: str, optional
+        :param pipeline_cache: Cache of loaded pipelines, defaults to the process-wide cache.
+        :type pipeline_cache: cache.PipelineCache, optional
+        :param sessions: Pooled HTTP sessions, defaults to a pool sized for the result posting threads.
+        :type sessions: SessionPool, optional
+        :raises ValueError: If the worker type, the queue policy or the wire format is not supported.
+        :raises errors.UnsupportedTaskError: If the task of a preloaded pipeline is not supported.
+        """
+        if worker_type not in settings.HOST_WORKER_TYPES:
+            raise ValueError(f"Unsupported worker type {worker_type}.")
+
+        self.api_key = api_key
+        self.host_id = uuid.uuid4().hex
+        self.workers = max(1, workers)
+        self.worker_type = worker_type
+        self.post_workers = max(1, post_workers)
+        self.batch_size = max(1, batch_size)
+        self.batch_wait_ms = batch_wait_ms
+        self.preload = [parse_model_spec(spec) for spec in preload or []]
+        self.status_interval = status_interval
+        self.max_reconnects = max_reconnects
+        self.reconnect_backoff = reconnect_backoff
+        self.max_reconnect_backoff = max_reconnect_backoff
+        self.stream_timeout = stream_timeout
+        self.wire_format = WireFormat(encoding, compression) if encoding else None
+        self.max_new_tokens = max_new_tokens
+        self.max_input_length = max_input_length
+        # wire format of the current producer stream, None for the legacy format
+        self._wire_format = None
+        if pipeline_cache is None:
+            pipeline_cache = cache.pipeline_cache
+        self.pipeline_cache = pipeline_cache
+        self.threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers)
+        self.sessions = sessions or SessionPool(
+            pool_size=max(settings.HTTP_POOL_SIZE, self.post_workers + 1)
+        )
+        self.result_cache = None
+        if result_cache_size > 0:
+            self.result_cache = cache.ResultCache(
+                max_entries=result_cache_size, ttl=result_cache_ttl
+            )
+        self.admission = AdmissionQueue(queue_size, queue_policy)
+        self.metrics = metrics.HostMetrics(self)
+        self.metrics_server = None
+        if metrics_port:
+            self.metrics_server = metrics.MetricsServer(self.metrics, metrics_port)
+        self.profiler = profiling.SamplingProfiler() if profile else None
+        self.profile_duration = profile_duration
+        self.profile_output = profile_output
+        self._profile_timer = None
+        self.executor = None
+        self.post_executor = None
+        self.batcher = None
+        self.dispatcher = None
+        self.expired = 0
+        self.coalesced = 0
+        self.duplicates = 0
+        self.reconnects = 0
+        # total time spent disconnected from the producer stream, in seconds
+        self.downtime = 0.0
+        self.last_event_id = None
+        # ids of the last received queries, replayed ones are dropped
+        self.seen = cache.LRUCache(max_entries=settings.HOST_SEEN_QUERIES)
+        self._response = None
+        # queries dispatched to the inference workers and not answered yet
+        self.pending = 0
+        # moving average of the inference latency of each model, in seconds
+        self.latency = {}
+        # queries waiting for the result of an identical running query
+        self._waiting = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._status_thread = None
+        # queries handed to the batcher or the workers, bounded so that
+        # overload builds up in the admission queue
+        self._slots = threading.Semaphore(self.workers * self.batch_size)
+
+    def start(self):
+        """Start the worker pools, once preloaded pipelines are ready."""
+        if self.profiler is not None:
+            # started first, so that the profile covers preloading
+            self.profiler.start()
+            if self.profile_duration > 0:
+                self._profile_timer = threading.Timer(
+                    self.profile_duration, self._write_profile
+                )
+                self._profile_timer.daemon = True
+                self._profile_timer.start()
+        if self.worker_type == "process":
+            context = multiprocessing.get_context("spawn")
+            ready = context.Barrier(self.workers) if self.preload else None
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_process_worker,
+                initargs=(
+                    self.threads_per_worker,
+                    self.pipeline_cache.max_entries,
+                    self.pipeline_cache.max_memory,
+                    self.preload,
+                    self.pipeline_cache.loader,
+                    # the memory budget of the host is split between processes
+                    self.pipeline_cache.max_rss // self.workers,
+                    self.pipeline_cache.mmap_weights,
+                    ready,
+                ),
+            )
+            if ready is not None:
+                # worker processes are spawned on demand, when a task is
+                # submitted and no process is idle. No task runs before all
+                # processes passed the barrier, so each of these tasks spawns
+                # one, and they complete once every process preloaded its
+                # pipelines. A process failing to preload breaks the pool.
+                futures = [self.executor.submit(os.getpid) for _ in range(self.workers)]
+                for future in futures:
+                    future.result()
+        else:
+            if self.workers > 1:
+                set_torch_threads(self.threads_per_worker)
+            preload_pipelines(self.preload, self.pipeline_cache)
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="hulse-worker"
+            )
+        self.post_executor = ThreadPoolExecutor(
+            max_workers=self.post_workers, thread_name_prefix="hulse-post"
+        )
+        if self.batch_size > 1:
+            self.batcher = Batcher(
+                self.submit_batch, self.batch_size, self.batch_wait_ms
+            )
+        self.dispatcher = threading.Thread(
+            target=self._dispatch_admitted, name="hulse-dispatcher", daemon=True
+        )
+        self.dispatcher.start()
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+            logger.info("Serving host metrics on %s", self.metrics_server.url)
+
+    def close(self, wait: bool = True):
+        """Stop the worker pools.
+
+        :param wait: Whether to wait for pending queries to be answered, defaults to True
+        :type wait: bool, optional
+        """
+        self._stopped.set()
+        for query in self.admission.close(drain=wait):
+            self._refuse(query)
+        if self.dispatcher and wait:
+            self.dispatcher.join()
+        if self.batcher:
+            self.batcher.close()
+        if self.executor:
+            self.executor.shutdown(wait=wait)
+        if self.post_executor:
+            self.post_executor.shutdown(wait=wait)
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self._profile_timer is not None:
+            self._profile_timer.cancel()
+        self._write_profile()
+
+    def _write_profile(self):
+        # stop the profiler and write its profile, once
+        with self._lock:
+            if self.profiler is None or not self.profiler.running:
+                return
+            self.profiler.stop()
+        folded, report = self.profiler.write(self.profile_output)
+        logger.warning(
+            "Host profile written to %s and %s\n%s",
+            folded,
+            report,
+            self.profiler.report(),
+        )
+
+    def submit(self, query: dict):
+        """Admit a query, to be dispatched to the inference workers once one is free.
+
+        Queries identical to a running query wait for its result instead, and
+        memoized results are posted right away. Queries refused by the
+        admission queue are rejected back to the server as busy.
+
+        :param query: Query received on the producer stream.
+        :type query: dict
+        """
+        qid = query.get("qid")
+        if qid is not None:
+            if qid in self.seen:
+                with self._lock:
+                    self.duplicates += 1
+                return
+            self.seen.put(qid, True)
+
+        query = utils.localize_deadline(query)
+        if utils.is_expired(query):
+            self._on_expired(query)
+            return
+
+        received = time.time()
+        query = bound_query(query, self.max_new_tokens, self.max_input_length)
+        query["received_at"] = received
+        key = query_key(query)
+        if self.result_cache is not None:
+            result = self.result_cache.get(key)
+            if result is not None:
+                spans = [tracing.make_span("result.cache", received, time.time())]
+                self.metrics.observe_query(query, "cached")
+                self.post_executor.submit(self._post_result, query, result, None, spans)
+                return
+
+        with self._lock:
+            if key in self._waiting:
+                self._waiting[key].append(query)
+                self.coalesced += 1
+                return
+            self._waiting[key] = []
+        for refused in self.admission.put(query):
+            self._refuse(refused)
+
+    def _dispatch_admitted(self):
+        while True:
+            self._slots.acquire()
+            query = self.admission.get()
+            if query is None:
+                self._slots.release()
+                return
+            if utils.is_expired(query):
+                self._slots.release()
+                self._on_leader_expired(query)
+            else:
+                self._dispatch(query)
+
+    def _dispatch(self, query: dict):
+        if self.batcher and Batcher.is_batchable(query):
+            self.batcher.add(query)
+        else:
+            self.submit_batch([query])
+
+    def submit_batch(self, queries: list) -> Future:
+        """Dispatch a batch of queries to the inference workers.
+
+        :param queries: Queries for the same task and model.
+        :type queries: list
+        :return: Future of the result of each query.
+        :rtype: Future
+        """
+        with self._lock:
+            self.pending += len(queries)
+        token_stream = None
+        if self.worker_type == "process":
+            # generated tokens cannot be streamed back from worker processes,
+            # streaming queries get their whole result at once
+            future = self.executor.submit(run_traced_batch, queries)
+        else:
+            if len(queries) == 1 and queries[0].get("stream"):
+                token_stream = TokenStream(
+                    partial(self._post_partial, queries[0].get("qid")),
+                    self.post_executor,
+                )
+            future = self.executor.submit(
+                run_traced_batch,
+                queries,
+                self.pipeline_cache,
+                token_stream.put if token_stream is not None else None,
+            )
+        future.add_done_callback(
+            partial(self._on_inference_done, queries, time.monotonic(), token_stream)
+        )
+        return future
+
+    def _on_inference_done(
+        self,
+        queries: list,
+        started: float,
+        token_stream: TokenStream,
+        future: Future,
+    ):
+        spec = format_model_spec(queries[0].get("task"), queries[0].get("model"))
+        with self._lock:
+            self.pending -= len(queries)
+            if not future.cancelled() and not future.exception():
+                elapsed = time.monotonic() - started
+                previous = self.latency.get(spec, elapsed)
+                self.latency[spec] = 0.8 * previous + 0.2 * elapsed
+        for _ in queries:
+            self._slots.release()
+        if future.cancelled():
+            return
+        if isinstance(future.exception(), errors.MemoryBudgetError):
+            # let the server route the queries to a host with more memory
+            logger.warning(future.exception().message)
+            for query in queries:
+                self._refuse(query)
+            return
+        if future.exception():
+            logger.error(
+                "Queries %s failed: %s",
+                [query.get("qid") for query in queries],
+                repr(future.exception()),
+            )
+            # answer the queries and their followers, instead of leaving
+            # their consumers waiting until they time out
+            reason = repr(future.exception())
+            for query in queries:
+                with self._lock:
+                    waiting = self._waiting.pop(query_key(query), [])
+                for failed in [query] + waiting:
+                    self.metrics.observe_query(failed, "failed")
+                    self.post_executor.submit(
+                        self._post_error, failed.get("qid"), reason
+                    )
+            return
+
+        results, spans = future.result()
+        self.metrics.observe_spans(queries[0], spans)
+        for query, result in zip(queries, results):
+            if result is None:
+                self._on_leader_expired(query)
+                continue
+
+            key = query_key(query)
+            with self._lock:
+                waiting = self._waiting.pop(key, [])
+            if self.result_cache is not None:
+                self.result_cache.put(key, result)
+            leader_spans = self._host_spans(query, spans)
+            self.metrics.observe_query(query, "answered")
+            if token_stream is not None:
+                # the final answer follows the generated text of the query
+                token_stream.finish(
+                    partial(self._post_result, query, result, spans=leader_spans)
+                )
+            else:
+                self.post_executor.submit(
+                    self._post_result, query, result, None, leader_spans
+                )
+            for answered in waiting:
+                self.metrics.observe_query(answered, "coalesced")
+                self.post_executor.submit(
+                    self._post_result,
+                    answered,
+                    result,
+                    None,
+                    self._host_spans(answered, spans),
+                )
+
+    @staticmethod
+    def _host_spans(query: dict, spans: list) -> list:
+        # wait of a query for a worker, or for an identical running query,
+        # followed by the spans of the inference which answered it
+        received = query.get("received_at") or time.time()
+        if spans and received <= spans[0]["start"]:
+            return [
+                tracing.make_span("host.queue", received, spans[0]["start"]),
+                *spans,
+            ]
+        return [tracing.make_span("host.wait", received, time.time()), *spans]
+
+    def _on_leader_expired(self, query: dict):
+        # the query expired while queued, run the next identical query instead
+        key = query_key(query)
+        with self._lock:
+            waiting = self._waiting.pop(key, [])
+        self._on_expired(query)
+        live = []
+        for follower in waiting:
+            if utils.is_expired(follower):
+                self._on_expired(follower)
+            else:
+                live.append(follower)
+        if live:
+            with self._lock:
+                if key in self._waiting:
+                    # an identical query started running in between
+                    self._waiting[key].extend(live)
+                    return
+                self._waiting[key] = live[1:]
+            self.admission.put(live[0], front=True)
+
+    def _refuse(self, query: dict):
+        # answer the query and the identical queries waiting for it as busy
+        with self._lock:
+            waiting = self._waiting.pop(query_key(query), [])
+        for refused in [query] + waiting:
+            logger.info("Rejected query %s, host is busy", refused.get("qid"))
+            self.metrics.observe_query(refused, "rejected")
+            self.post_executor.submit(self._post_busy, refused.get("qid"))
+
+    def _on_expired(self, query: dict):
+        with self._lock:
+            self.expired += 1
+        self.metrics.observe_query(query, "expired")
+        logger.info("Dropped query %s past its deadline", query.get("qid"))
+
+    def _post_busy(self, qid: str):
+        try:
+            post_busy(
+                qid,
+                self.api_key,
+                sessions=self.sessions,
+                wire_format=self._wire_format,
+            )
+        except requests.exceptions.RequestException as e:
+            self.metrics.post_failures.inc(kind="busy")
+            logger.error("Failed to reject query %s: %s", qid, repr(e))
+
+    def _post_error(self, qid: str, reason: str):
+        try:
+            post_error(
+                qid,
+                reason,
+                self.api_key,
+                sessions=self.sessions,
+                wire_format=self._wire_format,
+            )
+        except requests.exceptions.RequestException as e:
+            self.metrics.post_failures.inc(kind="error")
+            logger.error("Failed to post error of query %s: %s", qid, repr(e))
+
+    def _post_result(self, query: dict, result: Any, seq: int = None, spans: list = ()):
+        qid = query.get("qid")
+        try:
+            post_result(
+                qid,
+                result,
+                self.api_key,
+                sessions=self.sessions,
+                wire_format=self._wire_format,
+                seq=seq,
+                trace=make_trace(query, spans),
+            )
+        except requests.exceptions.RequestException as e:
+            self.metrics.post_failures.inc(kind="result")
+            logger.error("Failed to post result of query %s: %s", qid, repr(e))
+
+    def _post_partial(self, qid: str, seq: int, token: str):
+        try:
+            post_partial(
+                qid,
+                seq,
+                token,
+                self.api_key,
+                sessions=self.sessions,
+                wire_format=self._wire_format,
+            )
+        except requests.exceptions.RequestException as e:
+            self.metrics.post_failures.inc(kind="tokens")
+            logger.error("Failed to post tokens of query %s: %s", qid, repr(e))
+
+    def loaded_models(self) -> list:
+        """Get the pipelines loaded by the inference workers.
+
+        :return: Task and model spec of each loaded pipeline.
+        :rtype: list
+        """
+        if self.worker_type == "process":
+            # worker processes own their cache, report the pipelines they used
+            models = {format_model_spec(*spec) for spec in self.preload}
+            with self._lock:
+                models.update(self.latency)
+        else:
+            models = {
+                format_model_spec(task, model)
+                for task, model, _ in self.pipeline_cache.keys()
+            }
+        return sorted(models)
+
+    def capabilities(self) -> dict:
+        """Get the capabilities advertised to the stream server.
+
+        :return: Cores, memory, loaded models, queue depth and per-model latency of the host.
+        :rtype: dict
+        """
+        models = self.loaded_models()
+        with self._lock:
+            return dict(
+                host_id=self.host_id,
+                cores=os.cpu_count() or 1,
+                workers=self.workers,
+                memory=utils.get_total_memory(),
+                rss=utils.get_rss(),
+                models=models,
+                queue_depth=self.pending + len(self.admission),
+                admission=self.admission.stats(),
+                reconnects=self.reconnects,
+                downtime=round(self.downtime, 3),
+                latency={spec: round(t, 4) for spec, t in self.latency.items()},
+            )
+
+    def report_status(self) -> bool:
+        """Post the current capabilities of the host to the stream server.
+
+        :return: Whether the stream server received them.
+        :rtype: bool
+        """
+        session = self.sessions.get(settings.HULSE_STREAM_URL)
+        try:
+            r = session.post(
+                settings.HULSE_STREAM_URL + "status/",
+                json=self.capabilities(),
+                headers=settings.get_auth_headers(self.api_key),
+            )
+        except requests.exceptions.RequestException as e:
+            logger.warning("Failed to report host status: %s", repr(e))
+            return False
+        return r.status_code == 200
+
+    def _report_status_periodically(self):
+        while not self._stopped.wait(self.status_interval):
+            self.report_status()
+
+    def handle_stream(self, response: requests.Response):
+        """Dispatch the queries received on the producer stream.
+
+        :param response: Stream request response to be handled.
+        :type response: requests.Response
+        """
+        if self._wire_format is not None:
+            messages = self._wire_format.iter_messages(sse.iter_chunks(response))
+        else:
+            messages = (
+                Message(event.json(), event.id)
+                for event in sse.iter_events(sse.iter_chunks(response))
+            )
+        for message in messages:
+            if message.data:
+                self.submit(message.data)
+            if message.id is not None:
+                self.last_event_id = message.id
+
+    def connect(self) -> requests.Response:
+        """Open the producer stream, resuming from the last received event.
+
+        :raises errors.HulseError: If the server refused the connection.
+        :return: Stream request response.
+        :rtype: requests.Response
+        """
+        # build channel path to host computation
+        channel_path = f"producer/{self.api_key}/"
+        headers = settings.get_auth_headers(self.api_key)
+        if self.last_event_id is not None:
+            headers["Last-Event-ID"] = self.last_event_id
+        if self.wire_format is not None:
+            headers.update(self.wire_format.accept_headers())
+
+        # make streaming request to hulse server to enable push
+        session = self.sessions.get(settings.HULSE_STREAM_URL)
+        r = session.get(
+            settings.HULSE_STREAM_URL + channel_path,
+            params={"host_id": self.host_id},
+            headers=headers,
+            stream=True,
+            timeout=(settings.QUERY_CONNECT_TIMEOUT, self.stream_timeout or None),
+        )
+        if r.status_code != 200:
+            r.close()
+            raise errors.HulseError(r.status_code)
+        # servers which do not support the compact format stream events
+        self._wire_format = WireFormat.from_headers(r.headers)
+        # advertise the capabilities of the host for routing, once registered
+        self.report_status()
+        return r
+
+    def stop(self):
+        """Stop the host, closing the producer stream."""
+        self._stopped.set()
+        if self._response is not None:
+            self._response.close()
+
+    def run(self):
+        """Run the Hulse host until stopped, reconnecting to the producer stream.
+
+        :raises errors.HulseError: If the server refused the connection or the
+            maximum number of reconnects was exceeded.
+        """
+        try:
+            # the pools started so far are closed if preloading fails
+            self.start()
+            if self.status_interval > 0:
+                self._status_thread = threading.Thread(
+                    target=self._report_status_periodically,
+                    name="hulse-status",
+                    daemon=True,
+                )
+                self._status_thread.start()
+            self._stream_until_stopped()
+        finally:
+            self.close()
+            self.sessions.close()
+
+    def _stream_until_stopped(self):
+        # handle the producer stream, reconnecting with a jittered backoff
+        failures = 0
+        disconnected_at = None
+        try:
+            while not self._stopped.is_set():
+                try:
+                    self._response = self.connect()
+                    if disconnected_at is not None:
+                        self.downtime += time.monotonic() - disconnected_at
+                        self.reconnects += 1
+                        logger.info(
+                            "Reconnected to the producer stream after %.1fs",
+                            time.monotonic() - disconnected_at,
+                        )
+                    failures = 0
+                    disconnected_at = None
+                    self.handle_stream(self._response)
+                    reason = "stream closed"
+                except errors.HulseError as e:
+                    # client errors such as an invalid API key are not retried
+                    if e.status is None or e.status < 500 and e.status != 429:
+                        raise
+                    reason = e.message
+                except requests.exceptions.RequestException as e:
+                    reason = type(e).__name__
+                except Exception:
+                    # closing the stream from stop may break the read loop
+                    if self._stopped.is_set():
+                        break
+                    raise
+
+                if self._stopped.is_set():
+                    break
+                if disconnected_at is None:
+                    disconnected_at = time.monotonic()
+                failures += 1
+                if 0 <= self.max_reconnects < failures:
+                    raise errors.HulseError(expression=reason)
+
+                # full jitter, so that hosts do not reconnect all at once
+                backoff = min(
+                    self.max_reconnect_backoff,
+                    self.reconnect_backoff * 2 ** (failures - 1),
+                )
+                delay = random.uniform(0, backoff)
+                logger.warning(
+                    "Producer stream disconnected (%s), reconnecting in %.1fs",
+                    reason,
+                    delay,
+                )
+                self._stopped.wait(delay)
+        except errors.HulseError:
+            raise
+        except Exception as e:
+            raise errors.HulseError(expression=e)
+
+
+def run_host(api_key: str, **kwargs):
+    """Run the Hulse host until termination.
+
+    :param api_key: Hulse API key for the account.
+    :type api_key: str
+    :param kwargs: Host options, see :class:`Host`.
+    """
+    Host(api_key, **kwargs).run()
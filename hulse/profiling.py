@@ -0,0 +1,202 @@
+"""Sampling profiler of the host, breaking its time down by stage of the queries.
+
+The stacks of all the threads of the host process are sampled at a fixed
+interval, without instrumenting the profiled code, so that hosts can be
+profiled on real traffic. Samples of threads waiting for work are dropped,
+and the others are attributed to the first of these stages found on their
+stack:
+
+- ``result post``: posting results, tokens, rejections and errors to the server
+- ``pipeline construction``: loading pipelines and applying their backend
+- ``tokenization``: tokenizers and the preprocessing of pipelines
+- ``forward pass``: model forward passes and generation
+- ``json parse``: decoding events, frames and JSON payloads
+- ``stream read``: reading the producer stream
+- ``inference (other)``: the rest of pipeline calls, such as postprocessing
+- ``other``: everything else
+
+Reading the stream only counts the time spent decoding its chunks, since a
+thread receiving data cannot be told apart from a thread waiting for queries.
+
+Stacks are written in the folded format of flamegraph.pl, also read by
+speedscope, along with a report of the stages. Worker processes are not
+sampled, hosts profiling inferences must run them on threads.
+"""
+
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Union
+
+from hulse import settings
+
+# stage of a stack, from the first rule matching one of its frames: a file
+# path fragment, None for any file, and function names, None for any function
+STAGE_RULES = [
+    (
+        "result post",
+        "hulse",
+        {"post_result", "post_partial", "post_busy", "post_error", "_post_answer"},
+    ),
+    (
+        "pipeline construction",
+        "hulse",
+        {"load_pipeline", "load_onnx_pipeline", "quantize", "compile_model"},
+    ),
+    ("tokenization", "tokenization_utils", None),
+    ("tokenization", "tokenizers", None),
+    ("tokenization", "transformers", {"preprocess"}),
+    ("forward pass", "torch", None),
+    ("forward pass", "transformers", {"forward", "_forward", "generate"}),
+    ("json parse", "json", None),
+    ("json parse", "msgpack", None),
+    ("json parse", "hulse", {"feed", "json", "loads", "decode", "_parse_field"}),
+    ("stream read", "hulse", {"iter_chunks"}),
+    ("stream read", "requests", {"iter_content", "generate"}),
+    ("inference (other)", "hulse", {"run_inference", "run_batch"}),
+]
+
+# innermost frames of threads blocked waiting for work
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("selectors.py", "select"),
+    ("socketserver.py", "serve_forever"),
+}
+
+# innermost frames of socket reads, blocked on the stream when waiting for queries
+SOCKET_READS = {("socket.py", "readinto"), ("ssl.py", "recv_into"), ("ssl.py", "read")}
+
+
+def classify(frames: list) -> str:
+    """Get the stage of a sampled stack.
+
+    :param frames: File name and function name of each frame, innermost first.
+    :type frames: list
+    :return: Name of the stage, "idle" for threads waiting for work.
+    :rtype: str
+    """
+    leaf = (Path(frames[0][0]).name, frames[0][1]) if frames else None
+    if leaf in IDLE_FRAMES:
+        return "idle"
+    for stage, path, names in STAGE_RULES:
+        for filename, name in frames:
+            if (path is None or path in filename) and (names is None or name in names):
+                if stage == "stream read" and leaf in SOCKET_READS:
+                    return "idle"
+                return stage
+    return "other"
+
+
+class SamplingProfiler:
+    """Profiler sampling the stacks of all threads from a background thread."""
+
+    def __init__(
+        self,
+        interval: float = settings.HOST_PROFILE_INTERVAL,
+        include_idle: bool = False,
+    ):
+        """Create a new profiler.
+
+        :param interval: Interval between samples in seconds, defaults to settings.HOST_PROFILE_INTERVAL
+        :type interval: float, optional
+        :param include_idle: Whether to keep the samples of threads waiting for work, defaults to False
+        :type include_idle: bool, optional
+        """
+        self.interval = interval
+        self.include_idle = include_idle
+        # samples of each folded stack and of each stage
+        self.stacks = Counter()
+        self.stages = Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self._labels = {}
+        self._started = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start sampling."""
+        self._stopped.clear()
+        self._started = time.monotonic()
+        self._thread = threading.Thread(
+            target=self._run, name="hulse-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling, keeping the samples taken so far."""
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        self.duration += time.monotonic() - self._started
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = (
+                f"{code.co_name} ({Path(code.co_filename).name})"
+            )
+        return label
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                stage = classify([(code.co_filename, code.co_name) for code in codes])
+                if stage == "idle" and not self.include_idle:
+                    continue
+                labels = [names.get(ident, str(ident))]
+                labels.extend(self._label(code) for code in reversed(codes))
+                self.stacks[";".join(labels)] += 1
+                self.stages[stage] += 1
+                self.samples += 1
+
+    def report(self) -> str:
+        """Format the time spent in each stage.
+
+        :return: Samples and share of the samples of each stage.
+        :rtype: str
+        """
+        lines = [
+            f"{self.samples} samples over {self.duration:.1f}s, every {self.interval * 1e3:g}ms",
+            f"{'stage':<24}{'samples':>9}{'share':>8}",
+        ]
+        for stage, count in self.stages.most_common():
+            lines.append(f"{stage:<24}{count:>9}{count / self.samples:>8.1%}")
+        return "\n".join(lines)
+
+    def write(self, output: Union[str, Path]) -> tuple:
+        """Write the folded stacks and the stage report.
+
+        :param output: Path of the output files, without extension.
+        :type output: Union[str, Path]
+        :return: Paths of the folded stacks and of the report.
+        :rtype: tuple
+        """
+        output = Path(output)
+        folded = output.with_name(output.name + ".folded")
+        report = output.with_name(output.name + ".txt")
+        with open(folded, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(report, "w") as f:
+            f.write(self.report() + "\n")
+        return folded, report
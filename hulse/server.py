@@ -0,0 +1,523 @@
+"""Local stand-in for the Hulse stream server, to run consumers and hosts offline.
+
+The server mirrors the stream protocol of Hulse: hosts listen for queries on
+``producer/<api_key>/``, consumers wait for their result on
+``consumer/<api_key>/`` and hosts answer queries on ``result/``. Hosts report
+their capabilities on ``status/`` once connected, and each query is routed to
+the host of the account that has its model loaded and the fewest queries in
+flight. Queries rejected by a busy host are routed to another host, if any.
+
+Events sent to hosts carry an ``id:``, and a host reconnecting with the same
+host id and a ``Last-Event-ID`` header gets the unanswered queries it missed.
+
+Queries sent with a timeout reach hosts with the time left to answer them,
+which hosts turn into a deadline of their own clock.
+
+Queries with a trace id get the spans of their wait on the server and of
+their host with their answer, see :mod:`hulse.tracing`.
+
+Consumers posting their query and hosts accepting the compact wire format of
+:mod:`hulse.encoding` are answered with frames instead of server-sent events,
+independently of the format of the other end.
+
+Usage::
+
+    from hulse import settings
+    from hulse.server import StreamServer
+
+    with StreamServer() as server:
+        settings.HULSE_STREAM_URL = server.url
+        ...
+
+or ``python -m hulse.server --port 8000``.
+"""
+
+import argparse
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+
+from hulse.encoding import COMPRESSION_HEADER, KEEP_ALIVE, WireFormat
+from hulse.tracing import make_span
+
+
+def format_event(data: dict, event_id: int = None) -> str:
+    """Format a server-sent event carrying JSON data.
+
+    :param data: Data of the event.
+    :type data: dict
+    :param event_id: Id of the event, defaults to None
+    :type event_id: int, optional
+    :return: Server-sent event.
+    :rtype: str
+    """
+    event = f"data: {json.dumps(data)}\n\n"
+    return f"id: {event_id}\n{event}" if event_id is not None else event
+
+
+class Producer:
+    """A host connected to the stand-in server."""
+
+    def __init__(self, host_id: str, api_key: str, capabilities: dict = None):
+        """Register a connected host.
+
+        :param host_id: Id of the host.
+        :type host_id: str
+        :param api_key: Hulse API key of the host.
+        :type api_key: str
+        :param capabilities: Capabilities advertised by the host, defaults to None
+        :type capabilities: dict, optional
+        """
+        self.host_id = host_id
+        self.api_key = api_key
+        self.capabilities = capabilities or {}
+        self.queries = queue.Queue()
+        # ids of the queries routed to the host and not answered yet
+        self.in_flight = set()
+        # event id and query of the unanswered queries sent to the host
+        self.sent = {}
+        self.last_event_id = 0
+        self.connected = False
+        # incremented on each connection, so that a stale stream stops
+        self.connection = 0
+
+    def is_warm(self, task: str, model: str = None) -> bool:
+        """Whether the host has the pipeline of a query loaded.
+
+        :param task: Transformer task of the query.
+        :type task: str
+        :param model: Model of the query, defaults to None
+        :type model: str, optional
+        :return: True if the pipeline is loaded.
+        :rtype: bool
+        """
+        spec = f"{task}:{model}" if model else task
+        return spec in self.capabilities.get("models", [])
+
+    def load(self) -> int:
+        """Number of queries the host is working on.
+
+        :return: Largest of the queries routed to the host and its reported queue depth.
+        :rtype: int
+        """
+        return max(len(self.in_flight), self.capabilities.get("queue_depth", 0))
+
+    def route_key(self, task: str, model: str = None) -> tuple:
+        """Sort key of the host for a query, lower is better.
+
+        :param task: Transformer task of the query.
+        :type task: str
+        :param model: Model of the query, defaults to None
+        :type model: str, optional
+        :return: Whether the host is cold, its load and its latency for the model.
+        :rtype: tuple
+        """
+        spec = f"{task}:{model}" if model else task
+        latency = self.capabilities.get("latency", {}).get(spec, float("inf"))
+        return not self.is_warm(task, model), self.load(), latency
+
+
+class StreamServer:
+    """Local stand-in for the Hulse stream server, routing queries to hosts."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        keep_alive: float = 15,
+    ):
+        """Create a new stand-in stream server.
+
+        :param host: Interface to listen on, defaults to "127.0.0.1"
+        :type host: str, optional
+        :param port: Port to listen on, defaults to 0 for any free port
+        :type port: int, optional
+        :param keep_alive: Interval between keep-alive comments on idle streams in seconds, defaults to 15
+        :type keep_alive: float, optional
+        """
+        self.host = host
+        self.port = port
+        self.keep_alive = keep_alive
+        self.producers = {}
+        self.routed = {}
+        self._queries = {}
+        self._results = {}
+        # local monotonic deadline of each query with a timeout
+        self._deadlines = {}
+        # time each traced query started waiting for a host, and its spans
+        self._traces = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self.app = self.create_app()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        """Base URL of the server, to be used as settings.HULSE_STREAM_URL."""
+        return f"http://{self.host}:{self.port}/"
+
+    def route(
+        self, api_key: str, task: str, model: str = None, exclude: set = ()
+    ) -> Producer:
+        """Pick the host answering a query.
+
+        :param api_key: Hulse API key of the consumer.
+        :type api_key: str
+        :param task: Transformer task of the query.
+        :type task: str
+        :param model: Model of the query, defaults to None
+        :type model: str, optional
+        :param exclude: Ids of the hosts which rejected the query, defaults to ()
+        :type exclude: set, optional
+        :return: The warmest and least busy host of the account, None if no host is connected.
+        :rtype: Producer
+        """
+        with self._lock:
+            candidates = [
+                p
+                for p in self.producers.values()
+                if p.api_key == api_key and p.connected and p.host_id not in exclude
+            ]
+            if not candidates:
+                return None
+            return min(candidates, key=lambda p: p.route_key(task, model))
+
+    def disconnect(self, host_id: str):
+        """Drop the producer stream of a host, as a flaky connection would.
+
+        :param host_id: Id of the host.
+        :type host_id: str
+        """
+        with self._lock:
+            producer = self.producers.get(host_id)
+            if producer is not None:
+                producer.connection += 1
+                producer.connected = False
+
+    def create_app(self):
+        """Create the Flask application of the server.
+
+        :return: Flask application.
+        :rtype: flask.Flask
+        """
+        from flask import Flask, Response, abort, request
+
+        app = Flask(__name__)
+
+        def stream(events, wire_format=None):
+            headers = {"Cache-Control": "no-cache"}
+            if wire_format is None:
+                return Response(events, mimetype="text/event-stream", headers=headers)
+            if wire_format.compression:
+                headers[COMPRESSION_HEADER] = wire_format.compression
+            return Response(
+                events, content_type=wire_format.content_type, headers=headers
+            )
+
+        def with_budget(query):
+            # hosts get the time left to answer the query, not a point in time
+            # which depends on their clock
+            deadline = self._deadlines.get(query["qid"])
+            if deadline is None:
+                return query
+            return dict(query, timeout=max(0.0, deadline - time.monotonic()))
+
+        def encoder(wire_format):
+            # encode events and keep-alives in the format of the stream
+            if wire_format is None:
+                return format_event, lambda comment: f": {comment}\n\n"
+            return wire_format.encode, lambda comment: KEEP_ALIVE
+
+        @app.route("/producer/<api_key>/")
+        def producer(api_key):
+            host_id = request.args.get("host_id") or uuid.uuid4().hex
+            last_event_id = request.headers.get("Last-Event-ID", type=int)
+            wire_format = WireFormat.from_headers(request.headers, "Accept")
+            encode, comment = encoder(wire_format)
+            with self._lock:
+                producer = self.producers.get(host_id)
+                if producer is None or producer.api_key != api_key:
+                    producer = Producer(host_id, api_key)
+                    self.producers[host_id] = producer
+                # resume the stream, replaying the queries the host missed
+                replay = sorted(
+                    (event_id, query)
+                    for event_id, query in producer.sent.values()
+                    if last_event_id is None or event_id > last_event_id
+                )
+                producer.connection += 1
+                producer.connected = True
+                connection = producer.connection
+
+            def events():
+                try:
+                    # send the headers right away, hosts wait for the first byte
+                    yield comment("connected")
+                    for event_id, query in replay:
+                        yield encode(with_budget(query), event_id)
+                    while producer.connection == connection:
+                        try:
+                            query = producer.queries.get(timeout=self.keep_alive)
+                        except queue.Empty:
+                            yield comment("keep-alive")
+                            continue
+                        if producer.connection != connection:
+                            producer.queries.put(query)
+                            break
+                        with self._lock:
+                            if query["qid"] not in producer.in_flight:
+                                continue
+                            producer.last_event_id += 1
+                            event_id = producer.last_event_id
+                            producer.sent[query["qid"]] = (event_id, query)
+                            trace = self._traces.get(query["qid"])
+                            if trace is not None:
+                                trace["spans"].append(
+                                    make_span(
+                                        "server.queue", trace["queued"], time.time()
+                                    )
+                                )
+                        yield encode(with_budget(query), event_id)
+                finally:
+                    with self._lock:
+                        if producer.connection == connection:
+                            producer.connected = False
+                            if not producer.in_flight:
+                                self.producers.pop(host_id, None)
+
+            return stream(events(), wire_format)
+
+        @app.route("/consumer/<api_key>/", methods=["GET", "POST"])
+        def consumer(api_key):
+            if request.method == "POST":
+                # query posted in the compact wire format
+                wire_format = WireFormat.from_headers(request.headers)
+                if wire_format is None:
+                    abort(415)
+                fields = wire_format.decode(request.get_data())
+                task, model = fields.get("task"), fields.get("model")
+                data, timeout = fields.get("data"), fields.get("timeout")
+                kwargs, streaming = fields.get("kwargs"), bool(fields.get("stream"))
+                trace_id = fields.get("trace_id")
+                wire_format = (
+                    WireFormat.from_headers(request.headers, "Accept") or wire_format
+                )
+            else:
+                task = request.args.get("task")
+                model = request.args.get("model") or None
+                data = request.args.getlist("data")
+                # lists are flagged, since a list of one item is a single parameter
+                if len(data) == 1 and not request.args.get("list", type=int):
+                    data = data[0]
+                timeout = request.args.get("timeout", type=float)
+                kwargs = json.loads(request.args.get("kwargs") or "null")
+                streaming = bool(request.args.get("stream", type=int))
+                trace_id = request.args.get("trace_id")
+                wire_format = None
+            encode, comment = encoder(wire_format)
+
+            producer = self.route(api_key, task, model)
+            if producer is None:
+                abort(418)
+
+            qid = uuid.uuid4().hex
+            deadline = time.monotonic() + timeout if timeout else None
+            # streaming queries get partial answers before their final one
+            result = queue.Queue()
+            query = dict(
+                qid=qid,
+                task=task,
+                model=model,
+                data=data,
+            )
+            if kwargs:
+                query["kwargs"] = kwargs
+            if streaming:
+                query["stream"] = True
+            if trace_id:
+                query["trace_id"] = trace_id
+            with self._lock:
+                if trace_id:
+                    self._traces[qid] = dict(
+                        trace_id=trace_id, queued=time.time(), spans=[]
+                    )
+                self._results[qid] = result
+                self._queries[qid] = (api_key, query, set())
+                if deadline is not None:
+                    self._deadlines[qid] = deadline
+                self.routed[qid] = producer.host_id
+                producer.in_flight.add(qid)
+            producer.queries.put(query)
+
+            def events():
+                try:
+                    yield comment("routed")
+                    timeout = deadline - time.monotonic() if deadline else None
+                    while timeout is None or timeout > 0:
+                        try:
+                            answer = result.get(
+                                timeout=min(timeout or 1e9, self.keep_alive)
+                            )
+                        except queue.Empty:
+                            yield comment("keep-alive")
+                        else:
+                            # legacy consumers get the result as a JSON string
+                            if wire_format is None and "result" in answer:
+                                answer["result"] = json.dumps(answer["result"])
+                            yield encode(answer)
+                            if "token" not in answer:
+                                return
+                        timeout = deadline - time.monotonic() if deadline else None
+                finally:
+                    with self._lock:
+                        self._results.pop(qid, None)
+                        self._queries.pop(qid, None)
+                        self._deadlines.pop(qid, None)
+                        self._traces.pop(qid, None)
+                        host_id = self.routed.pop(qid, None)
+                        producer = self.producers.get(host_id)
+                        if producer is not None:
+                            producer.in_flight.discard(qid)
+                            producer.sent.pop(qid, None)
+                            if not producer.connected and not producer.in_flight:
+                                del self.producers[host_id]
+
+            return stream(events(), wire_format)
+
+        @app.route("/result/", methods=["POST"])
+        def result():
+            wire_format = WireFormat.from_headers(request.headers)
+            if wire_format is not None:
+                answer = wire_format.decode(request.get_data())
+            else:
+                answer = request.form.to_dict()
+                if "result" in answer:
+                    answer["result"] = json.loads(answer["result"])
+                if "seq" in answer:
+                    answer["seq"] = int(answer["seq"])
+                if "trace" in answer:
+                    answer["trace"] = json.loads(answer["trace"])
+            qid = answer.get("qid")
+
+            if "token" in answer:
+                # partial answer of a streaming query, the host is still on it
+                with self._lock:
+                    waiting = self._results.get(qid)
+                if waiting is None:
+                    abort(404)
+                waiting.put(dict(qid=qid, seq=answer.get("seq"), token=answer["token"]))
+                return "", 200
+
+            with self._lock:
+                waiting = self._results.get(qid)
+                pending = self._queries.get(qid)
+                host_id = self.routed.pop(qid, None)
+                if host_id in self.producers:
+                    self.producers[host_id].in_flight.discard(qid)
+                    self.producers[host_id].sent.pop(qid, None)
+                if pending is not None:
+                    pending[2].add(host_id)
+            # the consumer may have gone away meanwhile
+            if waiting is None or pending is None:
+                abort(404)
+
+            if answer.get("error") == "busy":
+                api_key, query, refused = pending
+                producer = self.route(
+                    api_key, query["task"], query["model"], exclude=refused
+                )
+                if producer is not None:
+                    with self._lock:
+                        self.routed[qid] = producer.host_id
+                        producer.in_flight.add(qid)
+                        if qid in self._traces:
+                            self._traces[qid]["queued"] = time.time()
+                    producer.queries.put(query)
+                else:
+                    waiting.put(dict(qid=qid, error="busy"))
+                return "", 200
+
+            if answer.get("error"):
+                # the host failed to answer the query, and will not retry it
+                with self._lock:
+                    self._traces.pop(qid, None)
+                waiting.put(
+                    dict(qid=qid, error=answer["error"], reason=answer.get("reason"))
+                )
+                return "", 200
+
+            final = dict(qid=qid, result=answer.get("result"))
+            if "seq" in answer:
+                final.update(seq=answer["seq"], final=True)
+            with self._lock:
+                trace = self._traces.pop(qid, None)
+            if trace is not None:
+                received = time.time()
+                spans = trace["spans"]
+                host_trace = answer.get("trace") or {}
+                for span in host_trace.get("spans") or []:
+                    # the post of the result ends once received
+                    spans.append(dict(span, end=span.get("end") or received))
+                final["trace"] = dict(trace_id=trace["trace_id"], spans=spans)
+            waiting.put(final)
+            return "", 200
+
+        @app.route("/status/", methods=["POST"])
+        def status():
+            capabilities = request.get_json(force=True, silent=True) or {}
+            with self._lock:
+                producer = self.producers.get(capabilities.get("host_id"))
+                if producer is None:
+                    abort(404)
+                producer.capabilities = capabilities
+            return "", 200
+
+        return app
+
+    def start(self):
+        """Serve requests from a background thread."""
+        from werkzeug.serving import make_server
+
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        self._server = make_server(self.host, self.port, self.app, threaded=True)
+        self.port = self._server.server_port
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="hulse-server", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving requests."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local Hulse stream server.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    args = parser.parse_args()
+
+    server = StreamServer(args.host, args.port)
+    server.start()
+    print(f"Serving the Hulse stream protocol on {server.url}")
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from hulse import settings
+
+
+def make_session(
+    pool_size: int = settings.HTTP_POOL_SIZE,
+    retries: int = settings.HTTP_RETRIES,
+    backoff: float = settings.HTTP_BACKOFF,
+    keep_alive: bool = True,
+) -> requests.Session:
+    """Create an HTTP session with a connection pool and a retry policy.
+
+    Failed connections are retried for all requests, while 502, 503 and 504
+    responses are only retried for idempotent requests. Read errors are never
+    retried, since the query may already be processed and retrying it would
+    exceed its timeout.
+
+    :param pool_size: Maximum number of connections kept open, defaults to settings.HTTP_POOL_SIZE
+    :type pool_size: int, optional
+    :param retries: Maximum number of retries of a request, defaults to settings.HTTP_RETRIES
+    :type retries: int, optional
+    :param backoff: Backoff factor between retries in seconds, defaults to settings.HTTP_BACKOFF
+    :type backoff: float, optional
+    :param keep_alive: Whether to keep connections open between requests, defaults to True
+    :type keep_alive: bool, optional
+    :return: Configured HTTP session.
+    :rtype: requests.Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        max_retries=Retry(
+            total=retries,
+            read=False,
+            backoff_factor=backoff,
+            status_forcelist=settings.HTTP_RETRY_STATUSES,
+            raise_on_status=False,
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+    return session
+
+
+class SessionPool:
+    """Pooled keep-alive HTTP sessions, one per base URL of the Hulse services."""
+
+    def __init__(
+        self,
+        pool_size: int = settings.HTTP_POOL_SIZE,
+        retries: int = settings.HTTP_RETRIES,
+        backoff: float = settings.HTTP_BACKOFF,
+        keep_alive: bool = True,
+    ):
+        """Create a new pool of HTTP sessions.
+
+        :param pool_size: Maximum number of connections kept open per base URL, defaults to settings.HTTP_POOL_SIZE
+        :type pool_size: int, optional
+        :param retries: Maximum number of retries of a request, defaults to settings.HTTP_RETRIES
+        :type retries: int, optional
+        :param backoff: Backoff factor between retries in seconds, defaults to settings.HTTP_BACKOFF
+        :type backoff: float, optional
+        :param keep_alive: Whether to keep connections open between requests, defaults to True
+        :type keep_alive: bool, optional
+        """
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.keep_alive = keep_alive
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get(self, url: str) -> requests.Session:
+        """Get the session of the base URL of the given URL.
+
+        :param url: URL to be requested.
+        :type url: str
+        :return: Session shared by all requests to the same scheme and host.
+        :rtype: requests.Session
+        """
+        parts = urlsplit(url)
+        base_url = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            if base_url not in self._sessions:
+                self._sessions[base_url] = make_session(
+                    pool_size=self.pool_size,
+                    retries=self.retries,
+                    backoff=self.backoff,
+                    keep_alive=self.keep_alive,
+                )
+            return self._sessions[base_url]
+
+    def close(self):
+        """Close all sessions and their open connections."""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+# sessions used when no pool is provided by a client or host
+default_sessions = SessionPool()
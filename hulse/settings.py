@@ -2,7 +2,6 @@ import os
 import json
 import copy
 from pathlib import Path
-import requests
 
 from appdirs import user_config_dir
 from dotenv import load_dotenv
@@ -40,6 +39,213 @@ SUPPORTED_TASKS = [
     "zero-shot-classification",
 ]
 
+# keyword arguments of the pipeline call that queries may set for each task,
+# refer to the transformers pipeline docs
+_GENERATION_KWARGS = [
+    "max_new_tokens",
+    "min_new_tokens",
+    "num_beams",
+    "num_return_sequences",
+    "do_sample",
+    "temperature",
+    "top_k",
+    "top_p",
+    "repetition_penalty",
+    "no_repeat_ngram_size",
+    "truncation",
+]
+TASK_KWARGS = {
+    "summarization": _GENERATION_KWARGS + ["clean_up_tokenization_spaces"],
+    "translation": _GENERATION_KWARGS + ["src_lang", "tgt_lang"],
+    "text-generation": _GENERATION_KWARGS + ["return_full_text"],
+    "text-classification": ["top_k", "function_to_apply", "truncation"],
+    "sentiment-analysis": ["top_k", "function_to_apply", "truncation"],
+    "question-answering": [
+        "top_k",
+        "max_answer_len",
+        "max_question_len",
+        "handle_impossible_answer",
+    ],
+    "text2text-generation": _GENERATION_KWARGS,
+    "zero-shot-classification": [
+        "candidate_labels",
+        "hypothesis_template",
+        "multi_label",
+    ],
+}
+# tasks whose pipelines generate tokens, and tasks whose inputs are truncated
+# to the maximum length of their model
+GENERATION_TASKS = [
+    "summarization",
+    "translation",
+    "text-generation",
+    "text2text-generation",
+]
+TRUNCATION_TASKS = [
+    "summarization",
+    "translation",
+    "text-classification",
+    "sentiment-analysis",
+    "text2text-generation",
+]
+
+# tasks whose generated tokens can be streamed to the consumer as they come
+STREAMING_TASKS = ["text-generation", "text2text-generation"]
+
+# pooled keep-alive HTTP sessions, failed connections and 502, 503, 504
+# responses are retried with an exponential backoff
+HTTP_POOL_SIZE = int(os.getenv("HULSE_HTTP_POOL_SIZE", 16))
+HTTP_RETRIES = int(os.getenv("HULSE_HTTP_RETRIES", 3))
+HTTP_BACKOFF = float(os.getenv("HULSE_HTTP_BACKOFF", 0.5))
+HTTP_RETRY_STATUSES = [502, 503, 504]
+
+# default query timeouts in seconds, for the connection to the stream server,
+# the first byte of its response and the whole query, whose time left is
+# forwarded to hosts so that they drop queries the consumer gave up on
+QUERY_CONNECT_TIMEOUT = float(os.getenv("HULSE_QUERY_CONNECT_TIMEOUT", 10))
+QUERY_FIRST_BYTE_TIMEOUT = float(os.getenv("HULSE_QUERY_FIRST_BYTE_TIMEOUT", 30))
+QUERY_TIMEOUT = float(os.getenv("HULSE_QUERY_TIMEOUT", 300))
+
+# default number of in-flight queries for batch queries from the client
+QUERY_CONCURRENCY = int(os.getenv("HULSE_QUERY_CONCURRENCY", 8))
+
+# opt-in compact wire format of queries and results, sent as length-prefixed
+# frames encoded with json or msgpack (`pip install hulse[msgpack]`) instead of
+# URL parameters, server-sent events and form fields. Frames larger than
+# WIRE_COMPRESS_MIN_SIZE bytes are compressed with gzip or zstd
+# (`pip install hulse[zstd]`)
+WIRE_ENCODINGS = ["json", "msgpack"]
+WIRE_ENCODING = os.getenv("HULSE_WIRE_ENCODING") or None
+WIRE_COMPRESSIONS = ["gzip", "zstd"]
+WIRE_COMPRESSION = os.getenv("HULSE_WIRE_COMPRESSION") or None
+WIRE_COMPRESS_MIN_SIZE = int(os.getenv("HULSE_WIRE_COMPRESS_MIN_SIZE", 1024))
+
+# every query carries a trace id and gets the spans of its stages on the
+# consumer, the server and the host with its answer, see hulse.tracing. Traces
+# are exported to OpenTelemetry when TRACE_EXPORTER is "otel"
+# (`pip install hulse[otel]`)
+TRACE_EXPORTERS = ["otel"]
+TRACE_EXPORTER = os.getenv("HULSE_TRACE_EXPORTER") or None
+
+# opt-in client-side cache of query results, kept in memory and optionally on
+# disk, results expire after RESULT_CACHE_TTL seconds
+RESULT_CACHE_SIZE = int(os.getenv("HULSE_RESULT_CACHE_SIZE", 1024))
+RESULT_CACHE_DISK_SIZE = int(os.getenv("HULSE_RESULT_CACHE_DISK_SIZE", 100000))
+RESULT_CACHE_TTL = float(os.getenv("HULSE_RESULT_CACHE_TTL", 24 * 3600))
+RESULT_CACHE_PATH = CONFIG_PATH / "results.sqlite3"
+
+# budget of the host pipeline cache, least recently used pipelines are evicted
+# first once the number of pipelines or their memory footprint (bytes) exceeds it
+PIPELINE_CACHE_SIZE = int(os.getenv("HULSE_PIPELINE_CACHE_SIZE", 4))
+PIPELINE_CACHE_MEMORY = int(os.getenv("HULSE_PIPELINE_CACHE_MEMORY", 0))
+
+# resident memory budget of the host process in bytes, 0 for no limit: least
+# recently used pipelines are unloaded to make room for new ones, and pipelines
+# which cannot fit are refused. With PIPELINE_MMAP_WEIGHTS, weights are only
+# loaded from memory-mapped safetensors files, so that unloaded pipelines reload
+# from the page cache of the OS. Pipelines are sized before loading from their
+# weights, looked up on the hub within PIPELINE_ESTIMATE_TIMEOUT seconds when
+# they are not downloaded yet
+HOST_MAX_MEMORY = int(os.getenv("HULSE_HOST_MAX_MEMORY", 0))
+PIPELINE_MMAP_WEIGHTS = os.getenv("HULSE_PIPELINE_MMAP_WEIGHTS", "0") == "1"
+PIPELINE_ESTIMATE_TIMEOUT = float(os.getenv("HULSE_PIPELINE_ESTIMATE_TIMEOUT", 5))
+
+# host worker pool, inferences run on HOST_WORKERS threads or processes while
+# results are posted back to the server from HOST_POST_WORKERS threads
+HOST_WORKER_TYPES = ["thread", "process"]
+HOST_WORKERS = int(os.getenv("HULSE_HOST_WORKERS", 1))
+HOST_WORKER_TYPE = os.getenv("HULSE_HOST_WORKER_TYPE", "thread")
+HOST_POST_WORKERS = int(os.getenv("HULSE_HOST_POST_WORKERS", 4))
+
+# bounded admission queue of the host, holding queries until an inference
+# worker is free, 0 for no bound. Once full, new queries are either rejected
+# back to the server as busy, shed the oldest queued query or block reading
+# the producer stream until there is room
+HOST_QUEUE_POLICIES = ["reject", "shed-oldest", "block"]
+HOST_QUEUE_SIZE = int(os.getenv("HULSE_HOST_QUEUE_SIZE", 64))
+HOST_QUEUE_POLICY = os.getenv("HULSE_HOST_QUEUE_POLICY", "block")
+
+# host memoization of inference results, identical queries are answered from
+# the cache or coalesced with the identical query already running, 0 disables
+# the cache but queries are still coalesced
+HOST_RESULT_CACHE_SIZE = int(os.getenv("HULSE_HOST_RESULT_CACHE_SIZE", 1024))
+HOST_RESULT_CACHE_TTL = float(os.getenv("HULSE_HOST_RESULT_CACHE_TTL", 3600))
+
+# host micro-batching, queries for the same pipeline are accumulated for up to
+# HOST_BATCH_WAIT_MS and run as a single batch, 1 disables batching
+BATCHABLE_TASKS = ["text-classification", "sentiment-analysis"]
+HOST_BATCH_SIZE = int(os.getenv("HULSE_HOST_BATCH_SIZE", 1))
+HOST_BATCH_WAIT_MS = float(os.getenv("HULSE_HOST_BATCH_WAIT_MS", 10))
+
+
+# hosts advertise their capabilities (cores, memory, loaded models, queue depth
+# and per-model latency) when connecting and every HOST_STATUS_INTERVAL seconds
+HOST_STATUS_INTERVAL = float(os.getenv("HULSE_HOST_STATUS_INTERVAL", 10))
+
+# hosts reconnect to the producer stream with a jittered exponential backoff,
+# resuming from the id of the last received event, -1 reconnects forever. The
+# stream is considered dead after HOST_STREAM_TIMEOUT seconds without data and
+# the ids of the last HOST_SEEN_QUERIES queries are kept to drop replayed ones
+HOST_RECONNECT_BACKOFF = float(os.getenv("HULSE_HOST_RECONNECT_BACKOFF", 1))
+HOST_RECONNECT_MAX_BACKOFF = float(os.getenv("HULSE_HOST_RECONNECT_MAX_BACKOFF", 60))
+HOST_MAX_RECONNECTS = int(os.getenv("HULSE_HOST_MAX_RECONNECTS", -1))
+HOST_STREAM_TIMEOUT = float(os.getenv("HULSE_HOST_STREAM_TIMEOUT", 120))
+HOST_SEEN_QUERIES = int(os.getenv("HULSE_HOST_SEEN_QUERIES", 10000))
+
+# host bounds on the cost of a query, whatever its pipeline arguments: tokens
+# generated (also the default of generation tasks), generated sequences, beams
+# and characters of each input text, 0 for no bound
+HOST_MAX_NEW_TOKENS = int(os.getenv("HULSE_HOST_MAX_NEW_TOKENS", 256))
+HOST_MAX_RETURN_SEQUENCES = int(os.getenv("HULSE_HOST_MAX_RETURN_SEQUENCES", 4))
+HOST_MAX_BEAMS = int(os.getenv("HULSE_HOST_MAX_BEAMS", 4))
+HOST_MAX_INPUT_LENGTH = int(os.getenv("HULSE_HOST_MAX_INPUT_LENGTH", 100000))
+
+# optional local endpoint exporting the metrics of the host in the Prometheus
+# text format on http://HOST_METRICS_ADDRESS:HOST_METRICS_PORT/metrics, 0 disables it
+HOST_METRICS_PORT = int(os.getenv("HULSE_HOST_METRICS_PORT", 0))
+HOST_METRICS_ADDRESS = os.getenv("HULSE_HOST_METRICS_ADDRESS", "127.0.0.1")
+
+# sampling profiler of the host, see hulse.profiling: interval between samples
+# and duration of the profiled window in seconds, 0 to profile until the host
+# stops, after which folded stacks and a report of the time spent in each stage
+# are written to HOST_PROFILE_OUTPUT.folded and HOST_PROFILE_OUTPUT.txt
+HOST_PROFILE_INTERVAL = float(os.getenv("HULSE_HOST_PROFILE_INTERVAL", 0.005))
+HOST_PROFILE_DURATION = float(os.getenv("HULSE_HOST_PROFILE_DURATION", 60))
+HOST_PROFILE_OUTPUT = os.getenv("HULSE_HOST_PROFILE_OUTPUT", "hulse-profile")
+
+# inference backend of host pipelines: the default fp32 PyTorch model, dynamic
+# int8 quantization of its linear layers, torch.compile or ONNX Runtime through
+# optimum (`pip install hulse[onnx]`). The backend of each model can be set in
+# the "backends" map of the host config file, keyed by task:model or task specs,
+# pipelines failing to load with their backend fall back to the default one
+HOST_BACKENDS = ["default", "quantized", "compiled", "onnx"]
+HOST_BACKEND = os.getenv("HULSE_HOST_BACKEND", "default")
+
+# pipelines loaded, warmed up and pinned in memory before the host connects to
+# the producer channel, as comma separated task:model specs, in addition to the
+# "preload" list of the host config file
+HOST_PRELOAD = [spec for spec in os.getenv("HULSE_HOST_PRELOAD", "").split(",") if spec]
+HOST_CONFIG_PATH = CONFIG_PATH / "host.json"
+
+# sample input of each task, run once through preloaded pipelines to warm them
+# up, dict inputs are passed as keyword arguments
+WARMUP_INPUTS = {
+    "summarization": "Hulse runs inference queries on the computers of a cluster.",
+    "translation": "Hello world.",
+    "text-generation": "Hello world.",
+    "text-classification": "Hello world.",
+    "sentiment-analysis": "Hello world.",
+    "question-answering": {
+        "question": "What does Hulse run?",
+        "context": "Hulse runs inference queries.",
+    },
+    "text2text-generation": "Hello world.",
+    "zero-shot-classification": {
+        "sequences": "Hello world.",
+        "candidate_labels": ["greeting", "question"],
+    },
+}
+
 
 def get_auth_headers(api_key: str) -> dict:
     """Generate HTTP headers for authentication with bearer token.
@@ -62,6 +268,22 @@ def load_config():
             CONFIG.update(json.load(f))
 
 
+def load_host_config(path: Path = HOST_CONFIG_PATH) -> dict:
+    """Load the host config file.
+
+    :param path: Path of the JSON host config file, defaults to HOST_CONFIG_PATH
+    :type path: Path, optional
+    :return: Host config, empty if the file does not exist.
+    :rtype: dict
+    """
+    path = Path(path)
+    if not path.is_file():
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+
 def set_config(config: dict) -> bool:
     """Store config to CONFIG user file and set it in module.
 
@@ -91,10 +313,12 @@ def validate_config(config: dict) -> bool:
     :return: Config validity result.
     :rtype: bool
     """
+    from hulse.sessions import default_sessions
+
     if "api_key" not in config or "email" not in config:
         return False
 
-    r = requests.get(
+    r = default_sessions.get(HULSE_API_URL).get(
         HULSE_API_URL + "ping/", headers=get_auth_headers(config["api_key"])
     )
     return r.status_code == 200
@@ -0,0 +1,171 @@
+import codecs
+import json
+import json.scanner
+from typing import Any, Iterable, Iterator, NamedTuple
+
+
+class Event(NamedTuple):
+    """Server-sent event dispatched by :class:`SSEParser`."""
+
+    data: str
+    event: str = "message"
+    id: str = None
+    retry: int = None
+
+    def json(self) -> Any:
+        """Decode the JSON data of the event.
+
+        :return: Decoded data, None if the data is not valid JSON.
+        :rtype: Any
+        """
+        data = self.data
+        try:
+            value, end = _scan_json(data, 0)
+        except (StopIteration, ValueError):
+            end = -1
+        if end == len(data):
+            return value
+        # surrounding whitespace and errors are handled by the full decoder
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+
+# scanner of the default JSON decoder, which json.loads only calls after
+# skipping whitespace in Python, half of the time of decoding small events
+_scan_json = json.scanner.make_scanner(json.JSONDecoder())
+
+
+class SSEParser:
+    """Incremental parser of a server-sent events stream, as specified by WHATWG.
+
+    Chunks of the raw byte stream are fed to the parser as they arrive, and
+    complete events are returned once their terminating blank line is read.
+    Multi-line data, event types, ids, retry intervals and comments are handled.
+
+    Each chunk is decoded and split into lines once. Lines spanning several
+    chunks, such as the data of large events, are only joined once complete,
+    so that they are parsed in linear time.
+    """
+
+    def __init__(self):
+        """Create a new parser."""
+        self.last_event_id = None
+        self.retry = None
+        # bytes of a character cut at the end of the last chunk
+        self._tail = b""
+        # chunks of the line being received, only joined once it is complete
+        self._line = []
+        # data lines and type of the event being received
+        self._data = []
+        self._event_type = "message"
+        self._after_cr = False
+        self._started = False
+
+    def feed(self, chunk: bytes) -> list:
+        """Parse a chunk of the stream.
+
+        :param chunk: Raw bytes, possibly cut in the middle of a line or event.
+        :type chunk: bytes
+        :return: Events completed by the chunk.
+        :rtype: list
+        """
+        if self._tail:
+            chunk = self._tail + chunk
+        text, consumed = codecs.utf_8_decode(chunk, "replace", False)
+        self._tail = chunk[consumed:]
+        if not self._started and text:
+            self._started = True
+            if text[0] == "\ufeff":
+                text = text[1:]
+        if self._after_cr and text:
+            # the line ended with the CR of a CRLF split across chunks
+            self._after_cr = False
+            if text[0] == "\n":
+                text = text[1:]
+        if "\r" in text:
+            self._after_cr = text[-1] == "\r"
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+
+        if "\n" not in text:
+            if text:
+                self._line.append(text)
+            return []
+        if self._line:
+            self._line.append(text)
+            text = "".join(self._line)
+        lines = text.split("\n")
+        rest = lines.pop()
+        self._line = [rest] if rest else []
+
+        events = []
+        data = self._data
+        for line in lines:
+            if not line:
+                # events end with a blank line
+                if data:
+                    events.append(
+                        Event(
+                            "\n".join(data),
+                            self._event_type,
+                            self.last_event_id,
+                            self.retry,
+                        )
+                    )
+                    data = self._data = []
+                self._event_type = "message"
+            elif line[:6] == "data: ":
+                data.append(line[6:])
+            elif line[:4] == "id: " and "\0" not in line:
+                self.last_event_id = line[4:]
+            else:
+                self._parse_field(line)
+        return events
+
+    def _parse_field(self, line: str):
+        name, colon, value = line.partition(":")
+        if colon and value[:1] == " ":
+            value = value[1:]
+        # lines without a name are comments
+        if name == "data":
+            self._data.append(value)
+        elif name == "event":
+            self._event_type = value
+        elif name == "id":
+            if "\0" not in value:
+                self.last_event_id = value
+        elif name == "retry":
+            if value.isdigit():
+                self.retry = int(value)
+
+
+def iter_events(chunks: Iterable) -> Iterator:
+    """Parse the events of a server-sent events stream.
+
+    :param chunks: Raw byte chunks of the stream, such as :func:`iter_chunks`.
+    :type chunks: Iterable
+    :return: Iterator over the dispatched events.
+    :rtype: Iterator
+    """
+    parser = SSEParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+
+
+def iter_chunks(response, chunk_size: int = 512) -> Iterator:
+    """Read the body of a streamed requests response as it arrives.
+
+    Chunked responses are read one transfer chunk at a time, so that events are
+    parsed as soon as they are received. Other responses are read by blocks of
+    `chunk_size` bytes, since reading them whole would wait for the stream to end.
+
+    :param response: Streamed response of the stream server.
+    :type response: requests.Response
+    :param chunk_size: Size of the reads of unchunked responses, defaults to 512
+    :type chunk_size: int, optional
+    :return: Iterator over the raw byte chunks of the body.
+    :rtype: Iterator
+    """
+    chunked = getattr(response.raw, "chunked", False)
+    return response.iter_content(chunk_size=None if chunked else chunk_size)
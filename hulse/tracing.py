@@ -0,0 +1,242 @@
+"""Tracing of queries across their consumer, the stream server and their host.
+
+Every query carries a trace id, and its answer the spans recorded by the
+server and the host, which the consumer merges with its own spans:
+
+- ``client.query``: the whole query, as seen by the consumer
+- ``client.cache``: answer of the query from the result cache of the client
+- ``client.send``: connection to the server and sending of the query
+- ``server.queue``: wait of the query on the server until sent to a host
+- ``host.queue``: wait of the query on the host until a worker runs it
+- ``host.wait``: wait for an identical query already running on the host
+- ``result.cache``: answer of the query from the result cache of the host
+- ``pipeline.acquire``: lookup of the pipeline, loading it on a cache miss
+- ``inference``: pipeline call, shared by the queries of a batch
+- ``result.post``: post of the result, from the host to the server
+- ``client.wait``: wait for the answer, once the query is sent
+- ``client.receive``: decoding of the answer
+
+Spans are dicts with a name and wall clock start and end timestamps in
+seconds, so that spans recorded on other machines are subject to their clock
+offset. Traces are exported to OpenTelemetry when settings.TRACE_EXPORTER is
+"otel", or with :func:`set_exporter`.
+"""
+
+import json
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from hulse import settings
+
+logger = logging.getLogger(__name__)
+
+_exporter = None
+
+
+def new_trace_id() -> str:
+    """Generate the id of a new trace.
+
+    :return: 32 hexadecimal characters, the size of OpenTelemetry trace ids.
+    :rtype: str
+    """
+    return uuid.uuid4().hex
+
+
+def make_span(name: str, start: float, end: float = None) -> dict:
+    """Make a span, as sent with answers.
+
+    :param name: Name of the stage of the query.
+    :type name: str
+    :param start: Start of the stage, as a timestamp in seconds.
+    :type start: float
+    :param end: End of the stage, defaults to None for a stage still running,
+        such as the post of a result, ended by the receiving end.
+    :type end: float, optional
+    :return: Span of the stage.
+    :rtype: dict
+    """
+    return {"name": name, "start": start, "end": end}
+
+
+class Trace:
+    """Spans of the stages of a query, recorded by its consumer."""
+
+    def __init__(self, trace_id: str = None):
+        """Create a new trace.
+
+        :param trace_id: Id of the trace, defaults to None for a new id.
+        :type trace_id: str, optional
+        """
+        self.trace_id = trace_id or new_trace_id()
+        self.spans = []
+        self.start = time.time()
+
+    def add(self, name: str, start: float, end: float = None) -> dict:
+        """Record a span.
+
+        :param name: Name of the stage of the query.
+        :type name: str
+        :param start: Start of the stage, as a timestamp in seconds.
+        :type start: float
+        :param end: End of the stage, defaults to None for now.
+        :type end: float, optional
+        :return: The recorded span.
+        :rtype: dict
+        """
+        span = make_span(name, start, time.time() if end is None else end)
+        self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name: str) -> Iterator:
+        """Record a span around a block of code.
+
+        :param name: Name of the stage of the query.
+        :type name: str
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, start)
+
+    def finish(self, answer: dict) -> dict:
+        """Merge the spans sent with an answer into the trace, and attach it to the answer.
+
+        Spans still running when the answer was sent end when it was received.
+        The trace is then exported, if an exporter is set.
+
+        :param answer: Final answer of the query.
+        :type answer: dict
+        :return: The answer, with the trace id and the spans of the query as trace.
+        :rtype: dict
+        """
+        received = time.time()
+        remote = answer.get("trace")
+        if isinstance(remote, str):
+            try:
+                remote = json.loads(remote)
+            except ValueError:
+                remote = None
+        if isinstance(remote, dict) and remote.get("trace_id") == self.trace_id:
+            for span in remote.get("spans") or []:
+                self.spans.append(dict(span, end=span.get("end") or received))
+        self.add("client.receive", received)
+        self.add("client.query", self.start)
+        self.spans.sort(key=lambda span: span["start"])
+        answer["trace"] = self.to_dict()
+        export(self)
+        return answer
+
+    def to_dict(self) -> dict:
+        """Get the trace as sent with answers.
+
+        :return: Trace id and spans.
+        :rtype: dict
+        """
+        return {"trace_id": self.trace_id, "spans": list(self.spans)}
+
+
+def breakdown(trace: dict) -> dict:
+    """Sum the durations of the spans of a trace by stage.
+
+    :param trace: Trace attached to an answer, see :meth:`Trace.finish`.
+    :type trace: dict
+    :return: Total duration of each stage in seconds, from the longest.
+    :rtype: dict
+    """
+    durations = {}
+    for span in trace.get("spans") or []:
+        if span.get("end") is not None:
+            duration = span["end"] - span["start"]
+            durations[span["name"]] = durations.get(span["name"], 0.0) + duration
+    return dict(sorted(durations.items(), key=lambda item: item[1], reverse=True))
+
+
+class OpenTelemetryExporter:
+    """Export traces as OpenTelemetry spans.
+
+    Spans are sent through the tracer provider configured by the application,
+    as children of a ``hulse.query`` span holding the Hulse trace id as
+    attribute. Requires opentelemetry-api, installed with `pip install hulse[otel]`.
+    """
+
+    def __init__(self, tracer: Any = None):
+        """Create a new exporter.
+
+        :param tracer: OpenTelemetry tracer, defaults to None for the tracer of
+            the global tracer provider.
+        :type tracer: opentelemetry.trace.Tracer, optional
+        :raises ImportError: If opentelemetry-api is not installed.
+        """
+        try:
+            from opentelemetry import trace
+        except ImportError as e:
+            raise ImportError(
+                "The otel trace exporter requires opentelemetry-api, install it with `pip install hulse[otel]`."
+            ) from e
+        self._set_span_in_context = trace.set_span_in_context
+        self.tracer = tracer or trace.get_tracer("hulse")
+
+    def export(self, trace: Trace):
+        """Export the spans of a trace.
+
+        :param trace: Finished trace of a query.
+        :type trace: Trace
+        """
+        if not trace.spans:
+            return
+        to_ns = lambda timestamp: int(timestamp * 1e9)
+        root = self.tracer.start_span(
+            "hulse.query",
+            start_time=to_ns(min(span["start"] for span in trace.spans)),
+            attributes={"hulse.trace_id": trace.trace_id},
+        )
+        context = self._set_span_in_context(root)
+        for span in trace.spans:
+            child = self.tracer.start_span(
+                span["name"], context=context, start_time=to_ns(span["start"])
+            )
+            child.end(end_time=to_ns(span["end"]))
+        root.end(end_time=to_ns(max(span["end"] for span in trace.spans)))
+
+
+def set_exporter(exporter: Any):
+    """Set the exporter of the traces of queries.
+
+    :param exporter: Object with an `export(trace)` method, such as
+        :class:`OpenTelemetryExporter`, None to disable exports.
+    :type exporter: Any
+    """
+    global _exporter
+    _exporter = exporter
+
+
+def get_exporter() -> Any:
+    """Get the exporter of the traces of queries, created from settings.TRACE_EXPORTER on first use.
+
+    :return: The exporter, None if traces are not exported.
+    :rtype: Any
+    """
+    global _exporter
+    if _exporter is None and settings.TRACE_EXPORTER == "otel":
+        _exporter = OpenTelemetryExporter()
+    return _exporter
+
+
+def export(trace: Trace):
+    """Export a trace, if an exporter is set.
+
+    :param trace: Finished trace of a query.
+    :type trace: Trace
+    """
+    exporter = get_exporter()
+    if exporter is None:
+        return
+    try:
+        exporter.export(trace)
+    except Exception as e:
+        logger.warning("Failed to export trace %s: %s", trace.trace_id, repr(e))
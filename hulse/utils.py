@@ -1,24 +1,28 @@
+import copy
+import gc
 import json
 import inspect
 import os
 import logging
 import ctypes
 import threading
+import time
+import uuid
+from typing import Any, Iterator
 
 import requests
-from transformers import pipeline
-from flask import Flask, redirect, request, cli
+from urllib3.exceptions import ReadTimeoutError
 
-# disable flask logs to CLI, avoid spamming user
-cli.show_server_banner = lambda *args: None
-
-
-from hulse import settings, errors
+from hulse import settings, errors, sse, tracing
+from hulse.encoding import WireFormat
+from hulse.sessions import SessionPool, default_sessions
 
 
 def process_stream_data(raw_data: str) -> dict:
     """Process a block of stream data from the Hulse server.
 
+    Kept for backward compatibility, streams are parsed with :class:`hulse.sse.SSEParser`.
+
     :param raw_data: Raw stream data block.
     :type raw_data: str
     :return: Processed stream data block (if any).
@@ -34,50 +38,272 @@ def process_stream_data(raw_data: str) -> dict:
             pass
 
 
-def handle_consumer_stream(response: requests.Response, timeout: int = 10) -> dict:
-    """Handle the response stream from the Hulse server when making a query.
+def decode_event(event: sse.Event) -> dict:
+    """Decode a result event of the legacy format, whose result is a JSON string.
 
-    :param response: Stream request response to be handled.
-    :type response: requests.Response
-    :param timeout: Timeout after which should raise an error if no results received, defaults to 10
-    :type timeout: int, optional
-    :return: Result returned from the Hulse server.
+    :param event: Event received on the consumer stream.
+    :type event: sse.Event
+    :return: Data of the event with its result decoded, None if it is not valid JSON.
     :rtype: dict
     """
-    # TODO: implement timeout logic
-    for line in response.iter_lines():
-        data = process_stream_data(line)
-        if data:
-            return data
+    data = event.json()
+    if isinstance(data, dict) and isinstance(data.get("result"), str):
+        try:
+            data["result"] = json.loads(data["result"])
+        except ValueError:
+            pass
+    return data
+
+
+def validate_kwargs(task: str, kwargs: dict):
+    """Check that the pipeline arguments of a query are supported by its task.
+
+    :param task: Transformer task of the query.
+    :type task: str
+    :param kwargs: Keyword arguments of the pipeline call.
+    :type kwargs: dict
+    :raises errors.UnsupportedArgumentError: If an argument is not supported by
+        the task, see settings.TASK_KWARGS, or is not JSON serializable.
+    """
+    supported = settings.TASK_KWARGS.get(task, [])
+    for name, value in kwargs.items():
+        if name not in supported:
+            raise errors.UnsupportedArgumentError(task, name)
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError) as e:
+            raise errors.UnsupportedArgumentError(task, name, e)
+
+
+def localize_deadline(query: dict) -> dict:
+    """Turn the time left to answer a received query into a deadline of the local clock.
+
+    Queries carry a time budget in seconds rather than a point in time, so that
+    the clock skew between consumers, servers and hosts does not matter.
+
+    :param query: Query received on the producer stream.
+    :type query: dict
+    :return: Copy of the query whose deadline is a :func:`time.monotonic` time,
+        None if it has no timeout.
+    :rtype: dict
+    """
+    query = dict(query)
+    timeout = query.pop("timeout", None)
+    query["deadline"] = (
+        time.monotonic() + float(timeout) if timeout is not None else None
+    )
+    return query
+
 
+def is_expired(query: dict) -> bool:
+    """Whether the deadline of a query has passed, so its consumer gave up on it.
 
-def handle_producer_stream(response: requests.Response, api_key: str):
-    """Produce a stream to be sent to the Hulse server.
+    :param query: Query with a local deadline, see :func:`localize_deadline`.
+    :type query: dict
+    :return: True if the query has an expired deadline.
+    :rtype: bool
+    """
+    deadline = query.get("deadline")
+    # the monotonic clock is shared by the worker processes of the host
+    return deadline is not None and deadline < time.monotonic()
+
+
+def _set_read_timeout(response: requests.Response, timeout: float):
+    # requests applies the same read timeout to the first byte and to every
+    # following read, extend it on the open socket once the response started
+    try:
+        response.raw.connection.sock.settimeout(timeout)
+    except AttributeError:
+        pass
+
+
+def cached_answer(result: Any, trace: tracing.Trace) -> dict:
+    """Build the answer of a query from a result of the client cache.
+
+    The answer gets a new qid and a trace of the cache lookup, rather than the
+    id and the stages of the query which computed the result.
+
+    :param result: Cached result of the query.
+    :type result: Any
+    :param trace: Trace of the query, started before the cache lookup.
+    :type trace: tracing.Trace
+    :return: Answer of the query.
+    :rtype: dict
+    """
+    trace.add("client.cache", trace.start)
+    trace.add("client.query", trace.start)
+    tracing.export(trace)
+    return {
+        "qid": uuid.uuid4().hex,
+        "result": copy.deepcopy(result),
+        "trace": trace.to_dict(),
+    }
+
+
+def answer_error(answer: dict) -> Exception:
+    """Get the error of an answer rejecting or failing its query.
+
+    :param answer: Answer received on the response stream of a query.
+    :type answer: dict
+    :return: HostBusyError for queries rejected by all hosts, InferenceError
+        for queries whose inference failed.
+    :rtype: Exception
+    """
+    if answer.get("error") == "busy":
+        return errors.HostBusyError()
+    return errors.InferenceError(answer.get("reason"))
+
+
+def iter_consumer_stream(
+    response: requests.Response, timeout: float = None
+) -> Iterator:
+    """Iterate over the answers of the response stream of a query.
+
+    Streaming queries get partial answers, with the text generated since the
+    previous one as token, before their final answer.
 
     :param response: Stream request response to be handled.
     :type response: requests.Response
-    :param api_key: Hulse API key.
-    :type api_key: str
+    :param timeout: Timeout after which should raise an error if the final answer was not received, defaults to None
+    :type timeout: float, optional
+    :raises errors.QueryTimeoutError: If the final answer was not received before the timeout.
+    :raises errors.HostBusyError: If all hosts rejected the query as busy.
+    :raises errors.InferenceError: If the inference of the query failed on its host.
+    :return: Iterator over the answers, up to the final answer, with their result decoded.
+    :rtype: Iterator
     """
-    for line in response.iter_lines():
-        data = process_stream_data(line)
-        if data:
-            # analyse data using hugging face model
-            classifier = pipeline(task=data.get("task"), model=data.get("model"))
-            result = classifier(data.get("data"))
-
-            # post data back to the server
-            resp = requests.post(
-                settings.HULSE_STREAM_URL + "result/",
-                data={
-                    "result": json.dumps(result[0]),
-                    "qid": data.get("qid"),
-                },
+    deadline = time.monotonic() + timeout if timeout else None
+    _set_read_timeout(response, timeout)
+    # the server answers in the compact wire format when it was negotiated
+    wire_format = WireFormat.from_headers(response.headers)
+    if wire_format is not None:
+        parser, decode = wire_format.parser(), lambda message: message.data
+    else:
+        parser, decode = sse.SSEParser(), decode_event
+    try:
+        for chunk in sse.iter_chunks(response):
+            for message in parser.feed(chunk):
+                data = decode(message)
+                if isinstance(data, dict) and data.get("error"):
+                    response.close()
+                    raise answer_error(data)
+                if data:
+                    yield data
+                    if "token" not in data:
+                        return
+            if deadline and time.monotonic() > deadline:
+                raise errors.QueryTimeoutError("result", timeout)
+    except requests.exceptions.ConnectionError as e:
+        response.close()
+        if e.args and isinstance(e.args[0], ReadTimeoutError):
+            raise errors.QueryTimeoutError("result", timeout, e)
+        raise
+    except errors.QueryTimeoutError:
+        response.close()
+        raise
+
+
+def handle_consumer_stream(response: requests.Response, timeout: float = None) -> dict:
+    """Handle the response stream from the Hulse server when making a query.
+
+    :param response: Stream request response to be handled.
+    :type response: requests.Response
+    :param timeout: Timeout after which should raise an error if no results received, defaults to None
+    :type timeout: float, optional
+    :raises errors.QueryTimeoutError: If no result was received before the timeout.
+    :raises errors.HostBusyError: If all hosts rejected the query as busy.
+    :raises errors.InferenceError: If the inference of the query failed on its host.
+    :return: Result returned from the Hulse server, with its result decoded.
+    :rtype: dict
+    """
+    for answer in iter_consumer_stream(response, timeout):
+        if "token" not in answer:
+            return answer
+
+
+def _open_query(
+    task: str,
+    data: str,
+    model: str,
+    api_key: str,
+    sessions: SessionPool,
+    timeout: float,
+    connect_timeout: float,
+    first_byte_timeout: float,
+    wire_format: WireFormat,
+    kwargs: dict,
+    stream: bool,
+    trace_id: str = None,
+) -> tuple:
+    # send the query and return its response stream and the time left for its result
+    start = time.monotonic()
+    params = {"task": task, "data": data, "model": model, "trace_id": trace_id}
+    if timeout:
+        params["timeout"] = timeout
+        first_byte_timeout = min(first_byte_timeout or timeout, timeout)
+    fields = {key: value for key, value in params.items() if value is not None}
+    if kwargs:
+        fields["kwargs"] = kwargs
+        params["kwargs"] = json.dumps(kwargs)
+    if stream:
+        fields["stream"] = True
+        params["stream"] = 1
+    if isinstance(data, list):
+        # URL parameters cannot tell a list of one item from the item itself
+        params["list"] = 1
+
+    url = settings.HULSE_STREAM_URL + f"consumer/{api_key}/"
+    session = (sessions or default_sessions).get(settings.HULSE_STREAM_URL)
+    try:
+        query_resp = None
+        if wire_format is not None:
+            query_resp = session.post(
+                url,
+                data=wire_format.encode(fields),
+                stream=True,
+                headers={**settings.get_auth_headers(api_key), **wire_format.headers()},
+                timeout=(connect_timeout, first_byte_timeout),
+            )
+            if query_resp.status_code in (405, 415):
+                # the server only speaks the legacy format
+                query_resp.close()
+                query_resp = None
+        if query_resp is None:
+            query_resp = session.get(
+                url,
+                params,
+                stream=True,
                 headers=settings.get_auth_headers(api_key),
+                timeout=(connect_timeout, first_byte_timeout),
             )
+    except requests.exceptions.ConnectTimeout as e:
+        raise errors.QueryTimeoutError("connection", connect_timeout, e)
+    except requests.exceptions.ReadTimeout as e:
+        raise errors.QueryTimeoutError("first byte", first_byte_timeout, e)
 
-
-def post_query(task: str, data: str, model: str, api_key: str) -> dict:
+    if query_resp.status_code == 418:
+        raise errors.UnsufficientResources()
+    elif query_resp.status_code != 200:
+        raise errors.HulseError(query_resp.status_code)
+    remaining = timeout - (time.monotonic() - start) if timeout else None
+    if remaining is not None and remaining <= 0:
+        query_resp.close()
+        raise errors.QueryTimeoutError("result", timeout)
+    return query_resp, remaining
+
+
+def post_query(
+    task: str,
+    data: str,
+    model: str,
+    api_key: str,
+    sessions: SessionPool = None,
+    timeout: float = None,
+    connect_timeout: float = None,
+    first_byte_timeout: float = None,
+    wire_format: WireFormat = None,
+    kwargs: dict = None,
+) -> dict:
     """Send query to server to be processed by online producers.
 
     :param task: Transformer task to be performed.
@@ -86,36 +312,137 @@ def post_query(task: str, data: str, model: str, api_key: str) -> dict:
     :type data: str
     :param api_key: Api key for Hulse.
     :type api_key: str
+    :param sessions: Pooled HTTP sessions, defaults to the process-wide sessions.
+    :type sessions: SessionPool, optional
+    :param timeout: Total timeout of the query in seconds, forwarded to hosts as a time budget, defaults to None
+    :type timeout: float, optional
+    :param connect_timeout: Timeout of the connection to the stream server, defaults to None
+    :type connect_timeout: float, optional
+    :param first_byte_timeout: Timeout for the stream server to start responding, defaults to None
+    :type first_byte_timeout: float, optional
+    :param wire_format: Compact wire format of the query and its result, defaults
+        to None for URL parameters and server-sent events. Servers which do not
+        support it are queried in the legacy format.
+    :type wire_format: WireFormat, optional
+    :param kwargs: Keyword arguments of the pipeline call, see :func:`validate_kwargs`, defaults to None
+    :type kwargs: dict, optional
     :raises errors.UnsufficientResources: If there are no online producers.
+    :raises errors.HostBusyError: If all online producers are busy.
+    :raises errors.InferenceError: If the inference of the query failed on its host.
+    :raises errors.QueryTimeoutError: If the query timed out.
     :raises errors.HulseError: An error occurred while communicating with the Hulse server.
-    :return: The result of the query.
+    :return: The answer of the query, whose result is the complete pipeline
+        output, a list of the result of each item for list data, and whose
+        trace holds the spans of its stages, see :mod:`hulse.tracing`.
     :rtype: dict
     """
-    channel_path = f"consumer/{api_key}/"
-    query_resp = requests.get(
-        settings.HULSE_STREAM_URL + channel_path,
-        {"task": task, "data": data, "model": model},
-        stream=True,
-        headers=settings.get_auth_headers(api_key),
-    )
-    if query_resp.status_code == 418:
-        raise errors.UnsufficientResources()
-    elif query_resp.status_code != 200:
-        raise errors.HulseError(query_resp.status_code)
-    else:
-        return handle_consumer_stream(query_resp)
+    trace = tracing.Trace()
+    with trace.span("client.send"):
+        query_resp, remaining = _open_query(
+            task,
+            data,
+            model,
+            api_key,
+            sessions,
+            timeout,
+            connect_timeout,
+            first_byte_timeout,
+            wire_format,
+            kwargs,
+            stream=False,
+            trace_id=trace.trace_id,
+        )
+    try:
+        with trace.span("client.wait"):
+            answer = handle_consumer_stream(query_resp, timeout=remaining)
+    except errors.QueryTimeoutError as e:
+        raise errors.QueryTimeoutError("result", timeout, e.expression)
+    return trace.finish(answer)
+
+
+def stream_query(
+    task: str,
+    data: str,
+    model: str,
+    api_key: str,
+    sessions: SessionPool = None,
+    timeout: float = None,
+    connect_timeout: float = None,
+    first_byte_timeout: float = None,
+    wire_format: WireFormat = None,
+    kwargs: dict = None,
+) -> Iterator:
+    """Send a streaming query, answered with the tokens generated as they come.
+
+    Takes the same parameters as :func:`post_query`.
+
+    :raises errors.UnsufficientResources: If there are no online producers.
+    :raises errors.HostBusyError: If all online producers are busy.
+    :raises errors.InferenceError: If the inference of the query failed on its host.
+    :raises errors.QueryTimeoutError: If the query timed out.
+    :raises errors.HulseError: An error occurred while communicating with the Hulse server.
+    :return: Iterator over the partial answers of the query, with the text
+        generated since the previous one as token, then its final answer with
+        its trace.
+    :rtype: Iterator
+    """
+    trace = tracing.Trace()
+    with trace.span("client.send"):
+        query_resp, remaining = _open_query(
+            task,
+            data,
+            model,
+            api_key,
+            sessions,
+            timeout,
+            connect_timeout,
+            first_byte_timeout,
+            wire_format,
+            kwargs,
+            stream=True,
+            trace_id=trace.trace_id,
+        )
+    waiting = time.time()
+    try:
+        for answer in iter_consumer_stream(query_resp, timeout=remaining):
+            if "token" not in answer:
+                trace.add("client.wait", waiting)
+                answer = trace.finish(answer)
+            yield answer
+    except errors.QueryTimeoutError as e:
+        raise errors.QueryTimeoutError("result", timeout, e.expression)
+    finally:
+        query_resp.close()
+
+
+def generated_text(result: Any) -> str:
+    """Get the text generated by a text generation pipeline.
+
+    :param result: Result of a text-generation or text2text-generation query.
+    :type result: Any
+    :return: Generated text of the first sequence, empty if there is none.
+    :rtype: str
+    """
+    if isinstance(result, list):
+        result = result[0] if result else None
+    if isinstance(result, dict):
+        return result.get("generated_text", "")
+    return result if isinstance(result, str) else ""
 
 
-def get_clusters(api_key: str) -> list:
+def get_clusters(api_key: str, sessions: SessionPool = None) -> list:
     """Get all available clusters for the given account.
 
     :param api_key: Hulse API key.
     :type api_key: str
+    :param sessions: Pooled HTTP sessions, defaults to the process-wide sessions.
+    :type sessions: SessionPool, optional
     :raises Exception: Unknown error occured while sending request to Hulse server.
     :return: List of clusters for the given account.
     :rtype: list
     """
-    r = requests.get(
+    session = (sessions or default_sessions).get(settings.HULSE_API_URL)
+    r = session.get(
         settings.HULSE_API_URL + "clusters/",
         headers=settings.get_auth_headers(api_key),
     )
@@ -126,18 +453,21 @@ def get_clusters(api_key: str) -> list:
     return clusters
 
 
-def join_cluster(cluster_id: str, api_key: str) -> bool:
+def join_cluster(cluster_id: str, api_key: str, sessions: SessionPool = None) -> bool:
     """Join a Hulse cluster
 
     :param cluster_id: Cluster ID to join.
     :type cluster_id: str
     :param api_key: Hulse API key
     :type api_key: str
+    :param sessions: Pooled HTTP sessions, defaults to the process-wide sessions.
+    :type sessions: SessionPool, optional
     :raises errors.HulseError: Error raised if the cluster could not be joined.
     :return: Whether the cluster was joined or not.
     :rtype: bool
     """
-    r = requests.post(
+    session = (sessions or default_sessions).get(settings.HULSE_API_URL)
+    r = session.post(
         settings.HULSE_API_URL + "cluster/join/",
         headers=settings.get_auth_headers(api_key),
         data={"cluster_id": cluster_id},
@@ -148,18 +478,21 @@ def join_cluster(cluster_id: str, api_key: str) -> bool:
     return True
 
 
-def delete_cluster(cluster_id: str, api_key: str) -> bool:
+def delete_cluster(cluster_id: str, api_key: str, sessions: SessionPool = None) -> bool:
     """Delete a Hulse cluster
 
     :param cluster_id: Cluster ID to delete.
     :type cluster_id: str
     :param api_key: Hulse API key
     :type api_key: str
+    :param sessions: Pooled HTTP sessions, defaults to the process-wide sessions.
+    :type sessions: SessionPool, optional
     :raises errors.HulseError: Error raised if the cluster could not be deleted.
     :return: Whether the cluster was deleted or not.
     :rtype: bool
     """
-    r = requests.post(
+    session = (sessions or default_sessions).get(settings.HULSE_API_URL)
+    r = session.post(
         settings.HULSE_API_URL + "cluster/delete/",
         headers=settings.get_auth_headers(api_key),
         data={"cluster_id": cluster_id},
@@ -170,7 +503,13 @@ def delete_cluster(cluster_id: str, api_key: str) -> bool:
     return True
 
 
-def edit_cluster(cluster_id: str, name: str, description: str, api_key: str) -> bool:
+def edit_cluster(
+    cluster_id: str,
+    name: str,
+    description: str,
+    api_key: str,
+    sessions: SessionPool = None,
+) -> bool:
     """Edit a Hulse cluster
 
     :param cluster_id: Cluster ID to edit.
@@ -181,11 +520,14 @@ def edit_cluster(cluster_id: str, name: str, description: str, api_key: str) ->
     :type description: str
     :param api_key: Hulse API key
     :type api_key: str
+    :param sessions: Pooled HTTP sessions, defaults to the process-wide sessions.
+    :type sessions: SessionPool, optional
     :raises errors.HulseError: Error raised if the cluster could not be edited.
     :return: Whether the cluster was edited or not.
     :rtype: bool
     """
-    r = requests.post(
+    session = (sessions or default_sessions).get(settings.HULSE_API_URL)
+    r = session.post(
         settings.HULSE_API_URL + "cluster/edit/",
         headers=settings.get_auth_headers(api_key),
         data={"cluster_id": cluster_id, "name": name, "description": description},
@@ -196,18 +538,21 @@ def edit_cluster(cluster_id: str, name: str, description: str, api_key: str) ->
     return True
 
 
-def leave_cluster(cluster_id: str, api_key: str) -> bool:
+def leave_cluster(cluster_id: str, api_key: str, sessions: SessionPool = None) -> bool:
     """Leave a Hulse cluster
 
     :param cluster_id: Cluster ID to leave.
     :type cluster_id: str
     :param api_key: Hulse API key
     :type api_key: str
+    :param sessions: Pooled HTTP sessions, defaults to the process-wide sessions.
+    :type sessions: SessionPool, optional
     :raises errors.HulseError: Error raised if the cluster could not be left.
     :return: Whether the cluster was left or not.
     :rtype: bool
     """
-    r = requests.post(
+    session = (sessions or default_sessions).get(settings.HULSE_API_URL)
+    r = session.post(
         settings.HULSE_API_URL + "cluster/leave/",
         headers=settings.get_auth_headers(api_key),
         data={"cluster_id": cluster_id},
@@ -218,28 +563,37 @@ def leave_cluster(cluster_id: str, api_key: str) -> bool:
     return True
 
 
-def run_host(api_key: str):
+def handle_producer_stream(response: requests.Response, api_key: str, **kwargs):
+    """Serially answer the queries received on the producer stream.
+
+    Kept for backward compatibility, see :func:`hulse.producer.handle_producer_stream`.
+
+    :param response: Stream request response to be handled.
+    :type response: requests.Response
+    :param api_key: Hulse API key.
+    :type api_key: str
+    """
+    from hulse import producer
+
+    producer.handle_producer_stream(response, api_key, **kwargs)
+
+
+def run_host(api_key: str, **kwargs):
     """Run the Hulse host until termination.
 
+    Kept for backward compatibility, see :func:`hulse.producer.run_host`.
+
     :param api_key: Hulse API key for the account.
     :type api_key: str
     """
-    # build channel path to host computation
-    channel_path = f"producer/{api_key}/"
+    from hulse import producer
 
-    # make streaming request to hulse server to enable push
-    r = requests.get(
-        settings.HULSE_STREAM_URL + channel_path,
-        headers=settings.get_auth_headers(api_key),
-        stream=True,
-    )
-    try:
-        handle_producer_stream(r, api_key)
-    except Exception as e:
-        raise errors.HulseError(expression=e)
+    producer.run_host(api_key, **kwargs)
 
 
-def create_cluster(api_key: str, name: str, description: str = None) -> bool:
+def create_cluster(
+    api_key: str, name: str, description: str = None, sessions: SessionPool = None
+) -> bool:
     """Create a new Hulse cluster.
 
     :param api_key: Hulse API key.
@@ -248,10 +602,13 @@ def create_cluster(api_key: str, name: str, description: str = None) -> bool:
     :type name: str
     :param description: Short description of the newly created cluster, defaults to None
     :type description: str, optional
+    :param sessions: Pooled HTTP sessions, defaults to the process-wide sessions.
+    :type sessions: SessionPool, optional
     :return: Whether the cluster was created.
     :rtype: bool
     """
-    r = requests.post(
+    session = (sessions or default_sessions).get(settings.HULSE_API_URL)
+    r = session.post(
         settings.HULSE_API_URL + "cluster/create/",
         headers=settings.get_auth_headers(api_key),
         data={"name": name, "description": description},
@@ -259,6 +616,71 @@ def create_cluster(api_key: str, name: str, description: str = None) -> bool:
     return r.status_code == 200
 
 
+def parse_size(size: str) -> int:
+    """Parse a human readable memory size such as 512MB or 4GB into bytes.
+
+    :param size: Memory size, plain numbers are read as bytes.
+    :type size: str
+    :raises ValueError: If the size cannot be parsed.
+    :return: Memory size in bytes.
+    :rtype: int
+    """
+    units = {"B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3, "TB": 1024**4}
+    size = str(size).strip().upper().replace("IB", "B")
+    for unit in sorted(units, key=len, reverse=True):
+        if size.endswith(unit):
+            return int(float(size[: -len(unit)].strip()) * units[unit])
+    return int(float(size))
+
+
+def get_total_memory() -> int:
+    """Get the physical memory of the machine.
+
+    :return: Physical memory in bytes, 0 if unknown.
+    :rtype: int
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+
+def get_rss() -> int:
+    """Get the current resident memory of the current process.
+
+    Read from /proc on Linux, and with psutil elsewhere if installed. The peak
+    resident memory is no substitute, since it does not drop once pipelines
+    are unloaded.
+
+    :return: Resident set size in bytes, 0 if unknown.
+    :rtype: int
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return 0
+
+
+def release_memory():
+    """Collect garbage and hand the freed heap memory back to the OS.
+
+    The allocator otherwise keeps memory freed by unloaded models, which then
+    still counts as resident memory of the process.
+    """
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
 def _async_raise(tid, exctype):
     """Raises an exception in the threads with id tid"""
     # https://stackoverflow.com/a/325528
@@ -328,6 +750,12 @@ class LoginThread(HostThread):
         self.email = None
         self.username = None
 
+        # flask is only needed to log in, avoid importing it with hulse
+        from flask import Flask, redirect, request, cli
+
+        # disable flask logs to CLI, avoid spamming user
+        cli.show_server_banner = lambda *args: None
+
         # local development server, ran on localhost
         self.app = Flask(__name__)
         logging.getLogger("werkzeug").disabled = True
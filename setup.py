@@ -21,6 +21,14 @@ setup(
         "flask",
         "appdirs",
     ],
+    extras_require={
+        "async": ["aiohttp"],
+        "msgpack": ["msgpack"],
+        "zstd": ["zstandard"],
+        "onnx": ["optimum[onnxruntime]"],
+        "otel": ["opentelemetry-api"],
+        "memory": ["psutil"],
+    },
     license="MIT",
     entry_points={
         "console_scripts": [
@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+from hulse import cache, settings
+from hulse.producer import Host
+from hulse.server import StreamServer
+
+API_KEY = "key"
+
+
+class FakePipeline:
+    """Text classification pipeline labelling each text with itself.
+
+    Outputs are shaped as those of transformers: a single text gets a list of
+    one label, or its top-k labels, and a list gets the output of each text.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, inputs, top_k=None, **kwargs):
+        self.calls.append((inputs, kwargs))
+
+        def classify(text):
+            labels = [
+                {"label": f"{text}-{i}", "score": 1 / (i + 1)}
+                for i in range(top_k or 1)
+            ]
+            return labels if top_k else labels[0]
+
+        if isinstance(inputs, list):
+            return [classify(text) for text in inputs]
+        return classify(inputs) if top_k else [classify(inputs)]
+
+
+class BlockingPipeline(FakePipeline):
+    """Pipeline whose calls wait until released."""
+
+    def __init__(self):
+        super().__init__()
+        self.released = threading.Event()
+
+    def __call__(self, inputs, **kwargs):
+        result = super().__call__(inputs, **kwargs)
+        self.released.wait(10)
+        return result
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("Condition not met in time.")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    with StreamServer(keep_alive=0.2) as server:
+        monkeypatch.setattr(settings, "HULSE_STREAM_URL", server.url)
+        yield server
+
+
+@pytest.fixture
+def start_host(server):
+    """Start hosts connected to the stand-in server, stopped after the test."""
+    hosts = []
+
+    def start(pipeline=None, **kwargs):
+        pipeline = pipeline or FakePipeline()
+        kwargs.setdefault("status_interval", 0)
+        kwargs.setdefault("result_cache_size", 0)
+        kwargs.setdefault(
+            "pipeline_cache", cache.PipelineCache(loader=lambda **_: pipeline)
+        )
+        host = Host(API_KEY, **kwargs)
+        thread = threading.Thread(target=host.run, daemon=True)
+        thread.start()
+        hosts.append((host, thread))
+        # hosts report their capabilities once connected
+        wait_for(
+            lambda: host.host_id in server.producers
+            and server.producers[host.host_id].connected
+            and server.producers[host.host_id].capabilities
+        )
+        return host
+
+    yield start
+    for host, thread in hosts:
+        host.stop()
+        thread.join(5)
@@ -0,0 +1,113 @@
+import json
+import threading
+
+import pytest
+
+from hulse.producer import AdmissionQueue
+from hulse.server import Producer, StreamServer
+
+
+def test_reject_refuses_new_queries():
+    queue = AdmissionQueue(max_depth=2, policy="reject")
+    assert queue.put({"qid": "a"}) == []
+    assert queue.put({"qid": "b"}) == []
+    assert queue.put({"qid": "c"}) == [{"qid": "c"}]
+    assert [queue.get()["qid"], queue.get()["qid"]] == ["a", "b"]
+    stats = queue.stats()
+    assert stats["admitted"] == 2
+    assert stats["rejected"] == 1
+    assert stats["peak_depth"] == 2
+
+
+def test_shed_oldest_refuses_the_oldest_query():
+    queue = AdmissionQueue(max_depth=2, policy="shed-oldest")
+    queue.put({"qid": "a"})
+    queue.put({"qid": "b"})
+    assert queue.put({"qid": "c"}) == [{"qid": "a"}]
+    assert [queue.get()["qid"], queue.get()["qid"]] == ["b", "c"]
+    assert queue.stats()["shed"] == 1
+
+
+def test_block_waits_for_room():
+    queue = AdmissionQueue(max_depth=1, policy="block")
+    queue.put({"qid": "a"})
+    refused = []
+    thread = threading.Thread(target=lambda: refused.extend(queue.put({"qid": "b"})))
+    thread.start()
+    thread.join(0.1)
+    assert thread.is_alive()
+    assert len(queue) == 1
+
+    assert queue.get()["qid"] == "a"
+    thread.join(1)
+    assert not thread.is_alive()
+    assert refused == []
+    assert queue.get()["qid"] == "b"
+
+
+def test_block_refuses_queries_once_closed():
+    queue = AdmissionQueue(max_depth=1, policy="block")
+    queue.put({"qid": "a"})
+    refused = []
+    thread = threading.Thread(target=lambda: refused.extend(queue.put({"qid": "b"})))
+    thread.start()
+    assert queue.close(drain=False) == [{"qid": "a"}]
+    thread.join(1)
+    assert refused == [{"qid": "b"}]
+    assert queue.get() is None
+
+
+def test_front_ignores_the_bound():
+    queue = AdmissionQueue(max_depth=1, policy="reject")
+    queue.put({"qid": "a"})
+    assert queue.put({"qid": "b"}, front=True) == []
+    assert [queue.get()["qid"], queue.get()["qid"]] == ["b", "a"]
+
+
+def test_unsupported_policy():
+    with pytest.raises(ValueError):
+        AdmissionQueue(policy="drop")
+
+
+def connect(server, host_id, api_key="key"):
+    producer = Producer(host_id, api_key)
+    producer.connected = True
+    server.producers[host_id] = producer
+    return producer
+
+
+def test_busy_query_is_routed_to_another_host():
+    server = StreamServer(keep_alive=0.1)
+    first, second = connect(server, "first"), connect(server, "second")
+    client = server.app.test_client()
+
+    response = client.get("/consumer/key/?task=text-classification&data=hello")
+    query = first.queries.get_nowait()
+    assert (
+        client.post("/result/", data=dict(qid=query["qid"], error="busy")).status_code
+        == 200
+    )
+    assert second.queries.get_nowait() == query
+    assert query["qid"] in second.in_flight
+    assert query["qid"] not in first.in_flight
+
+    # every host refused the query, the consumer is told it is busy
+    assert (
+        client.post("/result/", data=dict(qid=query["qid"], error="busy")).status_code
+        == 200
+    )
+    assert first.queries.empty()
+    events = response.get_data(as_text=True).split("\n\n")
+    assert json.loads(events[1][len("data: ") :]) == dict(
+        qid=query["qid"], error="busy"
+    )
+
+
+def test_busy_answer_of_unknown_query():
+    server = StreamServer()
+    connect(server, "first")
+    client = server.app.test_client()
+    assert (
+        client.post("/result/", data=dict(qid="unknown", error="busy")).status_code
+        == 404
+    )
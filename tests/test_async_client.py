@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from hulse import errors
+
+from conftest import API_KEY
+
+pytest.importorskip("aiohttp")
+
+from hulse.async_client import AsyncHulse
+
+
+@pytest.mark.parametrize("encoding", [None, "json"])
+def test_results_of_list_queries_do_not_depend_on_the_transport(start_host, encoding):
+    start_host()
+
+    async def main():
+        async with AsyncHulse(API_KEY, encoding=encoding) as client:
+            single = await client.query(["hi"], task="text-classification", timeout=5)
+            top_k = await client.query(
+                ["hi"], task="text-classification", timeout=5, top_k=2
+            )
+            return single["result"], top_k["result"]
+
+    label, second = {"label": "hi-0", "score": 1.0}, {"label": "hi-1", "score": 0.5}
+    assert asyncio.run(main()) == ([label], [[label, second]])
+
+
+def test_query_runs_on_a_host(start_host):
+    start_host()
+
+    async def main():
+        async with AsyncHulse(API_KEY) as client:
+            return await client.query("hi", task="text-classification", timeout=5)
+
+    answer = asyncio.run(main())
+    assert answer["result"] == {"label": "hi-0", "score": 1.0}
+    assert answer["trace"]["spans"]
+
+
+async def slow_query(data, **kwargs):
+    # later items complete first
+    await asyncio.sleep(0.05 * (3 - data))
+    if data == 1:
+        raise errors.InferenceError("failed")
+    return {"result": data}
+
+
+def test_query_batch_returns_results_in_order(monkeypatch):
+    client = AsyncHulse(API_KEY)
+    monkeypatch.setattr(client, "query", slow_query)
+    first, second, third = asyncio.run(
+        client.query_batch(range(3), concurrency=3, return_exceptions=True)
+    )
+    assert first == {"result": 0}
+    assert isinstance(second, errors.InferenceError)
+    assert third == {"result": 2}
+
+
+def test_query_batch_raises_the_exception_of_failed_queries(monkeypatch):
+    client = AsyncHulse(API_KEY)
+    monkeypatch.setattr(client, "query", slow_query)
+    with pytest.raises(errors.InferenceError):
+        asyncio.run(client.query_batch(range(3), concurrency=2))
+
+
+def test_query_batch_bounds_the_queries_in_flight(monkeypatch):
+    client = AsyncHulse(API_KEY)
+    in_flight, peak = [], []
+
+    async def query(data, **kwargs):
+        in_flight.append(data)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(data)
+        return {"result": data}
+
+    monkeypatch.setattr(client, "query", query)
+    results = asyncio.run(client.query_batch(range(20), concurrency=3))
+    assert [answer["result"] for answer in results] == list(range(20))
+    assert max(peak) == 3
+
+
+def test_iter_query_yields_results_in_order(monkeypatch):
+    client = AsyncHulse(API_KEY)
+    monkeypatch.setattr(client, "query", slow_query)
+
+    async def main():
+        results = client.iter_query(range(3), concurrency=3, return_exceptions=True)
+        return [result async for result in results]
+
+    first, second, third = asyncio.run(main())
+    assert first == {"result": 0}
+    assert isinstance(second, errors.InferenceError)
+    assert third == {"result": 2}
+
+
+def test_iter_query_yields_results_as_they_complete(monkeypatch):
+    client = AsyncHulse(API_KEY)
+    monkeypatch.setattr(client, "query", slow_query)
+
+    async def main():
+        results = client.iter_query(
+            range(3), concurrency=3, ordered=False, return_exceptions=True
+        )
+        return [result async for result in results]
+
+    results = asyncio.run(main())
+    assert [index for index, _ in results] == [2, 1, 0]
+    assert results[0][1] == {"result": 2}
+
+
+def test_iter_query_raises_the_exception_of_failed_queries(monkeypatch):
+    client = AsyncHulse(API_KEY)
+    monkeypatch.setattr(client, "query", slow_query)
+    results = []
+
+    async def main():
+        async for result in client.iter_query(range(3), concurrency=1):
+            results.append(result)
+
+    with pytest.raises(errors.InferenceError):
+        asyncio.run(main())
+    assert results == [{"result": 0}]
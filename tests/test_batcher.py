@@ -0,0 +1,68 @@
+import time
+
+from hulse.client import Hulse
+from hulse.producer import Batcher
+
+from conftest import API_KEY, FakePipeline, wait_for
+
+
+def query(qid, model="a", **kwargs):
+    return {
+        "qid": qid,
+        "task": "text-classification",
+        "model": model,
+        "data": qid,
+        **kwargs,
+    }
+
+
+def qids(batch):
+    return [query["qid"] for query in batch]
+
+
+def test_dispatches_full_batches_right_away():
+    batches = []
+    batcher = Batcher(batches.append, max_batch_size=2, max_wait_ms=60000)
+    batcher.add(query("1"))
+    batcher.add(query("2", model="b"))
+    batcher.add(query("3", kwargs={"top_k": 2}))
+    assert batches == []
+    batcher.add(query("4"))
+    assert [qids(batch) for batch in batches] == [["1", "4"]]
+    batcher.close()
+    assert sorted(qids(batch) for batch in batches) == [["1", "4"], ["2"], ["3"]]
+
+
+def test_dispatches_partial_batches_once_their_oldest_query_waited():
+    batches = []
+    batcher = Batcher(batches.append, max_batch_size=8, max_wait_ms=100)
+    start = time.monotonic()
+    batcher.add(query("1"))
+    batcher.add(query("2"))
+    wait_for(lambda: batches)
+    assert time.monotonic() - start >= 0.1
+    assert [qids(batch) for batch in batches] == [["1", "2"]]
+
+    batcher.add(query("3"))
+    wait_for(lambda: len(batches) == 2)
+    assert qids(batches[1]) == ["3"]
+    batcher.close()
+
+
+def test_host_runs_concurrent_queries_as_a_batch(start_host):
+    pipeline = FakePipeline()
+    start_host(pipeline, workers=1, batch_size=4, batch_wait_ms=500)
+    with Hulse(API_KEY) as client:
+        results = client.query_batch(
+            ["a", "b", "c", "d"], task="text-classification", concurrency=4
+        )
+    assert [answer["result"]["label"] for answer in results] == [
+        "a-0",
+        "b-0",
+        "c-0",
+        "d-0",
+    ]
+    assert len(pipeline.calls) == 1
+    inputs, kwargs = pipeline.calls[0]
+    assert sorted(inputs) == ["a", "b", "c", "d"]
+    assert kwargs["batch_size"] == 4
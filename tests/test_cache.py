@@ -0,0 +1,371 @@
+import sys
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from hulse import cache as cache_module
+from hulse import errors, settings, utils
+from hulse.cache import LRUCache, PipelineCache, ResultCache
+from hulse.client import Hulse
+
+MB = 2**20
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.keys() == ["a", "c"]
+    assert cache.get("b") is None
+    assert cache.stats() == dict(
+        entries=2, max_entries=2, pinned=0, hits=1, misses=1, evictions=1
+    )
+
+
+def test_pinned_entries_are_not_evicted():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    assert cache.pin("a")
+    assert not cache.pin("unknown")
+    cache.put("b", 2)
+    cache.put("c", 3)
+    assert cache.keys() == ["a", "c"]
+
+    # pinned entries count towards the budget
+    cache.put("d", 4)
+    assert cache.keys() == ["a", "d"]
+    cache.unpin("a")
+    cache.put("e", 5)
+    assert cache.keys() == ["d", "e"]
+
+
+class FakePipeline:
+    def __init__(self, task, model, size):
+        self.task = task
+        self.model_name = model
+        self.size = size
+
+
+class FakeMemory:
+    """Resident memory of the process made of the pipelines still alive."""
+
+    def __init__(self, sizes, base=50 * MB):
+        self.sizes = sizes
+        self.base = base
+        self.loads = []
+        self._alive = weakref.WeakSet()
+
+    def rss(self):
+        return self.base + sum(pipe.size for pipe in self._alive)
+
+    def load(self, task, model=None, **kwargs):
+        self.loads.append(model)
+        pipe = FakePipeline(task, model, self.sizes[model])
+        self._alive.add(pipe)
+        return pipe
+
+
+@pytest.fixture
+def memory(monkeypatch):
+    memory = FakeMemory(
+        {"a": 100 * MB, "b": 100 * MB, "c": 100 * MB, "large": 600 * MB}
+    )
+    monkeypatch.setattr(utils, "get_rss", memory.rss)
+    return memory
+
+
+def make_cache(memory, estimator=None):
+    return PipelineCache(
+        max_entries=10,
+        max_memory=0,
+        loader=memory.load,
+        max_rss=300 * MB,
+        mmap_weights=False,
+        estimator=estimator or memory.sizes.get,
+    )
+
+
+def load(cache, model):
+    # keep no reference to the pipeline, so that it is freed once evicted
+    cache.get_pipeline("text-classification", model)
+
+
+def key(model):
+    return PipelineCache.make_key("text-classification", model)
+
+
+def test_evicts_least_recently_used_pipelines_to_fit_the_budget(memory):
+    cache = make_cache(memory)
+    load(cache, "a")
+    load(cache, "b")
+    load(cache, "a")
+    assert memory.loads == ["a", "b"]
+
+    load(cache, "c")
+    assert cache.keys() == [key("a"), key("c")]
+    assert memory.rss() == 250 * MB
+    assert cache.evictions == 1
+    assert cache.pipelines()[key("c")]["resident"] == 100 * MB
+    assert cache.stats()["resident"] == 200 * MB
+
+
+def test_pinned_pipelines_are_not_unloaded(memory):
+    cache = make_cache(memory)
+    cache.preload("text-classification", "a")
+    load(cache, "b")
+    load(cache, "c")
+    assert cache.keys() == [key("a"), key("c")]
+    assert memory.rss() == 250 * MB
+
+
+def test_refuses_pipelines_which_cannot_fit_before_loading_them(memory):
+    cache = make_cache(memory)
+    cache.preload("text-classification", "a")
+    load(cache, "b")
+    with pytest.raises(errors.MemoryBudgetError) as e:
+        load(cache, "large")
+    assert e.value.needed == 750 * MB
+    assert e.value.budget == 300 * MB
+    # nothing was unloaded for a pipeline which would not fit anyway
+    assert memory.loads == ["a", "b"]
+    assert cache.keys() == [key("a"), key("b")]
+
+
+def test_refuses_pipelines_measured_over_the_budget(memory):
+    cache = make_cache(memory, estimator=lambda model: 0)
+    load(cache, "a")
+    with pytest.raises(errors.MemoryBudgetError):
+        load(cache, "large")
+    assert memory.loads == ["a", "large"]
+    assert key("large") not in cache
+    assert memory.rss() <= 300 * MB
+
+    # the measured size refuses the next load right away
+    with pytest.raises(errors.MemoryBudgetError):
+        load(cache, "large")
+    assert memory.loads == ["a", "large"]
+    load(cache, "b")
+    assert cache.keys() == [key("a"), key("b")]
+
+
+def test_disables_the_budget_when_resident_memory_is_unknown(memory, monkeypatch):
+    monkeypatch.setattr(utils, "get_rss", lambda: 0)
+    cache = make_cache(memory)
+    assert cache.max_rss == 0
+    load(cache, "large")
+    assert memory.loads == ["large"]
+
+    cache.configure(max_rss=300 * MB)
+    assert cache.max_rss == 0
+
+
+def test_estimates_pipelines_outside_of_the_load_lock(memory):
+    locked = []
+
+    def estimator(model):
+        locked.append(cache._load_lock.locked())
+        return memory.sizes[model]
+
+    cache = make_cache(memory, estimator=estimator)
+    load(cache, "a")
+    assert locked == [False]
+
+
+def test_caches_the_weights_sizes_found_on_the_hub(monkeypatch, tmp_path):
+    lookups = []
+
+    class HfApi:
+        def model_info(self, model, files_metadata=False, timeout=None):
+            lookups.append((model, timeout))
+            files = [SimpleNamespace(rfilename="model.safetensors", size=10 * MB)]
+            return SimpleNamespace(siblings=files)
+
+    monkeypatch.setitem(sys.modules, "huggingface_hub", SimpleNamespace(HfApi=HfApi))
+    monkeypatch.setenv("HF_HUB_CACHE", str(tmp_path))
+    monkeypatch.setattr(cache_module, "_hub_weights_sizes", {})
+    assert cache_module.estimate_weights_size("org/model") == 10 * MB
+    assert cache_module.estimate_weights_size("org/model") == 10 * MB
+    assert lookups == [("org/model", settings.PIPELINE_ESTIMATE_TIMEOUT)]
+
+
+class FakeModel:
+    """Model whose parameters take `size` bytes."""
+
+    def __init__(self, size):
+        self.size = size
+
+    def parameters(self):
+        return [FakeTensor(self.size)]
+
+    def buffers(self):
+        return []
+
+
+class FakeTensor:
+    def __init__(self, size):
+        self.size = size
+
+    def numel(self):
+        return self.size
+
+    def element_size(self):
+        return 1
+
+
+class FakeLoader:
+    def __init__(self, sizes=None, delay=0):
+        self.sizes = sizes or {}
+        self.delay = delay
+        self.loads = []
+
+    def __call__(self, task, model=None, **kwargs):
+        self.loads.append((model, kwargs))
+        time.sleep(self.delay)
+        pipe = FakePipeline(task, model, self.sizes.get(model, 0))
+        pipe.model = FakeModel(pipe.size)
+        return pipe
+
+
+def test_reuses_loaded_pipelines():
+    loader = FakeLoader()
+    cache = PipelineCache(max_entries=2, max_memory=0, loader=loader, max_rss=0)
+    pipe = cache.get_pipeline("text-classification", "a")
+    assert cache.get_pipeline("text-classification", "a") is pipe
+    assert cache.get_pipeline("text-classification", "a", device=-1) is not pipe
+    assert loader.loads == [("a", {}), ("a", {"device": -1})]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_evicts_least_recently_used_pipelines_over_the_entry_budget():
+    loader = FakeLoader()
+    cache = PipelineCache(max_entries=2, max_memory=0, loader=loader, max_rss=0)
+    load(cache, "a")
+    load(cache, "b")
+    load(cache, "a")
+    load(cache, "c")
+    assert cache.keys() == [key("a"), key("c")]
+    assert cache.evictions == 1
+
+    load(cache, "b")
+    assert [model for model, _ in loader.loads] == ["a", "b", "c", "b"]
+
+
+def test_evicts_pipelines_over_the_memory_budget():
+    loader = FakeLoader({"a": 4 * MB, "b": 4 * MB, "c": 8 * MB})
+    cache = PipelineCache(max_entries=10, max_memory=10 * MB, loader=loader, max_rss=0)
+    load(cache, "a")
+    load(cache, "b")
+    assert cache.memory == 8 * MB
+    load(cache, "c")
+    assert cache.keys() == [key("c")]
+    assert cache.memory == 8 * MB
+
+    cache.configure(max_memory=4 * MB)
+    # the most recently used pipeline is kept, even over budget
+    assert cache.keys() == [key("c")]
+    cache.pop(key("c"))
+    assert cache.memory == 0
+
+
+def test_concurrent_requests_wait_for_a_single_load():
+    loader = FakeLoader(delay=0.1)
+    cache = PipelineCache(max_entries=2, max_memory=0, loader=loader, max_rss=0)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        pipes = list(
+            executor.map(
+                lambda _: cache.get_pipeline("text-classification", "a"), range(4)
+            )
+        )
+    assert len(loader.loads) == 1
+    assert all(pipe is pipes[0] for pipe in pipes)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("hulse.cache.time.time", clock)
+    return clock
+
+
+def test_result_keys_identify_queries():
+    make_key = ResultCache.make_key
+    assert make_key("t", None, "hi", top_k=2, truncation=True) == make_key(
+        "t", None, "hi", truncation=True, top_k=2
+    )
+    assert make_key("t", None, "hi") != make_key("t", None, ["hi"])
+    assert make_key("t", None, "hi") != make_key("t", "m", "hi")
+    assert make_key("t", None, "hi") != make_key("t", None, "hi", top_k=2)
+
+
+def test_results_expire_after_their_ttl(clock):
+    results = ResultCache(max_entries=10, ttl=60)
+    results.put("a", {"label": "a"})
+    clock.now += 59
+    assert results.get("a") == {"label": "a"}
+    clock.now += 2
+    assert results.get("a") is None
+    assert "a" not in results
+    assert results.stats()["hit_rate"] == 0.5
+
+
+def test_results_are_stored_on_disk(clock, tmp_path):
+    path = tmp_path / "results.sqlite"
+    results = ResultCache(max_entries=1, ttl=60, disk=True, path=path)
+    results.put("a", [1, 2])
+    results.put("b", [3])
+    # evicted from memory, still on disk
+    assert results.keys() == ["b"]
+    assert results.get("a") == [1, 2]
+    results.close()
+
+    results = ResultCache(max_entries=1, ttl=60, disk=True, path=path)
+    assert results.get("b") == [3]
+    assert results.stats()["disk_entries"] == 2
+    clock.now += 61
+    assert results.get("a") is None
+    results.close()
+
+
+def test_disk_store_evicts_least_recently_used_results(clock, tmp_path):
+    results = ResultCache(
+        max_entries=1, ttl=60, disk=True, path=tmp_path / "r", max_disk_entries=2
+    )
+    for key in ["a", "b", "c"]:
+        clock.now += 1
+        results.put(key, key)
+    assert results.stats()["disk_entries"] == 2
+    assert results.get("a") is None
+    assert results.get("b") == "b"
+    results.close()
+
+
+def test_client_answers_repeated_queries_from_its_cache(monkeypatch):
+    queries = []
+
+    def post_query(task, data, model, api_key, **kwargs):
+        queries.append(data)
+        return {"qid": "q", "result": {"label": data}, "trace": {}}
+
+    monkeypatch.setattr(utils, "post_query", post_query)
+    with Hulse("key", cache=True) as client:
+        first = client.query("hi", task="text-classification")
+        again = client.query("hi", task="text-classification")
+        client.query("hi", task="text-classification", top_k=2)
+        assert again["result"] == first["result"]
+        assert "qid" in again and "trace" in again
+        assert queries == ["hi", "hi"]
+        assert client.cache_stats()["hits"] == 1
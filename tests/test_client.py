@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+from hulse import errors
+from hulse.client import Hulse
+
+from conftest import API_KEY
+
+
+@pytest.mark.parametrize("encoding", [None, "json"])
+def test_results_of_list_queries_do_not_depend_on_the_transport(start_host, encoding):
+    start_host()
+    client = Hulse(API_KEY, encoding=encoding)
+
+    def query(data, **kwargs):
+        answer = client.query(data, task="text-classification", timeout=5, **kwargs)
+        return answer["result"]
+
+    label, second = {"label": "hi-0", "score": 1.0}, {"label": "hi-1", "score": 0.5}
+    assert query("hi") == label
+    assert query("hi", top_k=2) == [label, second]
+    assert query(["hi"]) == [label]
+    assert query(["hi"], top_k=2) == [[label, second]]
+    assert query(["hi", "hi"], top_k=2) == [[label, second], [label, second]]
+    client.close()
+
+
+def slow_query(data, **kwargs):
+    # later items complete first
+    time.sleep(0.05 * (3 - data))
+    if data == 1:
+        raise errors.InferenceError("failed")
+    return {"result": data}
+
+
+def test_iter_query_yields_results_in_order(monkeypatch):
+    client = Hulse(API_KEY)
+    monkeypatch.setattr(client, "query", slow_query)
+    results = client.iter_query(range(3), concurrency=3, return_exceptions=True)
+    first, second, third = results
+    assert first == {"result": 0}
+    assert isinstance(second, errors.InferenceError)
+    assert third == {"result": 2}
+
+
+def test_iter_query_yields_results_as_they_complete(monkeypatch):
+    client = Hulse(API_KEY)
+    monkeypatch.setattr(client, "query", slow_query)
+    results = list(
+        client.iter_query(
+            range(3), concurrency=3, ordered=False, return_exceptions=True
+        )
+    )
+    assert [index for index, _ in results] == [2, 1, 0]
+    assert results[0][1] == {"result": 2}
+
+
+def test_iter_query_raises_the_exception_of_failed_queries(monkeypatch):
+    client = Hulse(API_KEY)
+    monkeypatch.setattr(client, "query", slow_query)
+    results = client.iter_query(range(3), concurrency=1)
+    assert next(results) == {"result": 0}
+    with pytest.raises(errors.InferenceError):
+        next(results)
+    with pytest.raises(errors.InferenceError):
+        client.query_batch(range(3), concurrency=2)
+
+
+def test_iter_query_bounds_the_queries_in_flight(monkeypatch):
+    client = Hulse(API_KEY)
+    in_flight, peak = [], []
+    lock = threading.Lock()
+
+    def query(data, **kwargs):
+        with lock:
+            in_flight.append(1)
+            peak.append(len(in_flight))
+        time.sleep(0.01)
+        with lock:
+            in_flight.pop()
+        return {"result": data}
+
+    monkeypatch.setattr(client, "query", query)
+    assert [
+        answer["result"] for answer in client.iter_query(range(20), concurrency=3)
+    ] == list(range(20))
+    assert max(peak) <= 3
@@ -0,0 +1,116 @@
+import pytest
+
+from hulse.encoding import (
+    COMPRESSED,
+    COMPRESSION_HEADER,
+    FRAME_HEADER,
+    KEEP_ALIVE,
+    Message,
+    WireFormat,
+)
+
+FORMATS = [
+    ("json", None, None),
+    ("json", "gzip", None),
+    ("json", "zstd", "zstandard"),
+    ("msgpack", None, "msgpack"),
+    ("msgpack", "gzip", "msgpack"),
+    ("msgpack", "zstd", "zstandard"),
+]
+
+RESULT = {
+    "qid": "0123456789abcdef",
+    "result": [{"label": "POSITIVE", "score": 0.99}] * 100,
+    "trace": {"trace_id": "t", "spans": []},
+}
+
+
+@pytest.fixture(params=FORMATS, ids=lambda p: "-".join(filter(None, p[:2])))
+def wire_format(request):
+    encoding, compression, module = request.param
+    if module is not None:
+        pytest.importorskip(module)
+    if encoding == "msgpack":
+        pytest.importorskip("msgpack")
+    return WireFormat(encoding, compression, min_compress_size=64)
+
+
+def test_round_trip(wire_format):
+    for obj in [RESULT, {"qid": "a", "token": "été"}, ["a", 1, 2.5, None, True]]:
+        assert wire_format.decode(wire_format.encode(obj)) == obj
+
+
+def test_compresses_large_frames_only(wire_format):
+    small, large = wire_format.encode({"qid": "a"}), wire_format.encode(RESULT)
+    assert not FRAME_HEADER.unpack_from(small)[1] & COMPRESSED
+    flags = FRAME_HEADER.unpack_from(large)[1]
+    assert bool(flags & COMPRESSED) == bool(wire_format.compression)
+
+
+def test_parser_splits_frames_across_chunks(wire_format):
+    objs = [{"qid": "a", "token": "x"}, RESULT, {"qid": "b"}]
+    stream = (
+        KEEP_ALIVE
+        + wire_format.encode(objs[0], 1)
+        + KEEP_ALIVE
+        + wire_format.encode(objs[1], 2)
+        + wire_format.encode(objs[2])
+    )
+    expected = [Message(objs[0], "1"), Message(objs[1], "2"), Message(objs[2])]
+    assert wire_format.parser().feed(stream) == expected
+
+    parser = wire_format.parser()
+    messages = []
+    for i in range(0, len(stream), 7):
+        messages.extend(parser.feed(stream[i : i + 7]))
+    assert messages == expected
+    assert list(wire_format.iter_messages([stream[:10], stream[10:]])) == expected
+
+
+def test_parser_waits_for_complete_frames():
+    wire_format = WireFormat()
+    frame = wire_format.encode({"qid": "a"})
+    parser = wire_format.parser()
+    assert parser.feed(frame[:3]) == []
+    assert parser.feed(frame[3:-1]) == []
+    assert parser.feed(frame[-1:]) == [Message({"qid": "a"})]
+
+
+def test_decode_requires_a_single_frame():
+    wire_format = WireFormat()
+    frame = wire_format.encode({"qid": "a"})
+    with pytest.raises(ValueError):
+        wire_format.decode(frame + frame)
+    with pytest.raises(ValueError):
+        wire_format.decode(frame[:-1])
+
+
+def test_compressed_frame_without_compression():
+    frame = WireFormat("json", "gzip", min_compress_size=0).encode({"qid": "a"})
+    with pytest.raises(ValueError):
+        WireFormat().decode(frame)
+
+
+def test_unsupported_format():
+    with pytest.raises(ValueError):
+        WireFormat("xml")
+    with pytest.raises(ValueError):
+        WireFormat("json", "brotli")
+
+
+def test_headers_round_trip():
+    wire_format = WireFormat("json", "gzip")
+    assert wire_format.headers() == {
+        "Content-Type": "application/vnd.hulse.json",
+        "Accept": "application/vnd.hulse.json",
+        COMPRESSION_HEADER: "gzip",
+    }
+    parsed = WireFormat.from_headers(wire_format.headers(), "Accept")
+    assert (parsed.encoding, parsed.compression) == ("json", "gzip")
+    assert WireFormat.from_headers({"Content-Type": "text/event-stream"}) is None
+    assert (
+        WireFormat.from_headers(
+            {"Content-Type": "application/vnd.hulse.json", COMPRESSION_HEADER: "lz4"}
+        )
+        is None
+    )
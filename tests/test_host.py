@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from hulse import cache, errors, settings
+from hulse.client import Hulse
+from hulse.producer import Host, format_model_spec, parse_model_spec
+
+from conftest import API_KEY, BlockingPipeline, FakePipeline, wait_for
+
+
+class BarrierPipeline(FakePipeline):
+    """Pipeline whose calls wait for `parties` calls to run at the same time."""
+
+    def __init__(self, parties: int):
+        super().__init__()
+        self.barrier = threading.Barrier(parties, timeout=5)
+        self.threads = set()
+
+    def __call__(self, inputs, **kwargs):
+        self.threads.add(threading.current_thread().name)
+        self.barrier.wait()
+        return super().__call__(inputs, **kwargs)
+
+
+def test_dispatches_queries_to_concurrent_workers(start_host):
+    pipeline = BarrierPipeline(parties=2)
+    start_host(pipeline, workers=2, batch_size=1)
+    with Hulse(API_KEY) as client:
+        results = client.query_batch(
+            ["a", "b"], task="text-classification", concurrency=2, timeout=10
+        )
+    assert [answer["result"]["label"] for answer in results] == ["a-0", "b-0"]
+    assert len(pipeline.threads) == 2
+    assert all(name.startswith("hulse-worker") for name in pipeline.threads)
+
+
+def test_coalesces_identical_queries_and_memoizes_their_result(start_host):
+    pipeline = BlockingPipeline()
+    host = start_host(pipeline, workers=2, batch_size=1, result_cache_size=16)
+    with Hulse(API_KEY) as client:
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            answers = [
+                executor.submit(
+                    client.query, "hi", task="text-classification", timeout=10
+                )
+                for _ in range(3)
+            ]
+            wait_for(lambda: host.coalesced == 2)
+            pipeline.released.set()
+            results = [answer.result()["result"] for answer in answers]
+        assert results == [{"label": "hi-0", "score": 1.0}] * 3
+        assert len(pipeline.calls) == 1
+
+        # answered from the memoized result
+        answer = client.query("hi", task="text-classification", timeout=10)
+        assert answer["result"] == results[0]
+        assert len(pipeline.calls) == 1
+        assert "result.cache" in [span["name"] for span in answer["trace"]["spans"]]
+
+        # other pipeline arguments get their own result
+        client.query("hi", task="text-classification", timeout=10, top_k=2)
+        assert len(pipeline.calls) == 2
+
+
+class PreloadedPipeline(FakePipeline):
+    """Pipeline recording its warm-up in the directory of HULSE_TEST_PRELOADS."""
+
+    def __call__(self, inputs, **kwargs):
+        path = os.path.join(os.environ["HULSE_TEST_PRELOADS"], str(os.getpid()))
+        with open(path, "a") as f:
+            f.write(f"{inputs}\n")
+        return super().__call__(inputs, **kwargs)
+
+
+def load_preloaded_pipeline(task, model=None, **kwargs):
+    # the first process preloads right away, the others take their time
+    try:
+        os.close(
+            os.open(
+                os.path.join(os.environ["HULSE_TEST_PRELOADS"], "first"),
+                os.O_CREAT | os.O_EXCL,
+            )
+        )
+    except FileExistsError:
+        time.sleep(1)
+    return PreloadedPipeline()
+
+
+def test_process_workers_are_ready_once_started(tmp_path, monkeypatch):
+    monkeypatch.setenv("HULSE_TEST_PRELOADS", str(tmp_path))
+    host = Host(
+        API_KEY,
+        workers=2,
+        worker_type="process",
+        preload=["text-classification"],
+        status_interval=0,
+        pipeline_cache=cache.PipelineCache(loader=load_preloaded_pipeline),
+    )
+    try:
+        host.start()
+        warmed = {
+            path.name: path.read_text()
+            for path in tmp_path.iterdir()
+            if path.name != "first"
+        }
+        assert len(warmed) == 2
+        warmup = settings.WARMUP_INPUTS["text-classification"]
+        assert all(text == f"{warmup}\n" for text in warmed.values())
+    finally:
+        host.close()
+
+
+def test_parses_the_pipelines_to_preload():
+    assert parse_model_spec("text-classification") == ("text-classification", None)
+    assert parse_model_spec("summarization:t5-small") == ("summarization", "t5-small")
+    assert parse_model_spec({"task": "translation", "model": "m"}) == (
+        "translation",
+        "m",
+    )
+    assert parse_model_spec(("question-answering", None)) == (
+        "question-answering",
+        None,
+    )
+    with pytest.raises(errors.UnsupportedTaskError):
+        parse_model_spec("unknown:model")
+    assert format_model_spec("summarization", "t5-small") == "summarization:t5-small"
+    assert format_model_spec("summarization") == "summarization"
+
+
+def test_preloaded_pipelines_are_warm_and_pinned_before_connecting(start_host, server):
+    pipeline = FakePipeline()
+    pipelines = cache.PipelineCache(max_entries=1, loader=lambda **_: pipeline)
+    host = start_host(
+        pipeline, preload=["text-classification:a"], pipeline_cache=pipelines
+    )
+    warmup = settings.WARMUP_INPUTS["text-classification"]
+    assert pipeline.calls == [(warmup, {})]
+    assert server.producers[host.host_id].capabilities["models"] == [
+        "text-classification:a"
+    ]
+
+    # other pipelines do not evict the preloaded one
+    with Hulse(API_KEY) as client:
+        client.query("hi", task="text-classification", model="b", timeout=5)
+    assert pipelines.make_key("text-classification", "a") in pipelines
+
+
+def test_closes_the_host_when_preloading_fails(server):
+    def load(**kwargs):
+        raise OSError("no such model")
+
+    host = Host(
+        API_KEY,
+        preload=["text-classification:missing"],
+        status_interval=0,
+        pipeline_cache=cache.PipelineCache(loader=load),
+    )
+    with pytest.raises(OSError):
+        host.run()
+    # no query is admitted anymore
+    assert host.admission.put({"qid": "late"}) == [{"qid": "late"}]
+
+
+def test_reconnects_and_drops_replayed_queries(start_host, server):
+    pipeline = FakePipeline()
+    host = start_host(pipeline, reconnect_backoff=0.01)
+    with Hulse(API_KEY) as client:
+        client.query("before", task="text-classification", timeout=5)
+        server.disconnect(host.host_id)
+        wait_for(lambda: host.reconnects == 1)
+        assert server.producers[host.host_id].connected
+        assert host.last_event_id == "1"
+        answer = client.query("after", task="text-classification", timeout=5)
+        assert answer["result"]["label"] == "after-0"
+    assert host.downtime > 0
+
+    query = {"qid": "replayed", "task": "text-classification", "data": "hi"}
+    host.submit(query)
+    host.submit(dict(query))
+    wait_for(lambda: len(pipeline.calls) == 3)
+    assert host.duplicates == 1
@@ -0,0 +1,67 @@
+import requests
+
+from hulse.client import Hulse
+from hulse.metrics import CONTENT_TYPE, Histogram, MetricsServer, Registry
+
+from conftest import API_KEY, wait_for
+
+
+def test_renders_cumulative_histogram_buckets():
+    histogram = Histogram("latency_seconds", "Latency.", ("model",), (0.1, 1))
+    histogram.observe(0.1, model="a")
+    histogram.observe(0.5, model="a")
+    histogram.observe(30, model="a")
+    assert histogram.render() == [
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{model="a",le="0.1"} 1',
+        'latency_seconds_bucket{model="a",le="1"} 2',
+        'latency_seconds_bucket{model="a",le="+Inf"} 3',
+        'latency_seconds_sum{model="a"} 30.6',
+        'latency_seconds_count{model="a"} 3',
+    ]
+
+
+def test_renders_counters_and_gauges_with_escaped_labels():
+    registry = Registry()
+    queries = registry.counter("queries_total", "Queries.", ("model", "outcome"))
+    depth = registry.gauge("queue_depth", "Queued queries.")
+    registry.add_collector(lambda: depth.set(3))
+    queries.inc(model='say "hi"\n', outcome="answered")
+    queries.inc(2, model=None, outcome="answered")
+    assert registry.render().splitlines() == [
+        "# HELP queries_total Queries.",
+        "# TYPE queries_total counter",
+        'queries_total{model="say \\"hi\\"\\n",outcome="answered"} 1.0',
+        'queries_total{model="",outcome="answered"} 2.0',
+        "# HELP queue_depth Queued queries.",
+        "# TYPE queue_depth gauge",
+        "queue_depth 3.0",
+    ]
+
+
+def test_serves_the_metrics_of_a_host(start_host):
+    host = start_host()
+    with Hulse(API_KEY) as client:
+        client.query("hi", task="text-classification", timeout=5)
+
+    server = MetricsServer(host.metrics, port=0, address="127.0.0.1")
+    server.start()
+    try:
+        # answers are counted once posted
+        wait_for(lambda: 'outcome="answered"' in host.metrics.render())
+        response = requests.get(server.url)
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == CONTENT_TYPE
+        assert (
+            'hulse_host_queries_total{task="text-classification",model="",'
+            'outcome="answered"} 1.0' in response.text.splitlines()
+        )
+        assert (
+            'hulse_host_inference_seconds_count{task="text-classification",model=""} 1'
+            in response.text.splitlines()
+        )
+        assert "hulse_host_queue_depth 0.0" in response.text.splitlines()
+        assert requests.get(server.url.replace("/metrics", "/other")).status_code == 404
+    finally:
+        server.stop()
@@ -0,0 +1,115 @@
+from hulse import settings
+from hulse.producer import bound_query, format_result
+
+
+def test_caps_generation_arguments():
+    query = {
+        "task": "text-generation",
+        "data": "Hello",
+        "kwargs": {
+            "max_new_tokens": 10000,
+            "min_new_tokens": 10000,
+            "num_return_sequences": 100,
+            "num_beams": 100,
+        },
+    }
+    kwargs = bound_query(query, max_new_tokens=64)["kwargs"]
+    assert kwargs["max_new_tokens"] == 64
+    assert kwargs["min_new_tokens"] == 64
+    assert kwargs["num_return_sequences"] == settings.HOST_MAX_RETURN_SEQUENCES
+    assert kwargs["num_beams"] == settings.HOST_MAX_BEAMS
+
+
+def test_keeps_arguments_under_the_caps():
+    query = {"task": "summarization", "data": "Hello", "kwargs": {"max_new_tokens": 8}}
+    assert bound_query(query, max_new_tokens=64)["kwargs"]["max_new_tokens"] == 8
+
+
+def test_no_cap_for_non_positive_limit():
+    query = {
+        "task": "summarization",
+        "data": "Hello",
+        "kwargs": {"max_new_tokens": 5000},
+    }
+    assert bound_query(query, max_new_tokens=0)["kwargs"]["max_new_tokens"] == 5000
+
+
+def test_defaults_max_new_tokens_of_generation_tasks():
+    query = {"task": "summarization", "data": "Hello"}
+    kwargs = bound_query(query, max_new_tokens=32)["kwargs"]
+    assert kwargs["max_new_tokens"] == 32
+    assert kwargs["truncation"] is True
+
+
+def test_drops_unsupported_and_invalid_arguments():
+    query = {
+        "task": "text-classification",
+        "data": "Hello",
+        "kwargs": {"top_k": 2, "num_beams": 64, "device": "cuda"},
+    }
+    assert bound_query(query)["kwargs"] == {"top_k": 2, "truncation": True}
+
+    query = {"task": "translation", "data": "Hello", "kwargs": {"num_beams": "many"}}
+    assert "num_beams" not in bound_query(query)["kwargs"]
+
+
+def test_truncates_input_texts():
+    query = {
+        "task": "question-answering",
+        "data": {"question": "q" * 50, "context": ["c" * 50, "short"]},
+    }
+    data = bound_query(query, max_input_length=10)["data"]
+    assert data == {"question": "q" * 10, "context": ["c" * 10, "short"]}
+
+
+def test_streamed_queries_generate_a_single_sequence():
+    query = {
+        "task": "text-generation",
+        "data": "Hello",
+        "stream": True,
+        "kwargs": {"num_beams": 4, "num_return_sequences": 4},
+    }
+    bounded = bound_query(query)
+    assert bounded["stream"] is True
+    assert bounded["kwargs"]["num_beams"] == 1
+    assert bounded["kwargs"]["num_return_sequences"] == 1
+    assert bounded["kwargs"]["return_full_text"] is False
+
+    query = dict(query, data=["Hello", "World"])
+    bounded = bound_query(query)
+    assert bounded["stream"] is False
+    assert bounded["kwargs"]["num_beams"] == settings.HOST_MAX_BEAMS
+
+
+def test_leaves_the_query_unchanged():
+    query = {"task": "translation", "data": "x" * 20, "kwargs": {"num_beams": 100}}
+    bound_query(query, max_input_length=5)
+    assert query == {
+        "task": "translation",
+        "data": "x" * 20,
+        "kwargs": {"num_beams": 100},
+    }
+
+
+def test_unwraps_the_single_output_of_a_single_input():
+    label = {"label": "POSITIVE", "score": 0.9}
+    assert format_result("text", [label]) == label
+    # question answering pipelines return the answer itself
+    answer = {"answer": "Paris", "score": 0.9}
+    assert format_result({"question": "q", "context": "c"}, answer) == answer
+
+
+def test_keeps_all_the_outputs_of_a_single_input():
+    labels = [{"label": "a", "score": 0.6}, {"label": "b", "score": 0.4}]
+    assert format_result("text", labels) == labels
+    sequences = [{"generated_text": "x"}, {"generated_text": "y"}]
+    assert format_result("prompt", sequences) == sequences
+
+
+def test_returns_the_result_of_each_input_of_a_list():
+    first, second = {"label": "a", "score": 1.0}, {"label": "b", "score": 1.0}
+    assert format_result(["x"], [first]) == [first]
+    assert format_result(["x", "y"], [first, second]) == [first, second]
+    # generation pipelines wrap the output of each input in a list
+    assert format_result(["x", "y"], [[first], [second]]) == [first, second]
+    assert format_result(["x"], [[first, second]]) == [[first, second]]
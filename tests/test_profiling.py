@@ -0,0 +1,71 @@
+import threading
+import time
+
+from hulse.profiling import SamplingProfiler, classify
+
+
+def test_classifies_stacks_by_the_first_matching_stage():
+    producer = "/site-packages/hulse/producer.py"
+    assert classify([("/lib/threading.py", "wait")]) == "idle"
+    assert classify([("/site-packages/torch/nn/modules/linear.py", "forward")]) == (
+        "forward pass"
+    )
+    # stages are matched in the order of the rules, whatever the frame
+    assert (
+        classify([("/lib/json/encoder.py", "encode"), (producer, "post_result")])
+        == "result post"
+    )
+    assert (
+        classify(
+            [
+                ("/site-packages/tokenizers/__init__.py", "encode"),
+                ("/site-packages/transformers/pipelines/base.py", "forward"),
+                (producer, "run_inference"),
+            ]
+        )
+        == "tokenization"
+    )
+    assert classify([("/site-packages/hulse/sse.py", "feed")]) == "json parse"
+    assert classify([(producer, "run_batch")]) == "inference (other)"
+    assert classify([("/app/main.py", "main")]) == "other"
+    assert classify([]) == "other"
+
+
+def test_stream_reads_waiting_for_data_are_idle():
+    read = [("/site-packages/hulse/sse.py", "iter_chunks")]
+    assert classify([("/lib/socket.py", "readinto"), *read]) == "idle"
+    assert classify([("/site-packages/urllib3/response.py", "read"), *read]) == (
+        "stream read"
+    )
+
+
+def spin(stopped):
+    while not stopped.is_set():
+        sum(range(100))
+
+
+def test_samples_busy_threads(tmp_path):
+    stopped = threading.Event()
+    busy = threading.Thread(target=spin, args=(stopped,), name="busy")
+    idle = threading.Thread(target=stopped.wait, name="idle")
+    profiler = SamplingProfiler(interval=0.001)
+    busy.start()
+    idle.start()
+    profiler.start()
+    time.sleep(0.2)
+    profiler.stop()
+    stopped.set()
+    busy.join()
+    idle.join()
+
+    assert profiler.samples > 0
+    assert not profiler.running
+    assert any(stack.startswith("busy;") for stack in profiler.stacks)
+    assert not any(stack.startswith("idle;") for stack in profiler.stacks)
+    assert "idle" not in profiler.stages
+
+    folded, report = profiler.write(tmp_path / "profile")
+    assert folded.name == "profile.folded"
+    stack, count = folded.read_text().splitlines()[0].rsplit(" ", 1)
+    assert profiler.stacks[stack] == int(count)
+    assert report.read_text().startswith(f"{profiler.samples} samples over")
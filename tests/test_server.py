@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from hulse.client import Hulse
+from hulse.server import Producer, StreamServer
+
+from conftest import API_KEY, BlockingPipeline, FakePipeline, wait_for
+
+
+def connect(server, host_id, api_key=API_KEY, **capabilities):
+    producer = Producer(host_id, api_key, capabilities)
+    producer.connected = True
+    server.producers[host_id] = producer
+    return producer
+
+
+def test_routes_queries_to_warm_hosts_first():
+    server = StreamServer()
+    connect(server, "cold", models=[])
+    connect(server, "warm", models=["text-classification:a"], queue_depth=5)
+    assert server.route(API_KEY, "text-classification", "a").host_id == "warm"
+    assert server.route(API_KEY, "text-classification", "b").host_id == "cold"
+
+
+def test_routes_queries_to_the_least_loaded_then_fastest_host():
+    server = StreamServer()
+    models = ["summarization"]
+    busy = connect(server, "busy", models=models)
+    busy.in_flight.update(["q1", "q2"])
+    connect(server, "slow", models=models, queue_depth=1, latency={"summarization": 2})
+    connect(server, "fast", models=models, queue_depth=1, latency={"summarization": 1})
+    assert server.route(API_KEY, "summarization").host_id == "fast"
+    assert server.route(API_KEY, "summarization", exclude={"fast"}).host_id == "slow"
+
+
+def test_only_routes_queries_to_connected_hosts_of_the_account():
+    server = StreamServer()
+    connect(server, "other", api_key="other")
+    assert server.route(API_KEY, "summarization") is None
+    connect(server, "gone").connected = False
+    assert server.route(API_KEY, "summarization") is None
+
+
+def test_hosts_report_their_capabilities():
+    server = StreamServer()
+    producer = connect(server, "host")
+    client = server.app.test_client()
+    status = {"host_id": "host", "models": ["summarization"], "queue_depth": 3}
+    assert client.post("/status/", json=status).status_code == 200
+    assert producer.capabilities == status
+    assert producer.is_warm("summarization")
+    assert producer.load() == 3
+    assert client.post("/status/", json={"host_id": "unknown"}).status_code == 404
+
+
+def test_queries_rejected_by_a_busy_host_are_answered_by_another(start_host):
+    busy = BlockingPipeline()
+    # let the warm-up of the preloaded pipeline through
+    busy.released.set()
+    start_host(
+        busy,
+        preload=["text-classification:a"],
+        workers=1,
+        batch_size=1,
+        queue_size=1,
+        queue_policy="reject",
+    )
+    busy.released.clear()
+    idle = FakePipeline()
+    start_host(idle)
+
+    with Hulse(API_KEY) as client, ThreadPoolExecutor(max_workers=3) as executor:
+        answers = [
+            executor.submit(
+                client.query, text, task="text-classification", model="a", timeout=10
+            )
+            for text in ["x", "y", "z"]
+        ]
+        # the warm host can only hold two of the queries, at most one running
+        # and one queued, the others are rejected and routed to the idle host
+        wait_for(lambda: idle.calls)
+        busy.released.set()
+        results = [answer.result()["result"]["label"] for answer in answers]
+    assert results == ["x-0", "y-0", "z-0"]
+    assert len(busy.calls) + len(idle.calls) == 4
+    assert 1 <= len(idle.calls) <= 2
+
+
+def test_replays_the_unanswered_queries_a_host_missed():
+    server = StreamServer(keep_alive=0.1)
+    client = server.app.test_client()
+    url = f"/producer/{API_KEY}/?host_id=host"
+    events = iter(client.get(url, buffered=False).response)
+    assert next(events) == b": connected\n\n"
+
+    producer = server.producers["host"]
+    for qid in ["a", "b"]:
+        producer.in_flight.add(qid)
+        producer.queries.put({"qid": qid, "task": "summarization"})
+    first, second = next(events), next(events)
+    assert first.startswith(b"id: 1\n") and b'"qid": "a"' in first
+    assert second.startswith(b"id: 2\n")
+
+    # the host only received the first event before the stream dropped
+    events = client.get(url, headers={"Last-Event-ID": "1"}, buffered=False).response
+    events = iter(events)
+    assert next(events) == b": connected\n\n"
+    assert next(events) == second
+    assert producer.connection == 2
@@ -0,0 +1,93 @@
+import json
+
+from hulse.sse import Event, SSEParser, iter_events
+
+
+def parse(*chunks):
+    parser = SSEParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return events
+
+
+def test_data_events():
+    events = parse(b'data: {"qid": "a"}\n\ndata: {"qid": "b"}\n\n')
+    assert events == [Event('{"qid": "a"}'), Event('{"qid": "b"}')]
+    assert events[0].json() == {"qid": "a"}
+
+
+def test_multi_line_data():
+    assert parse(b"data: first\ndata:second\ndata\n\n") == [Event("first\nsecond\n")]
+
+
+def test_event_id_and_retry_fields():
+    parser = SSEParser()
+    events = parser.feed(b"event: token\nid: 7\nretry: 3000\ndata: x\n\n")
+    assert events == [Event("x", event="token", id="7", retry=3000)]
+    # ids and retry intervals are kept by the next events
+    assert parser.feed(b"data: y\n\n") == [Event("y", id="7", retry=3000)]
+    assert parser.feed(b"id: 8\ndata: z\n\n") == [Event("z", id="8", retry=3000)]
+    assert parser.last_event_id == "8"
+    assert parser.retry == 3000
+
+
+def test_invalid_retry_and_id_are_ignored():
+    parser = SSEParser()
+    assert parser.feed(b"id: 1\nretry: soon\ndata: x\n\n") == [Event("x", id="1")]
+    assert parser.feed(b"id: a\0b\ndata: y\n\n") == [Event("y", id="1")]
+
+
+def test_comments_and_events_without_data():
+    assert parse(b": keep-alive\n\n", b"event: ping\n\n", b": note\ndata: x\n\n") == [
+        Event("x")
+    ]
+
+
+def test_line_endings():
+    expected = [Event("a\nb"), Event("c")]
+    assert parse(b"data: a\r\ndata: b\r\n\r\ndata: c\r\n\r\n") == expected
+    assert parse(b"data: a\rdata: b\r\rdata: c\r\r") == expected
+
+
+def test_crlf_split_across_chunks():
+    assert parse(b"data: a\r", b"\n\r", b"\ndata: b\r\n\r", b"", b"\n") == [
+        Event("a"),
+        Event("b"),
+    ]
+    # a CR ends its line without waiting for the next chunk
+    parser = SSEParser()
+    assert parser.feed(b"data: a\r\r") == [Event("a")]
+    assert parser.feed(b"\ndata: b\n\n") == [Event("b")]
+
+
+def test_events_split_across_chunks():
+    payload = 'id: 3\ndata: {"result": "été"}\n\n: keep-alive\n\ndata: x\ndata: y\n\n'
+    stream = b"\xef\xbb\xbf" + payload.encode()
+    expected = parse(stream)
+    assert expected == [Event('{"result": "été"}', id="3"), Event("x\ny", id="3")]
+    # fed one byte at a time, splitting lines and multibyte characters
+    assert parse(*(stream[i : i + 1] for i in range(len(stream)))) == expected
+
+
+def test_incomplete_event_is_not_dispatched():
+    parser = SSEParser()
+    assert parser.feed(b"data: x\n") == []
+    assert parser.feed(b"\n") == [Event("x")]
+
+
+def test_large_event():
+    data = json.dumps({"result": "x" * 100000})
+    chunks = [f"data: {data}\n\n".encode()[i : i + 512] for i in range(0, 100010, 512)]
+    assert list(iter_events(chunks)) == [Event(data)]
+
+
+def test_json_data():
+    assert Event('{"qid": "a", "result": [1, 2.5]}').json() == {
+        "qid": "a",
+        "result": [1, 2.5],
+    }
+    assert Event(' {"qid": "a"}\t').json() == {"qid": "a"}
+    assert Event('"text"').json() == "text"
+    for data in ["", "keep-alive", '{"qid": ', '{"qid": "a"} {}']:
+        assert Event(data).json() is None
@@ -0,0 +1,63 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from hulse import producer
+from hulse.client import Hulse
+from hulse.producer import TokenStream
+
+from conftest import API_KEY, wait_for
+
+
+def test_posts_tokens_in_order_then_the_final_answer():
+    posts = []
+    posting = threading.Event()
+    released = threading.Event()
+
+    def post_partial(seq, text):
+        posting.set()
+        released.wait(5)
+        posts.append((seq, text))
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        stream = TokenStream(post_partial, executor)
+        stream.put("Once")
+        posting.wait(5)
+        # accumulated while the first post is in flight
+        stream.put(" upon")
+        stream.put(" a time")
+        stream.finish(lambda seq: posts.append((seq, "final")))
+        released.set()
+        wait_for(lambda: len(posts) == 3)
+    assert posts == [(0, "Once"), (1, " upon a time"), (2, "final")]
+
+
+class GenerationPipeline:
+    """Text generation pipeline streaming a fixed continuation of its prompt."""
+
+    tokenizer = None
+
+    def __init__(self):
+        self.streamed = []
+
+    def __call__(self, prompt, streamer=None, **kwargs):
+        self.streamed.append(streamer is not None)
+        tokens = [" upon", " a", " time"]
+        for token in tokens:
+            if streamer is not None:
+                streamer(token)
+        return [{"generated_text": "".join(tokens)}]
+
+
+def test_streams_generated_text_to_the_consumer(start_host, monkeypatch):
+    # stands in for the transformers streamer, calling back with each token
+    monkeypatch.setattr(producer, "make_streamer", lambda tokenizer, on_text: on_text)
+    pipeline = GenerationPipeline()
+    start_host(pipeline)
+    with Hulse(API_KEY) as client:
+        chunks = list(client.stream_query("Once", timeout=5, max_new_tokens=3))
+        assert "".join(chunks) == " upon a time"
+
+        # non-streaming queries of the same pipeline get the whole text at once
+        answer = client.query("Once", task="text-generation", timeout=5)
+        assert answer["result"] == {"generated_text": " upon a time"}
+    assert pipeline.streamed == [True, False]
@@ -0,0 +1,70 @@
+import socket
+import time
+
+import pytest
+
+from hulse import errors, settings, utils
+from hulse.client import Hulse
+
+from conftest import API_KEY, BlockingPipeline, wait_for
+
+
+def test_localizes_the_time_budget_of_received_queries():
+    query = {"qid": "a", "timeout": 10}
+    localized = utils.localize_deadline(query)
+    assert "timeout" not in localized
+    assert 9 < localized["deadline"] - time.monotonic() <= 10
+    assert not utils.is_expired(localized)
+    assert query == {"qid": "a", "timeout": 10}
+
+    assert utils.is_expired(utils.localize_deadline({"timeout": 0}))
+    assert utils.localize_deadline({"qid": "a"})["deadline"] is None
+    assert not utils.is_expired(utils.localize_deadline({"qid": "a"}))
+
+
+def test_raises_when_the_result_does_not_come_in_time(start_host):
+    pipeline = BlockingPipeline()
+    start_host(pipeline)
+    with Hulse(API_KEY) as client:
+        start = time.monotonic()
+        with pytest.raises(errors.QueryTimeoutError) as e:
+            client.query("hi", task="text-classification", timeout=0.5)
+    assert e.value.stage == "result"
+    assert time.monotonic() - start < 2
+    pipeline.released.set()
+
+
+def test_raises_when_the_server_does_not_respond(monkeypatch):
+    # accepts connections, but never answers
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        monkeypatch.setattr(
+            settings,
+            "HULSE_STREAM_URL",
+            "http://127.0.0.1:%d/" % server.getsockname()[1],
+        )
+        with Hulse(API_KEY, retries=0) as client:
+            with pytest.raises(errors.QueryTimeoutError) as e:
+                client.query(
+                    "hi", task="text-classification", timeout=5, first_byte_timeout=0.2
+                )
+    assert e.value.stage == "first byte"
+
+
+def test_hosts_drop_queries_past_their_deadline(start_host):
+    pipeline = BlockingPipeline()
+    host = start_host(pipeline, workers=1, batch_size=1)
+    query = {"task": "text-classification", "model": None}
+
+    host.submit(dict(query, qid="expired", data="expired", timeout=0))
+    assert host.expired == 1
+
+    # queued behind a running query, until its consumer gave up
+    host.submit(dict(query, qid="running", data="running", timeout=10))
+    wait_for(lambda: pipeline.calls)
+    host.submit(dict(query, qid="queued", data="queued", timeout=0.2))
+    time.sleep(0.3)
+    pipeline.released.set()
+    wait_for(lambda: host.expired == 2)
+    assert [inputs for inputs, _ in pipeline.calls] == ["running"]
@@ -0,0 +1,79 @@
+from hulse import tracing
+from hulse.client import Hulse
+
+from conftest import API_KEY
+
+
+def test_sums_the_durations_of_each_stage_from_the_longest():
+    trace = {
+        "trace_id": "t",
+        "spans": [
+            tracing.make_span("inference", 10.0, 10.5),
+            tracing.make_span("host.queue", 9.0, 10.0),
+            tracing.make_span("inference", 11.0, 11.75),
+            # still running, without duration
+            tracing.make_span("result.post", 12.0),
+        ],
+    }
+    assert tracing.breakdown(trace) == {"inference": 1.25, "host.queue": 1.0}
+    assert list(tracing.breakdown(trace)) == ["inference", "host.queue"]
+    assert tracing.breakdown({}) == {}
+
+
+def test_merges_the_spans_of_the_answer_into_the_trace():
+    trace = tracing.Trace()
+    trace.add("client.send", trace.start)
+    answer = {
+        "result": "ok",
+        "trace": {
+            "trace_id": trace.trace_id,
+            "spans": [tracing.make_span("result.post", trace.start)],
+        },
+    }
+    spans = trace.finish(answer)["trace"]["spans"]
+    names = [span["name"] for span in spans]
+    assert sorted(names) == sorted(
+        ["client.send", "result.post", "client.receive", "client.query"]
+    )
+    # spans running when the answer was sent end once it is received
+    assert all(span["end"] is not None for span in spans)
+    assert spans == sorted(spans, key=lambda span: span["start"])
+
+    # spans of other traces are ignored
+    other = tracing.Trace().finish(dict(answer))
+    assert "result.post" not in [span["name"] for span in other["trace"]["spans"]]
+
+
+def test_exports_finished_traces():
+    exported = []
+
+    class Exporter:
+        def export(self, trace):
+            exported.append(trace.trace_id)
+
+    tracing.set_exporter(Exporter())
+    try:
+        trace = tracing.Trace()
+        trace.finish({"result": "ok"})
+    finally:
+        tracing.set_exporter(None)
+    assert exported == [trace.trace_id]
+
+
+def test_answers_carry_the_spans_of_every_stage(start_host):
+    start_host()
+    with Hulse(API_KEY) as client:
+        answer = client.query("hi", task="text-classification", timeout=5)
+    names = {span["name"] for span in answer["trace"]["spans"]}
+    assert {
+        "client.query",
+        "client.send",
+        "server.queue",
+        "host.queue",
+        "pipeline.acquire",
+        "inference",
+        "result.post",
+        "client.wait",
+        "client.receive",
+    } <= names
+    assert set(tracing.breakdown(answer["trace"])) == names